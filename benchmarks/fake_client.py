@@ -0,0 +1,46 @@
+"""
+Fake LLM Client
+Deterministic stand-in for the OpenAI client that answers from a known TOC and reference list.
+"""
+
+import json
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+
+class FakeClient:
+    """
+    Answers chat completion requests the way the pipeline expects, without a network.
+
+    TOC passes get the whole TOC (so generation stops after the second pass),
+    delta passes get no insertions, scheme-level requests get no levels, and
+    cross-reference requests get the known references. Usage is reported with
+    prompt tokens estimated from the request size.
+    """
+
+    def __init__(self, toc_md: str, refs: Optional[List[Dict]] = None):
+        self.toc_md = toc_md
+        self.refs = refs or []
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def reply(self, messages: List[Dict], json_mode: bool) -> str:
+        instructions = messages[-1]["content"]
+        if not json_mode:
+            return self.toc_md
+        if '"insertions"' in instructions:
+            return json.dumps({"insertions": []})
+        if '"levels"' in instructions:
+            return json.dumps({"levels": {}})
+        return json.dumps({"refs": self.refs})
+
+    def create(self, model: str, messages: List[Dict], response_format: Optional[Dict] = None, **params):
+        self.calls += 1
+        json_mode = bool(response_format) and response_format.get("type") == "json_object"
+        content = self.reply(messages, json_mode)
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(content) // 4,
+                                total_tokens=prompt_tokens + len(content) // 4,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=0))
+        choice = SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")
+        return SimpleNamespace(choices=[choice], usage=usage)
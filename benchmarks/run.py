@@ -0,0 +1,238 @@
+"""
+Benchmark Runner
+Times the local pipeline stages on synthetic documents and the EU example, offline.
+
+Usage (from the repository root):
+    python -m benchmarks.run                     # run and compare with a stored baseline, if any
+    python -m benchmarks.run --sizes 100 1000    # choose the synthetic document sizes
+    python -m benchmarks.run --save-baseline     # store this run as the local baseline
+    python -m benchmarks.run --check             # exit with status 1 on a scaling regression
+
+Besides each stage's time, the runner reports how it scales: the ratio of its
+times between consecutive synthetic sizes and the exponent that implies. The
+check compares these ratios, which carry over between machines, rather than
+the times, which do not; the baseline is kept locally and not committed.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from src.cross_reference_analyzer import analyse_references, collect_all_refs
+from src.header_ids import add_header_ids
+from src.main import get_smallest_chunks
+from src.section_tagger import locate_sections, render_tagged_text
+
+from .fake_client import FakeClient
+from .synthetic import generate_document
+
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+EU_DOCUMENT = ROOT / "examples" / "EU_document.txt"
+EU_TOC = ROOT / "out" / "EU_document_toc.md"
+
+DEFAULT_SIZES = [100, 300, 1000]
+
+# A stage whose time grows this many times more between two sizes than in the baseline counts as a regression
+REGRESSION_RATIO = 1.5
+# Without a baseline, a stage whose time grows faster than the size to this power counts as a regression
+MAX_SCALING_EXPONENT = 1.5
+# Stages taking less than this many seconds at the larger size are noise, whatever the ratio
+MIN_REGRESSION_S = 0.02
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Best wall time over repeat runs, then the peak traced memory of one more run."""
+    best = float("inf")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {"time_s": round(best, 5), "peak_mb": round(peak / (1024 * 1024), 2)}
+
+
+def bench_case(name: str, text: str, toc_md: str, refs: List[Dict], repeat: int) -> Dict[str, Any]:
+    """Run every local stage on one document and collect timings, memory and throughput."""
+    toc_ids, _ = add_header_ids(toc_md)
+    client = FakeClient(toc_md, refs)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sections = locate_sections(toc_ids, text, monotonic=True)
+        tagged_text = render_tagged_text(text, sections)
+        levels_info = analyse_references(toc_ids, tagged_text, client, sections)
+
+    stages = {
+        "tag_sections": measure(lambda: render_tagged_text(text, locate_sections(toc_ids, text, monotonic=True)), repeat),
+        "get_smallest_chunks": measure(lambda: get_smallest_chunks(tagged_text, toc_ids, sections), repeat),
+        "analyse_references": measure(
+            lambda: analyse_references(toc_ids, tagged_text, client, sections), repeat),
+        "collect_all_refs": measure(lambda: collect_all_refs(levels_info, tagged_text, sections), repeat),
+    }
+    total = sum(stage["time_s"] for stage in stages.values())
+    return {
+        "case": name,
+        "sections": sum(1 for line in toc_md.splitlines() if line.lstrip().startswith("#")),
+        "located": sum(1 for span in sections if not span.id.startswith("auto-")),
+        "chars": len(text),
+        "stages": stages,
+        "total_s": round(total, 5),
+        "sections_per_s": round(len(sections) / total) if total else None,
+        "mb_per_s": round(len(text) / (1024 * 1024) / total, 2) if total else None,
+    }
+
+
+def run(sizes: List[int], depth: int, noise: float, repeat: int, include_eu: bool) -> List[Dict[str, Any]]:
+    """Benchmark synthetic documents of each size, then the EU example."""
+    results = []
+    for size in sizes:
+        doc = generate_document(sections=size, depth=depth, noise=noise)
+        results.append(bench_case(f"synthetic-{size}", doc.text, doc.toc_md, doc.refs, repeat))
+        print_case(results[-1])
+
+    if include_eu and EU_DOCUMENT.exists() and EU_TOC.exists():
+        text = EU_DOCUMENT.read_text(encoding="utf-8")
+        results.append(bench_case("eu-document", text, EU_TOC.read_text(encoding="utf-8"), [], repeat))
+        print_case(results[-1])
+    return results
+
+
+def print_case(result: Dict[str, Any]) -> None:
+    """Print one row per stage of a benchmark case."""
+    print(f"\n{result['case']}: {result['sections']} sections ({result['located']} located), "
+          f"{result['chars']} chars, {result['total_s']:.4f}s total, "
+          f"{result['sections_per_s']} sections/s, {result['mb_per_s']} MB/s")
+    for stage, numbers in result["stages"].items():
+        print(f"  {stage:<22} {numbers['time_s']:>9.4f}s {numbers['peak_mb']:>9.2f} MB")
+
+
+def scaling(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Time ratio of each stage between consecutive synthetic sizes, with the exponent of size it implies."""
+    synthetic = [result for result in results if result["case"].startswith("synthetic-")]
+    rows = []
+    for small, large in zip(synthetic, synthetic[1:]):
+        size_ratio = large["sections"] / small["sections"]
+        for stage, numbers in large["stages"].items():
+            small_time = small["stages"].get(stage, {}).get("time_s")
+            if not small_time:
+                continue
+            time_ratio = numbers["time_s"] / small_time
+            rows.append({
+                "cases": f"{small['case']} -> {large['case']}",
+                "stage": stage,
+                "size_ratio": round(size_ratio, 3),
+                "time_ratio": round(time_ratio, 3),
+                "exponent": round(math.log(time_ratio) / math.log(size_ratio), 2) if size_ratio > 1 else None,
+                "time_s": numbers["time_s"],
+            })
+    return rows
+
+
+def print_scaling(rows: List[Dict[str, Any]]) -> None:
+    """Print the time ratio and exponent of each stage between consecutive sizes."""
+    if not rows:
+        return
+    print("\nScaling between sizes (time ratio, exponent of size):")
+    for row in rows:
+        exponent = f"n^{row['exponent']:.2f}" if row["exponent"] is not None else "-"
+        print(f"  {row['cases']:<36} {row['stage']:<22} {row['size_ratio']:>6.2f}x size "
+              f"{row['time_ratio']:>8.2f}x time  {exponent}")
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]]) -> None:
+    """Print each stage's time against the baseline, for information: times only compare on one machine."""
+    by_case = {result["case"]: result for result in baseline}
+    print("\nTimes against baseline:")
+    for result in results:
+        base = by_case.get(result["case"])
+        if base is None:
+            print(f"  {result['case']}: no baseline")
+            continue
+        for stage, numbers in result["stages"].items():
+            base_time = base["stages"].get(stage, {}).get("time_s")
+            if not base_time:
+                continue
+            print(f"  {result['case']:<16} {stage:<22} {base_time:>9.4f}s -> {numbers['time_s']:>9.4f}s "
+                  f"({numbers['time_s'] / base_time:.2f}x)")
+
+
+def check_scaling(rows: List[Dict[str, Any]], baseline: List[Dict[str, Any]]) -> List[str]:
+    """
+    Return the stages whose scaling regressed: their time ratio between two sizes
+    grew REGRESSION_RATIO times over the baseline's, or, without a baseline for
+    them, implies an exponent above MAX_SCALING_EXPONENT.
+    """
+    by_key = {(row["cases"], row["stage"]): row for row in baseline}
+    regressions = []
+    for row in rows:
+        if row["time_s"] < MIN_REGRESSION_S:
+            continue
+        base = by_key.get((row["cases"], row["stage"]))
+        if base is not None:
+            regressed = row["time_ratio"] > base["time_ratio"] * REGRESSION_RATIO
+        else:
+            regressed = row["exponent"] is not None and row["exponent"] > MAX_SCALING_EXPONENT
+        if regressed:
+            regressions.append(f"{row['cases']}/{row['stage']}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the local pipeline stages offline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Section counts of the synthetic documents")
+    parser.add_argument("--depth", type=int, default=3, help="Heading depth of the synthetic documents")
+    parser.add_argument("--noise", type=float, default=0.1, help="Share of perturbed snippets and lines")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the best time is kept")
+    parser.add_argument("--no-eu", action="store_true", help="Skip the EU example document")
+    parser.add_argument("--output", "-o", help="Also write the results to this JSON file")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help="Baseline JSON file, kept locally")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the baseline")
+    parser.add_argument("--check", action="store_true",
+                        help="Exit with status 1 if any stage scales worse than the baseline or superlinearly")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.depth, args.noise, args.repeat, not args.no_eu)
+    rows = scaling(results)
+    print_scaling(rows)
+    report = {"cases": results, "scaling": rows}
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"\nSaved baseline to: {baseline_path}")
+        return 0
+
+    baseline = {"cases": [], "scaling": []}
+    if baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        compare(results, baseline["cases"])
+    else:
+        print(f"\nNo baseline at {baseline_path}; checking scaling exponents against {MAX_SCALING_EXPONENT}")
+
+    regressions = check_scaling(rows, baseline["scaling"])
+    if regressions:
+        print(f"\n{len(regressions)} scaling regressions: {', '.join(regressions)}")
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Synthetic Documents
+Generates hierarchical legal-style documents together with their TOC and cross-references.
+"""
+
+import random
+from typing import Dict, List
+
+
+# Heading kind for each level; numbering runs through the whole document for every kind
+LEVEL_KINDS = ["PART", "CHAPTER", "Section", "Article", "Paragraph", "Point"]
+
+VOCABULARY = (
+    "controller processor data subject personal processing shall may where purpose lawful consent "
+    "authority member state union regulation provision measure rights information request period "
+    "without undue delay appropriate safeguards technical organisational security breach notify "
+    "record activity transfer third country international organisation supervisory competent court "
+    "remedy penalty fine application scope territorial material definition principle transparency "
+    "accuracy limitation integrity confidentiality accountability legitimate interest public task"
+).split()
+
+
+class SyntheticDocument:
+    """
+    A generated document with its TOC and reference ground truth.
+
+    Attributes:
+        text: Document text
+        toc_md: TOC in the format generate_toc returns (headers and quoted snippets, no IDs)
+        levels: Level of each section, in TOC order
+        refs: Cross-references in the {"from", "to"} form of analyse_references,
+            using the hN IDs that add_header_ids assigns
+    """
+
+    def __init__(self, text: str, toc_md: str, levels: List[int], refs: List[Dict]):
+        self.text = text
+        self.toc_md = toc_md
+        self.levels = levels
+        self.refs = refs
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+
+def generate_levels(sections: int, depth: int, rng: random.Random) -> List[int]:
+    """Random section levels in document order, starting at 1 and never skipping a level going down."""
+    levels = [1]
+    while len(levels) < sections:
+        level = levels[-1]
+        roll = rng.random()
+        if level < depth and roll < 0.55:
+            levels.append(level + 1)
+        elif level > 1 and roll > 0.8:
+            levels.append(rng.randint(1, level - 1))
+        else:
+            levels.append(level)
+    return levels
+
+
+def generate_document(sections: int = 200, depth: int = 3, words_per_section: int = 120,
+                      noise: float = 0.1, refs_per_section: float = 0.5, seed: int = 0) -> SyntheticDocument:
+    """
+    Generate a synthetic document.
+
+    Args:
+        sections: Number of sections (TOC entries)
+        depth: Deepest heading level (at most 6)
+        words_per_section: Body words of each leaf section; parents get a short preamble
+        noise: Share of TOC snippets with one word changed (exercising fuzzy matching),
+            and of body lines with doubled spaces and stray line breaks
+        refs_per_section: Average number of references to other Articles per leaf
+        seed: Random seed; the same arguments always give the same document
+    """
+    rng = random.Random(seed)
+    depth = max(1, min(depth, len(LEVEL_KINDS)))
+    levels = generate_levels(sections, depth, rng)
+    # Keep "Article" as the deepest kind where the depth allows, as in most legal texts
+    first_kind = max(0, LEVEL_KINDS.index("Article") + 1 - depth)
+    kinds = LEVEL_KINDS[first_kind:first_kind + depth]
+
+    counters: Dict[str, int] = {}
+    titles = []
+    for level in levels:
+        kind = kinds[level - 1]
+        counters[kind] = counters.get(kind, 0) + 1
+        titles.append(f"{kind} {counters[kind]}")
+
+    is_leaf = [i + 1 >= len(levels) or levels[i + 1] <= levels[i] for i in range(len(levels))]
+    targets = [i for i, title in enumerate(titles) if title.startswith("Article")] or list(range(len(titles)))
+
+    def words(count: int) -> List[str]:
+        return [rng.choice(VOCABULARY) for _ in range(count)]
+
+    lines = ["PREAMBLE", " ".join(words(60)), ""]
+    toc_lines = []
+    refs = []
+    for i, (level, title) in enumerate(zip(levels, titles)):
+        heading_words = words(rng.randint(3, 6))
+        heading_words[0] = heading_words[0].capitalize()
+        body = words(words_per_section if is_leaf[i] else max(10, words_per_section // 8))
+
+        section_refs = []
+        if is_leaf[i]:
+            for _ in range(int(refs_per_section) + (rng.random() < refs_per_section % 1)):
+                target = rng.choice(targets)
+                if target != i:
+                    pos = rng.randrange(len(body))
+                    body[pos:pos] = ["as", "referred", "to", "in", titles[target] + ","]
+                    if f"h{target + 1}" not in section_refs:
+                        section_refs.append(f"h{target + 1}")
+        if section_refs:
+            refs.append({"from": f"h{i + 1}", "to": section_refs})
+
+        body_text = " ".join(body) + "."
+        if rng.random() < noise:
+            body_text = body_text.replace(" ", "  ", 3).replace(" ", "\n", 1)
+        lines.extend([title, " ".join(heading_words), body_text, ""])
+
+        snippet = (heading_words + body)[:13]
+        if rng.random() < noise:
+            snippet[rng.randrange(1, len(snippet))] = rng.choice(VOCABULARY)
+        toc_lines.append(f"{'#' * level} {title}")
+        toc_lines.append('"' + " ".join(snippet) + '"')
+
+    return SyntheticDocument("\n".join(lines), "\n".join(toc_lines), levels, refs)
@@ -25,7 +25,9 @@ from pathlib import Path
 PROJECT_ROOT = Path(__file__).resolve().parents[1]   # one level up from /examples
 sys.path.insert(0, str(PROJECT_ROOT))
 
+from src.checkpoints import STAGES
 from src.main import analyze_document
+from src.incremental import update_analysis
 
 
 def main() -> None:
@@ -48,6 +50,94 @@ def main() -> None:
         default=2,
         help="Maximum LLM passes when generating the TOC"
     )
+    parser.add_argument(
+        "--cache-dir", "-c",
+        default=None,
+        help="Directory for a persistent cache of LLM responses (reruns skip unchanged calls)"
+    )
+    parser.add_argument(
+        "--concurrent-toc",
+        action="store_true",
+        help="Expand top-level TOC sections concurrently after the first pass"
+    )
+    parser.add_argument(
+        "--delta-toc",
+        action="store_true",
+        help="Have TOC passes after the first return only the new headings"
+    )
+    parser.add_argument(
+        "--stream-toc",
+        action="store_true",
+        help="Stream TOC passes, parsing headings as they arrive"
+    )
+    parser.add_argument(
+        "--no-monotonic-tagging",
+        dest="monotonic_tagging",
+        action="store_false",
+        help="Locate each section from the top of the document instead of in TOC order"
+    )
+    parser.add_argument(
+        "--ref-shard-tokens",
+        type=int,
+        default=None,
+        help="Cross-reference in concurrent shards of about this many tokens of text"
+    )
+    parser.add_argument(
+        "--local-refs",
+        action="store_true",
+        help="Extract cross-references with patterns, using the LLM only for unresolved ones"
+    )
+    parser.add_argument(
+        "--heuristic-toc",
+        action="store_true",
+        help="Build the TOC from numbered headings found locally, skipping LLM passes; "
+             "the other TOC options only apply when none are found"
+    )
+    parser.add_argument(
+        "--compact-prompts",
+        action="store_true",
+        help="Use short section markers and drop TOC snippets in cross-reference prompts"
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Write per-stage timings, token usage and cost to a JSON trace file"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the local stages with cProfile and tracemalloc, in the process that runs each stage"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Reuse the stages an earlier run in the output directory completed with the same inputs"
+    )
+    parser.add_argument(
+        "--force-stage",
+        action="append",
+        choices=STAGES,
+        default=None,
+        help="Recompute this stage even when resuming (repeatable)"
+    )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        default=None,
+        help="Keep LLM calls within this many requests per minute"
+    )
+    parser.add_argument(
+        "--tokens-per-minute",
+        type=float,
+        default=None,
+        help="Keep LLM calls within this many tokens per minute"
+    )
+    parser.add_argument(
+        "--update-from",
+        default=None,
+        help="Output directory of a previous run; only re-analyze what the amended document changed, "
+             "writing the updated analysis to --output, which must be a different directory"
+    )
     parser.add_argument(
         "--api-key", "-k",
         default=os.getenv("OPENAI_API_KEY"),
@@ -58,11 +148,42 @@ def main() -> None:
     if not args.api_key:
         parser.error("No API key supplied.  Pass --api-key or set OPENAI_API_KEY.")
 
+    if args.update_from:
+        result = update_analysis(
+            document_path=args.document,
+            previous_dir=args.update_from,
+            api_key=args.api_key,
+            output_dir=args.output,
+            cache_dir=args.cache_dir,
+            ref_shard_tokens=args.ref_shard_tokens,
+            compact_prompts=args.compact_prompts,
+            monotonic_tagging=args.monotonic_tagging,
+            trace=args.trace,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute
+        )
+        return
+
     result = analyze_document(
         document_path=args.document,
         api_key=args.api_key,
         output_dir=args.output,
-        max_passes=args.max_passes
+        max_passes=args.max_passes,
+        cache_dir=args.cache_dir,
+        concurrent_toc=args.concurrent_toc,
+        delta_toc=args.delta_toc,
+        ref_shard_tokens=args.ref_shard_tokens,
+        local_refs=args.local_refs,
+        heuristic_toc=args.heuristic_toc,
+        compact_prompts=args.compact_prompts,
+        trace=args.trace,
+        profile=args.profile,
+        resume=args.resume,
+        force_stages=args.force_stage,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        stream_toc=args.stream_toc,
+        monotonic_tagging=args.monotonic_tagging
     )
 
 
@@ -0,0 +1,173 @@
+"""
+Batch Module
+Analyzes many documents with one shared client, one request scheduler and a process pool.
+"""
+
+import json
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from openai import OpenAI
+
+from .main import analyze_document
+from .scheduler import RequestScheduler
+
+
+def find_documents(source: str, pattern: str = "*.txt") -> List[Path]:
+    """
+    Documents to analyze: the files matching pattern in a directory, or those
+    listed in a manifest file (a JSON list of paths, or one path per line with
+    # comments). Relative paths in a manifest are relative to the manifest.
+    """
+    source_path = Path(source)
+    if source_path.is_dir():
+        return sorted(path for path in source_path.glob(pattern) if path.is_file())
+    if not source_path.exists():
+        raise FileNotFoundError(f"Batch source not found: {source}")
+
+    text = source_path.read_text(encoding="utf-8")
+    if source_path.suffix == ".json":
+        entries = json.loads(text)
+    else:
+        entries = [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+    return [path if path.is_absolute() else source_path.parent / path for path in map(Path, entries)]
+
+
+def analyze_one(path: Path, api_key: str, output_path: Path, client: Any, scheduler: RequestScheduler,
+                local_pool: Executor, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Analyze one document of a batch and return its summary record, also when it fails."""
+    record: Dict[str, Any] = {"document": str(path), "output_dir": str(output_path / path.stem)}
+    start = time.perf_counter()
+    try:
+        result = analyze_document(str(path), api_key, str(output_path / path.stem), client=client,
+                                  scheduler=scheduler, local_executor=local_pool, **options)
+    except Exception as error:
+        record.update(status="failed", error=f"{type(error).__name__}: {error}",
+                      traceback=traceback.format_exc())
+        print(f"Failed: {path}: {record['error']}")
+    else:
+        totals = result["telemetry"]["totals"]
+        record.update(status="ok", sections=len(result["sections"]), llm_calls=totals["llm_calls"],
+                      prompt_tokens=totals["prompt_tokens"], cached_tokens=totals["cached_tokens"],
+                      completion_tokens=totals["completion_tokens"], cost_usd=totals["cost_usd"])
+    record["wall_s"] = round(time.perf_counter() - start, 3)
+    record["bytes"] = path.stat().st_size if path.exists() else 0
+    return record
+
+
+def run_batch(source: str, api_key: str, output_dir: str, pattern: str = "*.txt",
+              max_documents: int = 4, max_llm_calls: int = 8, processes: Optional[int] = None,
+              requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+              **options: Any) -> Dict[str, Any]:
+    """
+    Analyze every document of a directory or manifest.
+
+    Up to max_documents documents are analyzed at once, so one document's LLM
+    calls overlap with another's. All calls share one OpenAI client, and so
+    its connection pool, and go through one RequestScheduler, which bounds the
+    calls in flight and keeps them within the rate limits across documents.
+    Tagging and chunking run in a pool of processes so that they use more
+    than one core. The workers are spawned rather than forked, as forking
+    while the document threads hold locks could deadlock them, so a script
+    calling run_batch needs an if __name__ == "__main__" guard. A failing
+    document is recorded and the others carry on.
+
+    Args:
+        source: Directory of documents or manifest file (see find_documents)
+        api_key: OpenAI API key
+        output_dir: Directory to write each document's outputs to, in a
+            subdirectory named after the document, and batch_summary.json
+        pattern: File pattern of the documents in a source directory
+        max_documents: Documents analyzed concurrently
+        max_llm_calls: LLM calls in flight at once across all documents
+        processes: Worker processes for tagging and chunking (default: CPU count)
+        requests_per_minute: Request rate limit shared by all documents
+        tokens_per_minute: Token rate limit shared by all documents
+        **options: Further arguments for analyze_document, e.g. cache_dir or resume
+
+    Returns:
+        The batch summary: one record per document and the totals
+    """
+    documents = find_documents(source, pattern)
+    stems = [path.stem for path in documents]
+    duplicates = sorted({stem for stem in stems if stems.count(stem) > 1})
+    if duplicates:
+        raise ValueError(f"Documents must have distinct names, found several of: {', '.join(duplicates)}")
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    # Retries are left to the request scheduler, which knows the rate limits
+    client = OpenAI(api_key=api_key, max_retries=0)
+    scheduler = RequestScheduler(requests_per_minute, tokens_per_minute, max_concurrent=max_llm_calls)
+    print(f"Analyzing {len(documents)} documents, {max_documents} at a time, "
+          f"at most {max_llm_calls} LLM calls in flight")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as local_pool, \
+            ThreadPoolExecutor(max_workers=max_documents) as document_pool:
+        records = list(document_pool.map(
+            lambda path: analyze_one(path, api_key, output_path, client, scheduler, local_pool, options),
+            documents))
+    wall_s = time.perf_counter() - start
+
+    done = [record for record in records if record["status"] == "ok"]
+    totals = {
+        "documents": len(records),
+        "succeeded": len(done),
+        "failed": len(records) - len(done),
+        "wall_s": round(wall_s, 3),
+        "documents_per_min": round(len(done) / wall_s * 60, 2) if wall_s else None,
+        "mb_per_s": round(sum(r["bytes"] for r in done) / (1024 * 1024) / wall_s, 4) if wall_s else None,
+        "llm_calls": sum(r["llm_calls"] for r in done),
+        "llm_retries": scheduler.retries,
+        "prompt_tokens": sum(r["prompt_tokens"] for r in done),
+        "cached_tokens": sum(r["cached_tokens"] for r in done),
+        "completion_tokens": sum(r["completion_tokens"] for r in done),
+        "cost_usd": round(sum(r["cost_usd"] for r in done), 6),
+    }
+    summary = {"totals": totals, "documents": records}
+    summary_path = output_path / "batch_summary.json"
+    summary_path.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+    print(f"\nBatch done in {wall_s:.1f}s: {len(done)}/{len(records)} documents "
+          f"({totals['documents_per_min']} per minute, {totals['mb_per_s']} MB/s), "
+          f"{totals['llm_calls']} LLM calls, ~${totals['cost_usd']:.4f}")
+    for record in records:
+        if record["status"] != "ok":
+            print(f"  failed: {record['document']}: {record['error']}")
+    print(f"Saved batch summary to: {summary_path}")
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run cross-reference analysis on many documents")
+    parser.add_argument("source", help="Directory of documents, or a manifest file listing them")
+    parser.add_argument("--api-key", "-k", required=True, help="Your OpenAI API key")
+    parser.add_argument("--output-dir", "-o", required=True,
+                        help="Where to write each document's outputs and the batch summary")
+    parser.add_argument("--pattern", default="*.txt", help="File pattern of the documents in a directory")
+    parser.add_argument("--max-documents", type=int, default=4, help="Documents analyzed concurrently")
+    parser.add_argument("--max-llm-calls", type=int, default=8,
+                        help="LLM calls in flight at once across all documents")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Worker processes for tagging and chunking (default: CPU count)")
+    parser.add_argument("--requests-per-minute", type=float, default=None,
+                        help="Request rate limit shared by all documents")
+    parser.add_argument("--tokens-per-minute", type=float, default=None,
+                        help="Token rate limit shared by all documents")
+    parser.add_argument("--cache-dir", "-c", default=None, help="Directory for a persistent cache of LLM responses")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reuse the stages earlier runs completed for unchanged documents")
+    args = parser.parse_args()
+
+    summary = run_batch(args.source, args.api_key, args.output_dir, pattern=args.pattern,
+                        max_documents=args.max_documents, max_llm_calls=args.max_llm_calls,
+                        processes=args.processes, requests_per_minute=args.requests_per_minute,
+                        tokens_per_minute=args.tokens_per_minute, cache_dir=args.cache_dir, resume=args.resume)
+    raise SystemExit(1 if summary["totals"]["failed"] else 0)
@@ -0,0 +1,122 @@
+"""
+Checkpoints Module
+Manifest of the stages of a run, so an interrupted or repeated run can reuse their outputs.
+"""
+
+import hashlib
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+
+# Stages of analyze_document that are checkpointed, in pipeline order
+STAGES = ["toc", "tagging", "chunking", "cross_references", "collect_refs"]
+
+
+def content_hash(data: Union[str, bytes]) -> str:
+    """SHA-256 of a text or of raw bytes."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path: Path) -> str:
+    """SHA-256 of a file's contents."""
+    return content_hash(path.read_bytes())
+
+
+class RunManifest:
+    """
+    Record of which stage outputs in an output directory are complete and what produced them.
+
+    Each stage is keyed by a hash of its parameters and of the hashes of its
+    inputs (the document or earlier stages' outputs), so a stage is only reused
+    when nothing it depends on changed; a stage rerun after an earlier one
+    changed its output is stale, while one whose inputs came out identical is
+    still reused. The hashes of the output files are stored too, so outputs
+    edited or deleted since are recomputed. A stage that raised is recorded as
+    failed and recomputed on the next run. The manifest is rewritten after
+    every stage, so it is current even when the run is interrupted.
+    """
+
+    def __init__(self, path: Union[str, Path], input_hash: str, enabled: bool = True,
+                 resume: bool = False, force: Optional[Iterable[str]] = None):
+        """
+        Args:
+            path: JSON file to keep the manifest in
+            input_hash: Hash of the document being analyzed
+            enabled: Whether to record the stages at all
+            resume: Whether to reuse stages the manifest records as complete and current
+            force: Stages to recompute even when current
+        """
+        self.path = Path(path)
+        self.input_hash = input_hash
+        self.enabled = enabled
+        self.resume = resume
+        self.force = set(force or [])
+        unknown = self.force - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown stages to recompute: {', '.join(sorted(unknown))}; "
+                             f"expected some of {', '.join(STAGES)}")
+
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        if enabled and self.path.exists():
+            try:
+                self.stages = json.loads(self.path.read_text(encoding="utf-8")).get("stages", {})
+            except (json.JSONDecodeError, AttributeError):
+                print(f"Warning: ignoring unreadable manifest {self.path}")
+
+    @staticmethod
+    def stage_key(params: Dict[str, Any], inputs: List[str]) -> str:
+        """Hash of a stage's parameters and input hashes."""
+        return content_hash(json.dumps({"params": params, "inputs": inputs}, sort_keys=True, default=str))
+
+    def is_current(self, stage: str, key: str) -> bool:
+        """Whether a stage can be reused: complete with this key and its output files unchanged."""
+        if not (self.enabled and self.resume) or stage in self.force:
+            return False
+        entry = self.stages.get(stage)
+        if not entry or entry.get("status") != "complete" or entry.get("key") != key:
+            return False
+        for name, expected in entry.get("outputs", {}).items():
+            path = self.path.parent / name
+            if not path.exists() or file_hash(path) != expected:
+                return False
+        return True
+
+    @contextmanager
+    def run(self, stage: str, key: str, params: Dict[str, Any], outputs: List[Path]) -> Iterator[None]:
+        """
+        Record the stage run inside the block as complete, with the hashes of its
+        output files, or as failed if the block raises.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        started = time.time()
+        try:
+            yield
+        except BaseException as error:
+            self.stages[stage] = {"status": "failed", "key": key, "params": params,
+                                  "error": f"{type(error).__name__}: {error}", "finished_at": time.time()}
+            self.save()
+            raise
+        self.stages[stage] = {
+            "status": "complete", "key": key, "params": params,
+            "outputs": {path.name: file_hash(path) for path in outputs},
+            "started_at": started, "finished_at": time.time(),
+        }
+        self.save()
+
+    def output_hash(self, stage: str, name: str) -> str:
+        """Recorded hash of one output file of a stage, for use as a later stage's input."""
+        return self.stages.get(stage, {}).get("outputs", {}).get(name, "")
+
+    def save(self) -> None:
+        """Write the manifest, stages in pipeline order."""
+        stages = {stage: self.stages[stage] for stage in STAGES if stage in self.stages}
+        self.path.write_text(json.dumps({"input_sha256": self.input_hash, "stages": stages}, indent=2),
+                             encoding="utf-8")
@@ -5,14 +5,26 @@ Analyzes documents to find cross-references between sections.
 
 import re
 import json
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 from openai import OpenAI
 
+from .llm import chat_completion, document_messages
+from .llm_cache import ResponseCache
+from .prompt_compaction import compact_tagged_text, compact_toc, restore_ref_ids, section_ids
+from .reference_extractor import find_local_refs
+from .section_index import SectionIndex, SectionSpan
+from .section_tagger import render_tagged_text
+
 
 HEADER_RE = re.compile(r'^(#{1,6})\s*(.+?)\s*\{#([^}]+)\}\s*$', re.MULTILINE)
 START_RE = re.compile(r'\[START SECTION ([^:]+): ([^\]]+)\]')
 END_RE = re.compile(r'\[END SECTION ([^:]+): ([^\]]+)\]')
 
+# Rough size of a token in characters, for sizing shards
+CHARS_PER_TOKEN = 4
+
 
 def parse_toc_md(md: str) -> Dict[str, Dict[str, Any]]:
     """Parse TOC markdown to extract header info."""
@@ -33,13 +45,27 @@ def parse_tagged_text(txt: str) -> List[Dict[str, str]]:
     return out
 
 
-def build_cross_ref_prompt(markdown_table: str, wrapped_text: str) -> str:
-    """Build prompt for GPT to find all cross-references."""
-    return f"""Analyze this legal document to find ALL cross-references between sections.
+def build_cross_ref_prompt(markdown_table: str, wrapped_text: str, part: int = 1, parts: int = 1,
+                           compact: bool = False) -> tuple[str, str]:
+    """
+    Build prompt for GPT to find all cross-references, optionally for one part of a sharded document.
+    Returns (instructions, document); the TOC goes at the end of the instructions.
+    
+    With compact=True the text is expected to use the short markers from compact_tagged_text.
+    """
+    tag_word = "markers" if compact else "tags"
+    tag_format = "⟦id⟧ and ⟦/id⟧ markers" if compact else "[START SECTION id] and [END SECTION id] tags"
+    part_note = ""
+    if parts > 1:
+        part_note = f"""
+- The tagged document above is only part {part} of {parts} of the full document. Report references FROM the sections whose text appears in this part; they may point TO any section in the table of contents
+"""
+    
+    instructions = f"""Analyze the legal document above to find ALL cross-references between sections.
 
-The document has:
-1. A table of contents in Markdown format with section titles and {{#id}} anchors
-2. The full document text where each section is wrapped with [START SECTION id] and [END SECTION id] tags
+You are given:
+1. The full document text (above) where each section is wrapped with {tag_format}
+2. A table of contents in Markdown format with section titles and {{#id}} anchors (below)
 
 Your task: Go through EVERY section and find ALL references to other sections. Look for any text that refers to another part of the document.
 
@@ -60,20 +86,22 @@ Where "from" is the section ID containing the reference, and "to" is a list of s
 Important: 
 - Check EVERY section, even if it seems to have no references
 - Include ALL references found, don't skip any
-- Use the exact section IDs from the tags (h1, h22, etc.)
+- Use the exact section IDs from the {tag_word} (h1, h22, etc.)
 - Match references to the correct section IDs using the table of contents
-
+{part_note}
 --- MARKDOWN TABLE OF CONTENTS ---
 {markdown_table}
---- END MARKDOWN TABLE OF CONTENTS ---
-
---- TAGGED DOCUMENT ---
-{wrapped_text}
---- END TAGGED DOCUMENT ---"""
+--- END MARKDOWN TABLE OF CONTENTS ---"""
+    
+    return instructions, wrapped_text
 
 
-def extract_section_text(section_id: str, tagged_text: str) -> str:
+def extract_section_text(section_id: str, tagged_text: str, sections: Optional[SectionIndex] = None) -> str:
     """Extract clean text for a specific section from the tagged document."""
+    # Section spans give the text directly, with no tags to find or strip
+    if sections is not None:
+        return sections.text(section_id)
+    
     # Pattern for [START SECTION h1: ARTICLE I] format
     start_pattern = f'\\[START SECTION {re.escape(section_id)}: [^\\]]+\\]'
     end_pattern = f'\\[END SECTION {re.escape(section_id)}: [^\\]]+\\]'
@@ -91,7 +119,143 @@ def extract_section_text(section_id: str, tagged_text: str) -> str:
     return re.sub(r'\[(?:START|END)\s+SECTION\s+[^\]]+\]', '', raw_text, flags=re.IGNORECASE).strip()
 
 
-def analyse_references(toc_md_text: str, tagged_text: str, client: OpenAI) -> List[Dict]:
+def shard_tagged_text(tagged_text: str, max_tokens: int) -> List[str]:
+    """
+    Split tagged text into consecutive shards of at most about max_tokens tokens.
+    
+    Shards are only cut just before a START tag, so each one holds whole sections
+    (or the tail of a parent plus whole subsections). A single section longer than
+    the budget becomes a shard of its own.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    cut_points = [m.start() for m in START_RE.finditer(tagged_text)] + [len(tagged_text)]
+    
+    shards = []
+    shard_start = 0
+    last_cut = 0
+    for cut in cut_points:
+        if cut - shard_start > max_chars and last_cut > shard_start:
+            shards.append(tagged_text[shard_start:last_cut])
+            shard_start = last_cut
+        last_cut = cut
+    shards.append(tagged_text[shard_start:])
+    
+    return [shard for shard in shards if shard.strip()]
+
+
+def find_shard_refs(toc_md_text: str, shard_text: str, client: OpenAI, part: int = 1, parts: int = 1,
+                    cache: Optional[ResponseCache] = None, max_retries: int = 2,
+                    compact: bool = False) -> List[Dict]:
+    """
+    Ask the LLM for the references made from the sections in one shard.
+    
+    An unparseable reply, or one that is not a JSON object with a list of
+    refs, is retried for this shard alone, at once and bypassing the cache: a
+    malformed reply says nothing about rate limits, and every retry still goes
+    through the request scheduler (see RequestScheduler), which paces requests
+    and backs off failed ones. With compact=True the shard
+    and TOC are sent in compact form (see prompt_compaction) and the IDs in the
+    reply are mapped back to section IDs.
+    """
+    if compact:
+        valid_ids = set(parse_toc_md(toc_md_text)) | set(section_ids(shard_text))
+        instructions, document = build_cross_ref_prompt(compact_toc(toc_md_text), compact_tagged_text(shard_text),
+                                                        part, parts, compact=True)
+    else:
+        instructions, document = build_cross_ref_prompt(toc_md_text, shard_text, part, parts)
+    
+    for attempt in range(max_retries + 1):
+        try:
+            content = chat_completion(
+                client,
+                cache if attempt == 0 else None,
+                model="gpt-4.1-mini",
+                messages=document_messages(document, instructions),
+                temperature=0,
+                max_tokens=32000,
+                response_format={"type": "json_object"},
+            )
+            reply = json.loads(content)
+            refs = reply.get("refs", []) if isinstance(reply, dict) else None
+            if not isinstance(refs, list):
+                raise ValueError("reply is not a JSON object with a list of refs")
+            return restore_ref_ids(refs, valid_ids) if compact else refs
+        except ValueError as e:  # includes json.JSONDecodeError
+            if attempt == max_retries:
+                raise
+            print(f"Warning: reference analysis of part {part}/{parts} failed ({e}); retrying")
+
+
+def merge_refs(shard_refs: List[List[Dict]]) -> List[Dict]:
+    """
+    Merge per-shard reference lists in shard order.
+    
+    A section reported by several shards (e.g. a parent split across them) gets the
+    union of its targets, in first-seen order, so the result is deterministic.
+    """
+    merged: Dict[str, List[str]] = {}
+    for refs in shard_refs:
+        for ref in refs:
+            if not isinstance(ref, dict) or "from" not in ref:
+                continue
+            targets = merged.setdefault(ref["from"], [])
+            for to_id in ref.get("to", []):
+                if to_id not in targets:
+                    targets.append(to_id)
+    return [{"from": from_id, "to": to_ids} for from_id, to_ids in merged.items()]
+
+
+def find_refs(toc_md_text: str, tagged_text: str, client: OpenAI,
+              cache: Optional[ResponseCache] = None,
+              shard_tokens: Optional[int] = None,
+              max_workers: int = 4,
+              compact: bool = False) -> List[Dict]:
+    """Ask the LLM for the references in tagged text, in concurrent shards if shard_tokens is given."""
+    shards = shard_tagged_text(tagged_text, shard_tokens) if shard_tokens else [tagged_text]
+    if len(shards) <= 1:
+        return find_shard_refs(toc_md_text, tagged_text, client, cache=cache, compact=compact)
+    
+    print(f"Analyzing references in {len(shards)} shards (up to {max_workers} at a time)")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, find_shard_refs, toc_md_text, shard, client,
+                                   i + 1, len(shards), cache, compact=compact)
+                   for i, shard in enumerate(shards)]
+        return merge_refs([future.result() for future in futures])
+
+
+def escalation_text(index: SectionIndex, section_ids: List[str]) -> str:
+    """
+    Tagged text of the given sections, for asking the LLM about them alone.
+    
+    A section inside another given section is sent once, as part of it; each
+    block is rendered with render_tagged_text and keeps the tags of every
+    section nested in it, so references are attributed as in the full text.
+    """
+    wanted = set(section_ids)
+    blocks = []
+    covered_end = -1
+    for i, block in enumerate(index.spans):
+        if block.id not in wanted or block.start < covered_end:
+            continue
+        covered_end = block.end
+        nested = []
+        for span in index.spans[i:]:
+            if span.start >= block.end and span is not block:
+                break
+            if span.end <= block.end:
+                nested.append(SectionSpan(span.id, span.title, span.level, span.start - block.start,
+                                          span.end - block.start, span.parent))
+        blocks.append(render_tagged_text(index.source[block.start:block.end], nested))
+    return "\n".join(blocks)
+
+
+def analyse_references(toc_md_text: str, tagged_text: str, client: OpenAI,
+                       sections: Optional[SectionIndex] = None,
+                       cache: Optional[ResponseCache] = None,
+                       shard_tokens: Optional[int] = None,
+                       max_workers: int = 4,
+                       local: bool = False,
+                       compact: bool = False) -> List[Dict]:
     """
     Analyze document to find all cross-references.
     
@@ -99,25 +263,53 @@ def analyse_references(toc_md_text: str, tagged_text: str, client: OpenAI) -> Li
         toc_md_text: Markdown TOC with header IDs
         tagged_text: Document text with section tags
         client: OpenAI client instance
+        sections: Optional section spans from locate_sections, used for section text
+            and local extraction; rebuilt from tagged_text when not given
+        cache: Optional response cache for the LLM calls
+        shard_tokens: If given, send the tagged text in shards of about this many
+            tokens, each with the full TOC, as concurrent requests
+        max_workers: Maximum number of shards in flight at once
+        local: Extract references with patterns first and only send the sections
+            with references the patterns could not resolve to the LLM
+        compact: Send section markers, TOC and whitespace in compact form to cut
+            prompt tokens (see prompt_compaction)
         
     Returns:
-        List of dictionaries grouped by level containing section info and references
-    """
-    toc_map = parse_toc_md(toc_md_text)    
-    prompt = build_cross_ref_prompt(toc_md_text, tagged_text)
-    
-    rsp = client.chat.completions.create(
-        model="gpt-4.1-mini",  
-        messages=[
-            {"role": "system", "content": "Return only the JSON specified."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0,
-        max_tokens=32000,
-        response_format={"type": "json_object"},
-    )
-    refs_json = json.loads(rsp.choices[0].message.content)
+        List of dictionaries grouped by level containing section info, text and
+        references (see build_levels_info)
+    """
+    toc_map = parse_toc_md(toc_md_text)
+    index = sections if sections is not None else SectionIndex.from_tagged_text(tagged_text)
+    
+    if local:
+        local_refs, unresolved = find_local_refs(toc_map, index)
+        found_refs = [local_refs]
+        print(f"Found references locally in {len(local_refs)} sections")
+        
+        if unresolved:
+            print(f"Sending {len(unresolved)} sections with unresolved references to the LLM")
+            escalated_text = escalation_text(index, unresolved)
+            found_refs.append(find_refs(toc_md_text, escalated_text, client, cache, shard_tokens, max_workers,
+                                        compact))
+        refs = merge_refs(found_refs)
+    else:
+        # Passed through as the model returned them; find_refs merges the shards if there are several
+        refs = find_refs(toc_md_text, tagged_text, client, cache, shard_tokens, max_workers, compact)
     
+    return build_levels_info(toc_map, refs, index)
+
+
+def build_levels_info(toc_map: Dict[str, Dict[str, Any]], refs: List[Dict],
+                      sections: Optional[SectionIndex] = None) -> List[Dict]:
+    """
+    Group every TOC section by level with its references and, given the section spans, its text.
+    
+    Args:
+        toc_map: Header info by section ID, as from parse_toc_md
+        refs: References in {"from", "to"} form; later entries for a section win
+        sections: Section spans to take each chunk's "text" from; without them
+            chunks have no "text" and callers get it from the tagged text
+    """
     # Build complete section info with all sections from TOC
     all_sections = {}
     
@@ -127,14 +319,17 @@ def analyse_references(toc_md_text: str, tagged_text: str, client: OpenAI) -> Li
             "section_title": info["title"],
             "section_id": section_id,
             "references": [],
-            "text": extract_section_text(section_id, tagged_text),
             "level": info["level"]
         }
+        if sections is not None:
+            all_sections[section_id]["text"] = sections.text(section_id)
     
     # Then, add references from GPT results
-    for ref in refs_json.get("refs", []):
+    for ref in refs:
+        if not isinstance(ref, dict) or "from" not in ref:
+            continue
         from_id = ref["from"]
-        to_ids = ref["to"]
+        to_ids = ref.get("to", [])
         if from_id in all_sections:
             all_sections[from_id]["references"] = to_ids
     
@@ -142,48 +337,90 @@ def analyse_references(toc_md_text: str, tagged_text: str, client: OpenAI) -> Li
     level_map: Dict[int, List] = {}
     for section_id, section_data in all_sections.items():
         level = section_data["level"]
-        level_map.setdefault(level, []).append({
+        chunk = {
             "section_title": section_data["section_title"],
             "section_id": section_data["section_id"],
-            "references": section_data["references"],
-            "text": section_data["text"]
-        })
+            "references": section_data["references"]
+        }
+        if "text" in section_data:
+            chunk["text"] = section_data["text"]
+        level_map.setdefault(level, []).append(chunk)
     
     return [{"level": lvl, "chunks": chunks} for lvl, chunks in sorted(level_map.items())]
 
 
-def collect_refs_texts(section_id: str, structured: List[Dict], tagged_text: str = None) -> List[str]:
-    """Collect the text of all sections referenced by the given section."""
-    # Find which sections this section references
-    referenced_ids = []
+def index_chunks(structured: List[Dict]) -> Dict[str, Dict]:
+    """Map each section ID to its chunk in the level-grouped analysis results."""
+    chunks_by_id: Dict[str, Dict] = {}
     for lvl in structured:
         for c in lvl["chunks"]:
-            if c["section_id"] == section_id:
-                referenced_ids = c["references"]
-                break
-        if referenced_ids:
-            break
+            chunks_by_id.setdefault(c["section_id"], c)
+    return chunks_by_id
+
+
+def collect_refs_texts(
+    section_id: str,
+    structured: List[Dict],
+    tagged_text: str = None,
+    sections: Optional[SectionIndex] = None,
+    chunks_by_id: Optional[Dict[str, Dict]] = None,
+    text_cache: Optional[Dict[str, str]] = None
+) -> List[str]:
+    """
+    Collect the text of all sections referenced by the given section.
+    
+    The text comes from sections, or from tagged_text when no section spans
+    are given, or else from the "text" of the chunks in structured. chunks_by_id (from index_chunks) and text_cache can be shared
+    across calls so that the results are indexed once and each section's text
+    is extracted once.
+    """
+    if chunks_by_id is None:
+        chunks_by_id = index_chunks(structured)
+    
+    # Find which sections this section references
+    chunk = chunks_by_id.get(section_id)
+    referenced_ids = chunk["references"] if chunk else []
     
     if not referenced_ids:
         return []
     
-    # If tagged_text is provided, extract fresh text for each referenced section
-    if tagged_text:
-        return [extract_section_text(ref_id, tagged_text) for ref_id in referenced_ids]
+    # Without section spans or tagged_text, use the text from the structured data
+    if sections is None and not tagged_text:
+        return [chunks_by_id[r]["text"] for r in referenced_ids if "text" in chunks_by_id.get(r, {})]
     
-    # Otherwise, use the text from the structured data
-    id_to_text = {c["section_id"]: c["text"] for lvl in structured for c in lvl["chunks"]}
-    return [id_to_text[r] for r in referenced_ids if r in id_to_text]
+    # Extract the text of each referenced section, once per section
+    if text_cache is None:
+        text_cache = {}
+    texts = []
+    for ref_id in referenced_ids:
+        if ref_id not in text_cache:
+            text_cache[ref_id] = extract_section_text(ref_id, tagged_text, sections)
+        texts.append(text_cache[ref_id])
+    return texts
+
 
 def collect_all_refs(
     structured: List[Dict],
-    tagged_text: Optional[str] = None
+    tagged_text: Optional[str] = None,
+    sections: Optional[SectionIndex] = None
 ) -> Dict[str, List[str]]:
+    """
+    Map every section ID to the texts of the sections it references.
+    
+    When only tagged_text is given, section spans are rebuilt from it in one pass,
+    and each referenced section's text is extracted at most once.
+    """
+    if sections is None and tagged_text:
+        sections = SectionIndex.from_tagged_text(tagged_text)
+    
+    chunks_by_id = index_chunks(structured)
+    text_cache: Dict[str, str] = {}
+    
     result = {}
     for lvl in structured:
         for c in lvl["chunks"]:
             result[c["section_id"]] = collect_refs_texts(
-                c["section_id"], structured, tagged_text
+                c["section_id"], structured, tagged_text, sections,
+                chunks_by_id=chunks_by_id, text_cache=text_cache
             )
     return result
-
@@ -0,0 +1,306 @@
+"""
+Incremental Module
+Updates a previous analysis for an amended document, section by section.
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from openai import OpenAI
+
+from .checkpoints import RunManifest, content_hash
+from .cross_reference_analyzer import build_levels_info, collect_all_refs, find_refs, parse_toc_md
+from .header_ids import add_header_ids
+from .llm_cache import ResponseCache, closing, open_cache
+from .main import get_smallest_chunks, save_reference_graph
+from .scheduler import RequestScheduler
+from .section_index import SectionIndex
+from .section_tagger import locate_sections, parse_markdown_structure, render_tagged_text
+from .telemetry import Telemetry
+from .toc_heuristics import detect_headings
+
+
+def normalized(text: str) -> str:
+    """Text with all whitespace runs collapsed, for comparing section contents."""
+    return " ".join(text.split())
+
+
+def load_previous_run(previous_dir: Path, stem: str) -> Tuple[str, SectionIndex, Dict[str, List[str]]]:
+    """
+    Load the TOC, section spans and reference graph saved by a previous run.
+
+    Returns:
+        Tuple of (TOC with {#hN} anchors, spans over the previous text, references by section ID)
+    """
+    paths = {name: previous_dir / f"{stem}_{name}" for name in ("toc.md", "tagged.txt", "refs.json")}
+    missing = [str(path) for path in paths.values() if not path.exists()]
+    if missing:
+        raise FileNotFoundError(f"Previous run is missing {', '.join(missing)}; run analyze_document "
+                                f"with an output directory first")
+
+    # IDs are either already in the saved TOC or assigned in the same order as before
+    toc_ids, _ = add_header_ids(paths["toc.md"].read_text(encoding="utf-8"))
+    old_sections = SectionIndex.from_tagged_text(paths["tagged.txt"].read_text(encoding="utf-8"))
+    refs = json.loads(paths["refs.json"].read_text(encoding="utf-8"))
+    return toc_ids, old_sections, refs
+
+
+def add_new_headings(toc_ids: str, raw_text: str, sections: SectionIndex,
+                     section_ids: Set[str]) -> Tuple[str, List[str]]:
+    """
+    Add numbered headings that appear in the given sections but not in the TOC.
+
+    Only headings of a kind the TOC already uses ("Article 5a" in a TOC of
+    Articles) are added, at the level of the closest earlier heading of that
+    kind and before the first TOC section that starts after them. New headings
+    get IDs after the highest existing one, so no existing ID changes.
+
+    Returns:
+        Tuple of (updated TOC with IDs, IDs of the added headings)
+    """
+    toc_sections = parse_markdown_structure(toc_ids)
+    titles = {section['title'] for section in toc_sections}
+    kinds = {section['title'].split()[0].lower() for section in toc_sections if section['title'].split()}
+    by_id = {section['id']: section for section in toc_sections}
+    numbers = [int(section['id'][1:]) for section in toc_sections if section['id'][1:].isdigit()]
+    next_id = max(numbers, default=0) + 1
+
+    located = sorted((span for span in sections if span.id in by_id), key=lambda span: span.start)
+    insertions: Dict[int, List[str]] = {}
+    added = []
+    for section_id in sorted(section_ids, key=lambda sid: sections.get(sid).start if sid in sections else 0):
+        span = sections.get(section_id)
+        if span is None:
+            continue
+        for heading in detect_headings(raw_text[span.start:span.end]):
+            if heading['title'] in titles or heading['scheme'] not in kinds:
+                continue
+            pos = span.start + heading['pos']
+            earlier = [s for s in located if s.start < pos and
+                       by_id[s.id]['title'].split()[0].lower() == heading['scheme']]
+            if not earlier:
+                continue
+
+            level = by_id[earlier[-1].id]['level']
+            later = next((s for s in located if s.start > pos), None)
+            line_index = by_id[later.id]['line_index'] if later else len(toc_ids.splitlines())
+            new_id = f"h{next_id}"
+            next_id += 1
+            insertions.setdefault(line_index, []).extend([
+                f"{'#' * level} {heading['title']} {{#{new_id}}}",
+                '"' + heading['snippet'] + '"',
+            ])
+            titles.add(heading['title'])
+            added.append(new_id)
+
+    if not added:
+        return toc_ids, []
+
+    lines = toc_ids.splitlines()
+    new_lines = []
+    for i in range(len(lines) + 1):
+        new_lines.extend(insertions.get(i, []))
+        if i < len(lines):
+            new_lines.append(lines[i])
+    return "\n".join(new_lines) + "\n", added
+
+
+def diff_sections(old_sections: SectionIndex, new_sections: SectionIndex,
+                  toc_map: Dict[str, Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+    """
+    Compare each TOC section's own text (without subsections) between two runs.
+
+    Returns:
+        Tuple of (IDs whose text changed or that are new, IDs no longer found)
+    """
+    changed, removed = [], []
+    for section_id in toc_map:
+        if section_id not in new_sections:
+            if section_id in old_sections:
+                removed.append(section_id)
+            continue
+        if normalized(old_sections.own_text(section_id)) != normalized(new_sections.own_text(section_id)):
+            changed.append(section_id)
+    return changed, removed
+
+
+def update_analysis(document_path: str, previous_dir: str, api_key: str, output_dir: str,
+                    previous_stem: Optional[str] = None, cache_dir: Optional[str] = None,
+                    ref_shard_tokens: Optional[int] = None, compact_prompts: bool = False,
+                    monotonic_tagging: bool = True, trace: bool = False, client: Optional[Any] = None,
+                    scheduler: Optional[RequestScheduler] = None, requests_per_minute: Optional[float] = None,
+                    tokens_per_minute: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Update a previous analysis for an amended version of the document.
+
+    The previous TOC is reused with its section IDs and located in the new text;
+    numbered headings added by the amendment get new IDs. Sections whose own text
+    changed, and sections referencing a changed or removed section, are the only
+    ones whose references are asked for again; all other references are kept.
+
+    The run is measured like analyze_document (see Telemetry), its LLM calls go
+    through the request scheduler, and the outputs are recorded in the amended
+    document's checkpoint manifest (see RunManifest), so a later resumed
+    analyze_document run reuses them rather than outputs of the previous version.
+
+    The updated outputs go to their own directory, never over the previous
+    run's, so a failed or partial update leaves that run intact to diff or
+    retry against.
+
+    Args:
+        document_path: Path to the amended document
+        previous_dir: Output directory of the previous run
+        api_key: OpenAI API key
+        output_dir: Directory to save the updated files, which must not be previous_dir
+        previous_stem: File name stem of the previous run's outputs; defaults to
+            the stem of document_path
+        cache_dir: Optional directory for a persistent LLM response cache
+        ref_shard_tokens: Split the reference request into shards of about this many tokens
+        compact_prompts: Send the reference request in compact form
+        monotonic_tagging: Locate sections in TOC order (see align_sections)
+        trace: Write the telemetry of the run to a JSON trace
+        client: OpenAI client to use instead of creating one
+        scheduler: Request scheduler to send the LLM calls through instead of creating one
+        requests_per_minute: Request rate limit of the scheduler created
+        tokens_per_minute: Token rate limit of the scheduler created
+
+    Returns:
+        Dictionary of results as from analyze_document, plus the IDs of changed,
+        added, removed and re-queried sections
+    """
+    doc_path = Path(document_path)
+    if not doc_path.exists():
+        raise FileNotFoundError(f"Document not found: {document_path}")
+    previous_path = Path(previous_dir)
+    output_path = Path(output_dir)
+    if output_path.resolve() == previous_path.resolve():
+        raise ValueError("The updated analysis needs an output_dir other than previous_dir, "
+                         "which it is computed from")
+    output_path.mkdir(exist_ok=True)
+    stem = previous_stem or doc_path.stem
+
+    if client is None:
+        # Retries are left to the request scheduler, which knows the rate limits
+        client = OpenAI(api_key=api_key, max_retries=0)
+    if scheduler is None:
+        scheduler = RequestScheduler(requests_per_minute, tokens_per_minute)
+    with closing(open_cache(cache_dir)) as cache:
+        return run_update(doc_path, previous_path, output_path, stem, client, scheduler, cache,
+                          ref_shard_tokens, compact_prompts, monotonic_tagging, trace)
+
+
+def run_update(doc_path: Path, previous_path: Path, output_path: Path, stem: str, client: Any,
+               scheduler: RequestScheduler, cache: Optional[ResponseCache], ref_shard_tokens: Optional[int],
+               compact_prompts: bool, monotonic_tagging: bool, trace: bool) -> Dict[str, Any]:
+    """The body of update_analysis, once its client, scheduler and cache are set up."""
+    print(f"Reading document: {doc_path}")
+    raw_text = doc_path.read_text(encoding="utf-8")
+    toc_ids, old_sections, old_refs = load_previous_run(previous_path, stem)
+
+    # Stages are recorded under the keys analyze_document computes, with the TOC
+    # parameters of the previous run, which the updated TOC carries over
+    previous_manifest = RunManifest(previous_path / f"{stem}_manifest.json", "")
+    toc_params = previous_manifest.stages.get("toc", {}).get("params", {})
+    manifest = RunManifest(output_path / f"{doc_path.stem}_manifest.json", content_hash(raw_text))
+    paths = {name: output_path / f"{doc_path.stem}_{name}" for name in
+             ("toc.md", "tagged.txt", "sections.json", "smallest_chunks.json", "refs.json", "all_refs.json")}
+
+    telemetry = Telemetry()
+    with telemetry.activate(), scheduler.activate():
+        print("\nLocating previous sections in the amended text")
+        with telemetry.stage("tagging"):
+            sections = locate_sections(toc_ids, raw_text, monotonic_tagging)
+            changed, removed = diff_sections(old_sections, sections, parse_toc_md(toc_ids))
+
+            toc_ids, added = add_new_headings(toc_ids, raw_text, sections, set(changed))
+            toc_map = parse_toc_md(toc_ids)
+            if added:
+                print(f"Added {len(added)} new headings: {', '.join(added)}")
+                # A section a new heading was carved out of only changed if its remaining text did
+                sections = locate_sections(toc_ids, raw_text, monotonic_tagging)
+                changed, removed = diff_sections(old_sections, sections, toc_map)
+                changed = [sid for sid in changed if sid not in added]
+            tagged_text = render_tagged_text(raw_text, sections)
+
+        # Sections whose references may have changed: their own text changed, they are
+        # new, or they point at a section that changed or disappeared
+        stale_targets = set(changed) | set(removed) | set(added)
+        requery = [sid for sid in toc_map if sid in sections and
+                   (sid in stale_targets or any(to_id in stale_targets for to_id in old_refs.get(sid, [])))]
+        print(f"{len(changed)} sections changed, {len(added)} added, {len(removed)} removed; "
+              f"re-querying references for {len(requery)} sections")
+
+        refs = {sid: [to_id for to_id in to_ids if to_id in toc_map]
+                for sid, to_ids in old_refs.items() if sid in toc_map}
+        if requery:
+            with telemetry.stage("cross_references"):
+                subset_text = "\n".join(
+                    f"[START SECTION {sid}: {toc_map[sid]['title']}] {sections.own_text(sid)} "
+                    f"[END SECTION {sid}: {toc_map[sid]['title']}]"
+                    for sid in requery
+                )
+                new_refs = find_refs(toc_ids, subset_text, client, cache, ref_shard_tokens,
+                                     compact=compact_prompts)
+                for sid in requery:
+                    refs[sid] = []
+                for ref in new_refs:
+                    if ref["from"] in refs:
+                        refs[ref["from"]] = [to_id for to_id in ref["to"] if to_id in toc_map]
+
+        levels_info = build_levels_info(toc_map, [{"from": sid, "to": to_ids} for sid, to_ids in refs.items()],
+                                        sections)
+        with telemetry.stage("chunking"):
+            smallest_chunks = get_smallest_chunks(tagged_text, toc_ids, sections)
+        with telemetry.stage("collect_refs"):
+            all_refs = collect_all_refs(levels_info, tagged_text, sections)
+
+    # The TOC is saved with its IDs so that they stay stable across further updates
+    toc_hash = content_hash(add_header_ids(toc_ids)[0])
+    with manifest.run("toc", manifest.stage_key(toc_params, [manifest.input_hash]), toc_params,
+                      [paths["toc.md"]]):
+        paths["toc.md"].write_text(toc_ids, encoding="utf-8")
+    tagging_params = {"monotonic": monotonic_tagging}
+    with manifest.run("tagging", manifest.stage_key(tagging_params, [manifest.input_hash, toc_hash]),
+                      tagging_params, [paths["tagged.txt"], paths["sections.json"]]):
+        paths["tagged.txt"].write_text(tagged_text, encoding="utf-8")
+        paths["sections.json"].write_text(json.dumps(sections.to_records()), encoding="utf-8")
+    tagged_hash = manifest.output_hash("tagging", paths["tagged.txt"].name)
+    with manifest.run("chunking", manifest.stage_key({}, [toc_hash, tagged_hash]), {},
+                      [paths["smallest_chunks.json"]]):
+        with open(paths["smallest_chunks.json"], "w", encoding="utf-8") as f:
+            json.dump(smallest_chunks, f, indent=2, ensure_ascii=False)
+    refs_params = {"shard_tokens": ref_shard_tokens, "local": False, "compact": compact_prompts}
+    with manifest.run("cross_references", manifest.stage_key(refs_params, [toc_hash, tagged_hash]), refs_params,
+                      [paths["refs.json"]]):
+        save_reference_graph(levels_info, paths["refs.json"])
+    graph_hash = manifest.output_hash("cross_references", paths["refs.json"].name)
+    with manifest.run("collect_refs", manifest.stage_key({}, [tagged_hash, graph_hash]), {},
+                      [paths["all_refs.json"]]):
+        with open(paths["all_refs.json"], "w", encoding="utf-8") as f:
+            json.dump(all_refs, f, indent=2)
+    print(f"Saved updated analysis to: {output_path}")
+
+    report = telemetry.summary()
+    totals = report["totals"]
+    print(f"\nDone in {totals['wall_s']:.1f}s: {totals['llm_calls']} LLM calls, "
+          f"{totals['prompt_tokens']} prompt tokens ({totals['cached_tokens']} cached), "
+          f"{totals['completion_tokens']} completion tokens, ~${totals['cost_usd']:.4f}")
+    if trace:
+        trace_path = output_path / f"{doc_path.stem}_trace.json"
+        telemetry.write_trace(trace_path)
+        print(f"Saved trace to: {trace_path}")
+
+    return {
+        "toc_ids": toc_ids,
+        "tagged_text": tagged_text,
+        "sections": sections,
+        "levels_info": levels_info,
+        "all_refs": all_refs,
+        "smallest_chunks": smallest_chunks,
+        "changed": changed,
+        "added": added,
+        "removed": removed,
+        "requeried": requery,
+        "telemetry": report,
+    }
@@ -0,0 +1,138 @@
+"""
+LLM Module
+Single entry point for the chat completion calls made by the pipeline.
+"""
+
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+from openai import OpenAI
+
+from .llm_cache import ResponseCache
+from .scheduler import current_scheduler
+from .telemetry import record_call
+
+
+# Shared by every call so that requests over the same document share a prefix
+SYSTEM_PROMPT = ("You are a document analyzer. Follow the instructions in the last message "
+                 "and return only the output they specify. Do NOT reproduce large blocks of text.")
+
+
+def document_messages(document: str, instructions: str) -> List[Dict[str, str]]:
+    """
+    Build the messages for a call about a document in the canonical layout.
+
+    The fixed system prompt and the document block come first and are byte-for-byte
+    the same for every call over the same text, so the provider can serve them from
+    its prompt cache; the instructions, which change from call to call, come last.
+    """
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"--- DOCUMENT ---\n{document}\n--- END DOCUMENT ---"},
+        {"role": "user", "content": instructions},
+    ]
+
+
+def report_usage(rsp: Any, model: Optional[str]) -> None:
+    """Print the token usage of a response, including prompt tokens served from the provider's cache."""
+    usage = getattr(rsp, "usage", None)
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    print(f"LLM call ({model}): {usage.prompt_tokens} prompt tokens ({cached} cached), "
+          f"{usage.completion_tokens} completion tokens")
+
+
+def chat_completion(client: OpenAI, cache: Optional[ResponseCache] = None, **params: Any) -> str:
+    """
+    Run a chat completion and return the text of the reply.
+
+    The request is sent through the active RequestScheduler, which keeps it
+    within the rate limits and retries transient failures.
+
+    Args:
+        client: OpenAI client instance
+        cache: Optional response cache; identical requests are answered from it
+        **params: Arguments for client.chat.completions.create (model, messages, ...)
+
+    Returns:
+        The message content of the first choice
+    """
+    key = None
+    if cache is not None:
+        key = cache.make_key(**params)
+        cached = cache.get(key)
+        if cached is not None:
+            record_call(params.get("model"), None, 0.0, cache_hit=True)
+            return cached
+
+    rsp, wall_s = current_scheduler().call(client.chat.completions.create, **params)
+    record_call(params.get("model"), getattr(rsp, "usage", None), wall_s)
+    report_usage(rsp, params.get("model"))
+    choice = rsp.choices[0]
+    content = choice.message.content or ""
+
+    # Truncated replies are not worth replaying
+    if cache is not None and choice.finish_reason != "length":
+        cache.put(key, content)
+
+    return content
+
+
+def stream_chat_completion(client: OpenAI, cache: Optional[ResponseCache] = None, **params: Any) -> Iterator[str]:
+    """
+    Run a chat completion with stream=True and yield the text of the reply as it arrives.
+
+    The request is admitted by the active RequestScheduler like any other and
+    stays in flight until the stream is read or closed; a failure once the
+    reply has started is not retried. Closing the iterator early closes the
+    stream, so the provider stops generating, and the call is recorded as
+    aborted. Only replies read to the end are cached, under the same key as
+    the same request without streaming; a cached reply is yielded in one piece.
+
+    Args:
+        client: OpenAI client instance
+        cache: Optional response cache; identical requests are answered from it
+        **params: Arguments for client.chat.completions.create (model, messages, ...)
+    """
+    key = None
+    if cache is not None:
+        key = cache.make_key(**params)
+        cached = cache.get(key)
+        if cached is not None:
+            record_call(params.get("model"), None, 0.0, cache_hit=True)
+            yield cached
+            return
+
+    pieces = []
+    finish_reason = None
+    usage = None
+    # The request holds its scheduler slot until the stream has been read or closed
+    with current_scheduler().admitted(client.chat.completions.create, stream=True,
+                                      stream_options={"include_usage": True}, **params) as (stream, wall_s):
+        start = time.perf_counter() - wall_s
+        try:
+            for chunk in stream:
+                # The last chunk carries the usage of the whole request and no choices
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                text = choice.delta.content
+                if text:
+                    pieces.append(text)
+                    yield text
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+            # A stream closed before its end (e.g. for copying text) reports no usage
+            record_call(params.get("model"), usage, time.perf_counter() - start, aborted=finish_reason is None)
+            report_usage(SimpleNamespace(usage=usage), params.get("model"))
+
+    # Truncated replies are not worth replaying
+    if cache is not None and finish_reason == "stop":
+        cache.put(key, "".join(pieces))
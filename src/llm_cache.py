@@ -0,0 +1,120 @@
+"""
+LLM Cache Module
+Persistent, content-addressed cache of chat completion responses.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, ContextManager, Optional, Union
+
+
+# File name of the cache in a cache directory
+CACHE_FILE = "llm_responses.sqlite3"
+
+
+class ResponseCache:
+    """
+    On-disk cache of chat completion texts, keyed by a hash of the request.
+
+    Entries are stored in a single SQLite file so the cache can be shared between
+    runs and threads. Reading an entry marks it as recently used; writing one evicts
+    the least recently used entries until the cache fits in max_bytes. Entries
+    older than ttl seconds are treated as missing and dropped.
+    """
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = 512 * 1024 * 1024,
+                 ttl: Optional[float] = 30 * 24 * 3600):
+        """
+        Args:
+            path: SQLite file to store the cache in; parent directories are created
+            max_bytes: Total size of cached responses to keep
+            ttl: Maximum age of an entry in seconds, or None to keep entries indefinitely
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(**params: Any) -> str:
+        """Hash the complete request (model, messages and all other parameters)."""
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response text for a key, or None on a miss."""
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        """Store a response text, then evict expired and least recently used entries."""
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            if self.ttl is not None:
+                self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+            for old_key, old_size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                total -= old_size
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        """Close the underlying database."""
+        self._db.close()
+
+    def __enter__(self) -> "ResponseCache":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def open_cache(cache_dir: Optional[Union[str, Path]]) -> Optional[ResponseCache]:
+    """The response cache kept in cache_dir, or None when no directory is given."""
+    return ResponseCache(Path(cache_dir) / CACHE_FILE) if cache_dir else None
+
+
+def closing(cache: Optional[ResponseCache]) -> ContextManager[Optional[ResponseCache]]:
+    """Context manager closing the cache, if there is one, when the block ends."""
+    return cache if cache is not None else nullcontext()
@@ -7,16 +7,37 @@ import sys
 import json
 import re
 from pathlib import Path
-from typing import Dict, Any, Optional
+from concurrent.futures import Executor
+from typing import Dict, Any, Callable, List, Optional, Tuple, TypeVar
 from openai import OpenAI
 
 from .toc_generator import generate_toc
 from .header_ids import add_header_ids
-from .section_tagger import tag_sections, parse_markdown_structure
-from .cross_reference_analyzer import analyse_references, collect_all_refs
+from .section_index import SectionIndex
+from .section_tree import SectionTree
+from .section_tagger import locate_sections, render_tagged_text, parse_markdown_structure
+from .cross_reference_analyzer import analyse_references, build_levels_info, collect_all_refs, parse_toc_md
+from .checkpoints import STAGES, RunManifest, content_hash
+from .llm_cache import closing, open_cache
+from .profiling import StageProfiler
+from .scheduler import RequestScheduler
+from .telemetry import Telemetry
 
 
-def analyze_document(document_path: str, api_key: str, output_dir: Optional[str] = None, max_passes: int = 3) -> Dict[str, Any]:
+T = TypeVar("T")
+
+
+def analyze_document(document_path: str, api_key: str, output_dir: Optional[str] = None, max_passes: int = 3,
+                     cache_dir: Optional[str] = None, concurrent_toc: bool = False,
+                     delta_toc: bool = False, ref_shard_tokens: Optional[int] = None,
+                     local_refs: bool = False, heuristic_toc: bool = False,
+                     compact_prompts: bool = False, trace: bool = False,
+                     profile: bool = False, resume: bool = False,
+                     force_stages: Optional[List[str]] = None, client: Optional[Any] = None,
+                     local_executor: Optional[Executor] = None, requests_per_minute: Optional[float] = None,
+                     tokens_per_minute: Optional[float] = None,
+                     scheduler: Optional[RequestScheduler] = None, stream_toc: bool = False,
+                     monotonic_tagging: bool = True) -> Dict[str, Any]:
     """
     Complete end-to-end document analysis pipeline.
     
@@ -25,11 +46,57 @@ def analyze_document(document_path: str, api_key: str, output_dir: Optional[str]
         api_key: OpenAI API key
         output_dir: Optional directory to save intermediate files
         max_passes: Number of passes to make at most with LLM.
+        cache_dir: Optional directory for a persistent LLM response cache, so
+            re-running on an unchanged document does not repeat any LLM call
+        concurrent_toc: After the first TOC pass, expand each top-level section
+            from its own text, concurrently
+        delta_toc: Have TOC passes after the first return only the new headings
+            as JSON, applied to the TOC locally
+        ref_shard_tokens: Split cross-referencing into concurrent requests of
+            about this many tokens of tagged text each
+        local_refs: Extract cross-references with patterns and only ask the LLM
+            about sections with references the patterns cannot resolve
+        heuristic_toc: Build the TOC from numbered headings found with line
+            patterns, calling the LLM only for levels it cannot infer; the
+            other TOC options only apply if no numbered headings are found
+        compact_prompts: Send cross-reference prompts with short section markers,
+            a TOC without snippets and normalized whitespace
+        trace: Write the telemetry of the run (see Telemetry) to a JSON trace
+            file next to the other outputs
+        profile: Profile the local stages (tagging, chunking, collecting refs)
+            with cProfile and tracemalloc, writing .prof files and summaries
+            next to the other outputs (see StageProfiler); with a local_executor,
+            tagging and chunking are profiled inside the worker that runs them
+        resume: Reuse the outputs of stages that an earlier run in output_dir
+            completed with the same document, parameters and inputs, starting
+            from the first stage that is stale or failed (see RunManifest).
+            Every run with an output_dir records its stages in
+            {stem}_manifest.json, whether or not it resumes
+        force_stages: Stages to recompute even when resuming, out of "toc",
+            "tagging", "chunking", "cross_references" and "collect_refs"
+        client: OpenAI client to use instead of creating one from api_key, e.g.
+            one shared by the documents of a batch
+        local_executor: Executor to run tagging and chunking in, e.g. a process
+            pool shared by the documents of a batch; they run in this thread
+            when omitted
+        requests_per_minute: Request rate limit to keep the LLM calls within
+        tokens_per_minute: Token rate limit to keep the LLM calls within
+        scheduler: RequestScheduler to send the LLM calls through instead of one
+            built from the limits above, e.g. one shared by the documents of a batch
+        stream_toc: Stream full TOC passes and parse headings as they arrive,
+            stopping a pass early if it starts copying the document; with
+            concurrent_toc, top-level sections are expanded while the first
+            pass is still streaming
+        monotonic_tagging: Locate sections in TOC order with a forward cursor
+            (see align_sections) rather than each one from the top of the document
     
     Returns:
-        Dictionary containing all analysis results
+        Dictionary containing all analysis results, including per-stage and
+        per-call telemetry under "telemetry"
     """
     # Setup
+    if resume and not output_dir:
+        raise ValueError("Resuming needs the output_dir of the earlier run")
     doc_path = Path(document_path)
     if not doc_path.exists():
         raise FileNotFoundError(f"Document not found: {document_path}")
@@ -41,66 +108,164 @@ def analyze_document(document_path: str, api_key: str, output_dir: Optional[str]
         output_path = doc_path.parent
     
     # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
+    if client is None:
+        # Retries are left to the request scheduler, which knows the rate limits
+        client = OpenAI(api_key=api_key, max_retries=0)
+    if scheduler is None:
+        scheduler = RequestScheduler(requests_per_minute, tokens_per_minute)
     
     # Read document
     print(f"Reading document: {doc_path}")
     raw_text = doc_path.read_text(encoding="utf-8")
     
-    # Step 1: Generate TOC
-    print("\nStep 1: Generating Table of Contents")
-    toc_md = generate_toc(raw_text, client, max_passes=max_passes)
-    
-    if output_dir:
-        toc_path = output_path / f"{doc_path.stem}_toc.md"
-        toc_path.write_text(toc_md, encoding="utf-8")
-        print(f"Saved TOC to: {toc_path}")        
+    stem = doc_path.stem
+    manifest = RunManifest(output_path / f"{stem}_manifest.json", content_hash(raw_text),
+                           enabled=bool(output_dir), resume=resume, force=force_stages)
+    toc_path = output_path / f"{stem}_toc.md"
+    tagged_output_path = output_path / f"{stem}_tagged.txt"
+    sections_path = output_path / f"{stem}_sections.json"
+    chunks_output_path = output_path / f"{stem}_smallest_chunks.json"
+    graph_path = output_path / f"{stem}_refs.json"
+    refs_path = output_path / f"{stem}_all_refs.json"
+
+    telemetry = Telemetry()
+    profiler = StageProfiler(output_path, stem, enabled=profile)
+    with closing(open_cache(cache_dir)) as cache, telemetry.activate(), scheduler.activate():
+        # Step 1: Generate TOC
+        print("\nStep 1: Generating Table of Contents")
+        toc_params = {"max_passes": max_passes, "concurrent": concurrent_toc, "delta": delta_toc,
+                      "heuristic": heuristic_toc, "stream": stream_toc}
+        toc_key = manifest.stage_key(toc_params, [manifest.input_hash])
+        if manifest.is_current("toc", toc_key):
+            toc_md = toc_path.read_text(encoding="utf-8")
+            print(f"Reusing TOC from: {toc_path}")
+        else:
+            with manifest.run("toc", toc_key, toc_params, [toc_path]), telemetry.stage("toc"):
+                toc_md = generate_toc(raw_text, client, max_passes=max_passes, cache=cache,
+                                      concurrent=concurrent_toc, delta=delta_toc, heuristic=heuristic_toc,
+                                      stream=stream_toc)
+                if output_dir:
+                    toc_path.write_text(toc_md, encoding="utf-8")
+                    print(f"Saved TOC to: {toc_path}")
+            
+        # Step 2: Add IDs to TOC
+        print("\nStep 2: Adding IDs to TOC")
+        with telemetry.stage("header_ids"):
+            toc_ids, id_map = add_header_ids(toc_md)
+        toc_hash = content_hash(toc_ids)
         
-    # Step 2: Add IDs to TOC
-    print("\nStep 2: Adding IDs to TOC")
-    toc_ids, id_map = add_header_ids(toc_md)
-    
-    # Step 3: Tag sections in the text using the IDs
-    print("\nStep 3: Tagging Sections")
-    tagged_text = tag_sections(toc_ids, raw_text)
-
-    # Save tagged text to output directory
-    tagged_output_path = output_path / f"{doc_path.stem}_tagged.txt"
-    with open(tagged_output_path, 'w', encoding='utf-8') as f:
-        f.write(tagged_text)
-    
-    # Get smallest chunks
-    smallest_chunks = get_smallest_chunks(tagged_text, toc_ids)
-    
-    # Save smallest chunks to output directory
-    chunks_output_path = output_path / f"{doc_path.stem}_smallest_chunks.json"
-    with open(chunks_output_path, 'w', encoding='utf-8') as f:
-        json.dump(smallest_chunks, f, indent=2, ensure_ascii=False)
-
-    # Step 4: Cross reference the text using the IDs as markers, organized by section depth (level)
-    print("\nStep 4: Cross referencing")
-    levels_info = analyse_references(toc_ids, tagged_text, client)
-
-    # Step 5: 
-    print("\nStep 5: Collecting results")
-    all_refs = collect_all_refs(levels_info, tagged_text)
-    if output_dir:
-        refs_path = output_path / f"{doc_path.stem}_all_refs.json"
-        with open(refs_path, "w", encoding="utf-8") as f:
-            json.dump(all_refs, f, indent=2)
-        print("Saved all_refs JSON to %s", refs_path)
+        # Step 3: Tag sections in the text using the IDs
+        print("\nStep 3: Tagging Sections")
+        tagging_params = {"monotonic": monotonic_tagging}
+        tagging_key = manifest.stage_key(tagging_params, [manifest.input_hash, toc_hash])
+        if manifest.is_current("tagging", tagging_key):
+            tagged_text = tagged_output_path.read_text(encoding="utf-8")
+            sections = SectionIndex.from_records(raw_text, json.loads(sections_path.read_text(encoding="utf-8")))
+            print(f"Reusing tagged text from: {tagged_output_path}")
+        else:
+            with manifest.run("tagging", tagging_key, tagging_params, [tagged_output_path, sections_path]):
+                with telemetry.stage("tagging"):
+                    sections, tagged_text = run_local(local_executor, profiler.call, "tagging", tag_document,
+                                                      toc_ids, raw_text, monotonic_tagging)
+
+                # Save tagged text to output directory
+                with open(tagged_output_path, 'w', encoding='utf-8') as f:
+                    f.write(tagged_text)
+                if output_dir:
+                    sections_path.write_text(json.dumps(sections.to_records()), encoding="utf-8")
+        tagged_hash = manifest.output_hash("tagging", tagged_output_path.name)
+        
+        # Get smallest chunks
+        chunking_key = manifest.stage_key({}, [toc_hash, tagged_hash])
+        if manifest.is_current("chunking", chunking_key):
+            smallest_chunks = json.loads(chunks_output_path.read_text(encoding="utf-8"))
+        else:
+            with manifest.run("chunking", chunking_key, {}, [chunks_output_path]):
+                with telemetry.stage("chunking"):
+                    smallest_chunks = run_local(local_executor, profiler.call, "chunking", get_smallest_chunks,
+                                                tagged_text, toc_ids, sections)
+        
+                # Save smallest chunks to output directory
+                with open(chunks_output_path, 'w', encoding='utf-8') as f:
+                    json.dump(smallest_chunks, f, indent=2, ensure_ascii=False)
+
+        # Step 4: Cross reference the text using the IDs as markers, organized by section depth (level)
+        print("\nStep 4: Cross referencing")
+        refs_params = {"shard_tokens": ref_shard_tokens, "local": local_refs, "compact": compact_prompts}
+        refs_key = manifest.stage_key(refs_params, [toc_hash, tagged_hash])
+        if manifest.is_current("cross_references", refs_key):
+            # The saved graph holds every reference; the level grouping is rebuilt locally
+            graph = json.loads(graph_path.read_text(encoding="utf-8"))
+            levels_info = build_levels_info(parse_toc_md(toc_ids),
+                                            [{"from": sid, "to": to_ids} for sid, to_ids in graph.items()],
+                                            sections)
+            print(f"Reusing cross-references from: {graph_path}")
+        else:
+            with manifest.run("cross_references", refs_key, refs_params, [graph_path]):
+                with telemetry.stage("cross_references"):
+                    levels_info = analyse_references(toc_ids, tagged_text, client, sections, cache=cache,
+                                                     shard_tokens=ref_shard_tokens, local=local_refs,
+                                                     compact=compact_prompts)
+                if output_dir:
+                    save_reference_graph(levels_info, graph_path)
+
+        # Step 5: 
+        print("\nStep 5: Collecting results")
+        collect_key = manifest.stage_key({}, [tagged_hash, manifest.output_hash("cross_references", graph_path.name)])
+        if manifest.is_current("collect_refs", collect_key):
+            all_refs = json.loads(refs_path.read_text(encoding="utf-8"))
+        else:
+            with manifest.run("collect_refs", collect_key, {}, [refs_path]):
+                with telemetry.stage("collect_refs"), profiler.profile("collect_refs"):
+                    all_refs = collect_all_refs(levels_info, tagged_text, sections)
+                if output_dir:
+                    with open(refs_path, "w", encoding="utf-8") as f:
+                        json.dump(all_refs, f, indent=2)
+                    print("Saved all_refs JSON to %s", refs_path)
+
+    report = telemetry.summary()
+    totals = report["totals"]
+    print(f"\nDone in {totals['wall_s']:.1f}s: {totals['llm_calls']} LLM calls, "
+          f"{totals['prompt_tokens']} prompt tokens ({totals['cached_tokens']} cached), "
+          f"{totals['completion_tokens']} completion tokens, ~${totals['cost_usd']:.4f}")
+    if trace:
+        trace_path = output_path / f"{stem}_trace.json"
+        telemetry.write_trace(trace_path)
+        print(f"Saved trace to: {trace_path}")
 
     return {
         "toc_md": toc_md,
         "toc_ids": toc_ids,
         "id_map": id_map,
         "tagged_text": tagged_text,
+        "sections": sections,
         "levels_info": levels_info,
         "all_refs": all_refs,
-        "smallest_chunks": smallest_chunks
+        "smallest_chunks": smallest_chunks,
+        "telemetry": report
     }
 
-def get_smallest_chunks(tagged_text: str, toc_ids: str) -> Dict[str, str]:
+def run_local(executor: Optional[Executor], fn: Callable[..., T], *args: Any) -> T:
+    """Run a local stage in the executor, if given, and wait for its result."""
+    if executor is None:
+        return fn(*args)
+    return executor.submit(fn, *args).result()
+
+
+def tag_document(toc_ids: str, raw_text: str, monotonic: bool = True) -> Tuple[SectionIndex, str]:
+    """Locate the TOC sections in the text and render the tagged text."""
+    sections = locate_sections(toc_ids, raw_text, monotonic)
+    return sections, render_tagged_text(raw_text, sections)
+
+
+def save_reference_graph(levels_info: List[Dict], path: Path) -> None:
+    """Save the section IDs each section references, so a later run can update the analysis incrementally."""
+    graph = {chunk["section_id"]: chunk["references"] for level in levels_info for chunk in level["chunks"]}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(graph, f, indent=2)
+
+
+def get_smallest_chunks(tagged_text: str, toc_ids: str, sections: Optional[SectionIndex] = None) -> Dict[str, str]:
     """
     Extract the smallest/deepest chunks from the document hierarchy.
     
@@ -110,71 +275,57 @@ def get_smallest_chunks(tagged_text: str, toc_ids: str) -> Dict[str, str]:
     Args:
         tagged_text: The document text with section tags
         toc_ids: The TOC IDs
+        sections: Optional section spans from locate_sections; when omitted they
+            are rebuilt from tagged_text in a single pass over its tags
     
     Returns:
         Dict mapping section IDs to their text content
     """
     # Parse the TOC structure to get section hierarchy
-    sections = parse_markdown_structure(toc_ids)
+    toc_sections = parse_markdown_structure(toc_ids)
     
-    if not sections:
+    if not toc_sections:
         return {}
     
     # Sort sections by their line order in the TOC
-    sections.sort(key=lambda x: x['line_index'])
+    toc_sections.sort(key=lambda x: x['line_index'])
     
-    # Identify which sections are "smallest chunks"
-    smallest_chunk_ids = []
+    # Identify which sections are "smallest chunks": the leaves of the hierarchy,
+    # i.e. sections not directly followed by a deeper one
+    tree = SectionTree.from_sections(toc_sections)
+    smallest_chunk_ids = [toc_sections[i]['id'] for i in tree.leaves()]
     
-    for i, section in enumerate(sections):
-        current_level = section['level']
-        
-        # Check if this is a leaf node (deepest before stepping back up)
-        is_smallest = True
-        
-        # Look at subsequent sections to see if any go deeper
-        for j in range(i + 1, len(sections)):
-            next_section = sections[j]
-            next_level = next_section['level']
-            
-            # If we find a deeper level, this isn't a leaf
-            if next_level > current_level:
-                is_smallest = False
-                break
-            
-            # If we hit the same or higher level, stop looking
-            # (we've reached the end of this section's subsections)
-            if next_level <= current_level:
-                break
-        
-        if is_smallest:
-            smallest_chunk_ids.append(section['id'])
+    # Extract text content for each smallest chunk; sections that weren't
+    # properly tagged get empty text
+    if sections is None:
+        sections = SectionIndex.from_tagged_text(tagged_text)
     
-    # Extract text content for each smallest chunk
-    chunk_texts = {}
+    return {section_id: sections.text(section_id) for section_id in smallest_chunk_ids}
+
+
+def get_level_chunks(tagged_text: str, toc_ids: str, level: int,
+                     sections: Optional[SectionIndex] = None) -> Dict[str, str]:
+    """
+    Extract the chunks of every section at one level of the document hierarchy.
     
-    for section_id in smallest_chunk_ids:
-        # Find the section tags in the tagged text
-        start_pattern = rf'\[START SECTION {re.escape(section_id)}:[^\]]*\]'
-        end_pattern = rf'\[END SECTION {re.escape(section_id)}:[^\]]*\]'
-        
-        start_match = re.search(start_pattern, tagged_text)
-        end_match = re.search(end_pattern, tagged_text)
-        
-        if start_match and end_match:
-            start_pos = start_match.end()
-            end_pos = end_match.start()
-            
-            if start_pos < end_pos:
-                section_text = tagged_text[start_pos:end_pos].strip()
-                chunk_texts[section_id] = section_text
-            else:
-                chunk_texts[section_id] = ""
-        else:
-            # If we can't find the tags, this section wasn't properly tagged
-            chunk_texts[section_id] = ""
+    Args:
+        tagged_text: The document text with section tags
+        toc_ids: The TOC IDs
+        level: TOC level to extract (1 for top-level sections)
+        sections: Optional section spans from locate_sections; when omitted they
+            are rebuilt from tagged_text in a single pass over its tags
+    
+    Returns:
+        Dict mapping section IDs to their text content, including subsections
+    """
+    toc_sections = parse_markdown_structure(toc_ids)
+    toc_sections.sort(key=lambda x: x['line_index'])
+    
+    if sections is None:
+        sections = SectionIndex.from_tagged_text(tagged_text)
     
-    return chunk_texts
+    return {section['id']: sections.text(section['id'])
+            for section in toc_sections if section['level'] == level}
 
 if __name__ == "__main__":
     import argparse
@@ -191,6 +342,89 @@ if __name__ == "__main__":
         "--output-dir", "-o", default=None,
         help="Where to write out intermediate files and JSON"
     )
+    parser.add_argument(
+        "--cache-dir", "-c", default=None,
+        help="Directory for a persistent cache of LLM responses"
+    )
+    parser.add_argument(
+        "--concurrent-toc", action="store_true",
+        help="Expand top-level TOC sections concurrently after the first pass"
+    )
+    parser.add_argument(
+        "--delta-toc", action="store_true",
+        help="Have TOC passes after the first return only the new headings"
+    )
+    parser.add_argument(
+        "--stream-toc", action="store_true",
+        help="Stream TOC passes, parsing headings as they arrive"
+    )
+    parser.add_argument(
+        "--no-monotonic-tagging", dest="monotonic_tagging", action="store_false",
+        help="Locate each section from the top of the document instead of in TOC order"
+    )
+    parser.add_argument(
+        "--ref-shard-tokens", type=int, default=None,
+        help="Cross-reference in concurrent shards of about this many tokens"
+    )
+    parser.add_argument(
+        "--local-refs", action="store_true",
+        help="Extract cross-references with patterns, using the LLM only for unresolved ones"
+    )
+    parser.add_argument(
+        "--heuristic-toc", action="store_true",
+        help="Build the TOC from numbered headings found locally, skipping LLM passes; "
+             "the other TOC options only apply when none are found"
+    )
+    parser.add_argument(
+        "--compact-prompts", action="store_true",
+        help="Use short section markers and drop TOC snippets in cross-reference prompts"
+    )
+    parser.add_argument(
+        "--trace", action="store_true",
+        help="Write per-stage timings, token usage and cost to a JSON trace file"
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Profile the local stages with cProfile and tracemalloc, in the process that runs each stage"
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Reuse the stages an earlier run in the output directory completed with the same inputs"
+    )
+    parser.add_argument(
+        "--force-stage", action="append", choices=STAGES, default=None,
+        help="Recompute this stage even when resuming (repeatable)"
+    )
+    parser.add_argument(
+        "--requests-per-minute", type=float, default=None,
+        help="Keep LLM calls within this many requests per minute"
+    )
+    parser.add_argument(
+        "--tokens-per-minute", type=float, default=None,
+        help="Keep LLM calls within this many tokens per minute"
+    )
+    parser.add_argument(
+        "--update-from", default=None,
+        help="Output directory of a previous run; only re-analyze the sections the amended document changed, "
+             "writing the updated analysis to --output-dir, which must be a different directory"
+    )
     args = parser.parse_args()
 
-    results = analyze_document(args.document_path, args.api_key, args.output_dir)
+    if args.update_from and not args.output_dir:
+        parser.error("--update-from needs an --output-dir other than the previous run's")
+    if args.update_from:
+        from .incremental import update_analysis
+        results = update_analysis(args.document_path, args.update_from, args.api_key, args.output_dir,
+                                  cache_dir=args.cache_dir, ref_shard_tokens=args.ref_shard_tokens,
+                                  compact_prompts=args.compact_prompts, monotonic_tagging=args.monotonic_tagging,
+                                  trace=args.trace, requests_per_minute=args.requests_per_minute,
+                                  tokens_per_minute=args.tokens_per_minute)
+    else:
+        results = analyze_document(args.document_path, args.api_key, args.output_dir, cache_dir=args.cache_dir,
+                                   concurrent_toc=args.concurrent_toc, delta_toc=args.delta_toc,
+                                   ref_shard_tokens=args.ref_shard_tokens, local_refs=args.local_refs,
+                                   heuristic_toc=args.heuristic_toc, compact_prompts=args.compact_prompts,
+                                   trace=args.trace, profile=args.profile, resume=args.resume,
+                                   force_stages=args.force_stage, requests_per_minute=args.requests_per_minute,
+                                   tokens_per_minute=args.tokens_per_minute, stream_toc=args.stream_toc,
+                                   monotonic_tagging=args.monotonic_tagging)
@@ -0,0 +1,37 @@
+"""
+Numbering Module
+Patterns and normalization of the numbers of sections and units ("Article 5", "CHAPTER III", "2.01").
+"""
+
+from typing import Dict
+
+
+# Arabic numbers, optionally dotted or lettered, as in "5", "2.01" or "6a"
+ARABIC = r'\d+[a-z]?(?:\.\d+)*'
+
+# Upper-case roman numerals, as in "III"
+ROMAN = r'[IVXLCDM]+'
+
+# A unit number: arabic or upper-case roman, the latter matched case-sensitively in IGNORECASE patterns
+NUMBER = r'(?:' + ARABIC + r'|(?-i:' + ROMAN + r')\b)'
+
+ROMAN_VALUES: Dict[str, int] = {'I': 1, 'V': 5, 'X': 10, 'L': 50, 'C': 100, 'D': 500, 'M': 1000}
+
+
+def roman_to_int(numeral: str) -> int:
+    """Value of an upper-case roman numeral."""
+    total = 0
+    for i, char in enumerate(numeral):
+        value = ROMAN_VALUES[char]
+        if i + 1 < len(numeral) and ROMAN_VALUES[numeral[i + 1]] > value:
+            total -= value
+        else:
+            total += value
+    return total
+
+
+def normalize_number(number: str) -> str:
+    """Canonical form of a unit number, so "III" and "3" compare equal."""
+    if number.isupper() and all(char in ROMAN_VALUES for char in number):
+        return str(roman_to_int(number))
+    return number.lower()
@@ -0,0 +1,67 @@
+"""
+Prompt Compaction Module
+Shrinks tagged text and TOCs before they are embedded in LLM prompts.
+"""
+
+import re
+from typing import Dict, Iterable, List
+
+from .section_index import TAG_RE
+
+
+HEADER_LINE_RE = re.compile(r'^\s*#{1,6}\s')
+INLINE_SPACE_RE = re.compile(r'[ \t\f\v\u00a0]+')
+LINE_BREAK_RE = re.compile(r' ?\n\s*')
+
+# Characters the model may keep around an ID when copying it from a compact marker
+ID_NOISE = '⟦⟧/#{} \t'
+
+
+def normalize_whitespace(text: str) -> str:
+    """Collapse runs of spaces and tabs to one space, and runs of blank lines to a single line break."""
+    return LINE_BREAK_RE.sub('\n', INLINE_SPACE_RE.sub(' ', text)).strip()
+
+
+def compact_tagged_text(tagged_text: str) -> str:
+    """
+    Replace section tags with short markers and normalize whitespace.
+
+    "[START SECTION h12: Article 12 ...]" becomes "⟦h12⟧" and the matching END
+    tag "⟦/h12⟧". Section IDs are kept as they are, so IDs in the model's reply
+    refer to the same sections as in the full tagged text.
+    """
+    def marker(match: re.Match) -> str:
+        kind, section_id, _ = match.groups()
+        return f"⟦{section_id}⟧" if kind == 'START' else f"⟦/{section_id}⟧"
+
+    return normalize_whitespace(TAG_RE.sub(marker, tagged_text))
+
+
+def compact_toc(toc_md: str) -> str:
+    """Keep only the header lines of a TOC, with their {#id} anchors, dropping the quoted snippets."""
+    return "\n".join(normalize_whitespace(line) for line in toc_md.splitlines() if HEADER_LINE_RE.match(line))
+
+
+def section_ids(tagged_text: str) -> List[str]:
+    """IDs of all sections tagged in the text, in order."""
+    return list(dict.fromkeys(m.group(2) for m in TAG_RE.finditer(tagged_text) if m.group(1) == 'START'))
+
+
+def restore_ref_ids(refs: List[Dict], valid_ids: Iterable[str]) -> List[Dict]:
+    """
+    Map IDs in refs returned for a compact prompt back to section IDs.
+
+    Marker characters the model copied along with an ID ("⟦h12⟧", "#h12") are
+    stripped, and references to IDs that are not sections are dropped.
+    """
+    valid = set(valid_ids)
+    restored = []
+    for ref in refs:
+        if not isinstance(ref, dict):
+            continue
+        from_id = str(ref.get("from", "")).strip(ID_NOISE)
+        if from_id not in valid:
+            continue
+        to_ids = [str(to_id).strip(ID_NOISE) for to_id in ref.get("to", [])]
+        restored.append({"from": from_id, "to": [to_id for to_id in to_ids if to_id in valid]})
+    return restored
@@ -0,0 +1,206 @@
+"""
+Reference Extractor Module
+Finds cross-references between sections with compiled patterns, without an LLM.
+"""
+
+import re
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+
+from .numbering import NUMBER, normalize_number
+from .section_index import SectionIndex
+from .section_tree import SectionTree
+
+
+# Kinds of numbered units a reference can point to, by the words used for them
+UNIT_KINDS = {
+    'article': 'article', 'articles': 'article', 'art': 'article',
+    'chapter': 'chapter', 'chapters': 'chapter',
+    'section': 'section', 'sections': 'section', 'sec': 'section',
+    'part': 'part', 'parts': 'part',
+    'title': 'title', 'titles': 'title',
+    'annex': 'annex', 'annexes': 'annex',
+}
+
+# Paragraph and point subdivisions after a number, as in "6(1)(a)"; they resolve to the unit itself
+SUBDIVISIONS = r'(?:\s?\([0-9a-z]{1,4}\))*'
+
+# "Article 6(1)", "Chapter III", "Section 2.01", "Articles 13 and 14", "Articles 12 to 15"
+REFERENCE_RE = re.compile(
+    r'\b(?P<kind>Articles?|Art\.|Chapters?|Sections?|Sec\.|Parts?|Titles?|Annex(?:es)?)\s+'
+    r'(?P<numbers>' + NUMBER + SUBDIVISIONS +
+    r'(?:\s*(?:,|and/or|and|or|to)\s*' + NUMBER + SUBDIVISIONS + r')*)',
+    re.IGNORECASE
+)
+NUMBER_RE = re.compile(r'(' + NUMBER + r')' + SUBDIVISIONS + r'|\b(to)\b', re.IGNORECASE)
+
+# What follows a reference into another instrument: "Article 16 TFEU", "Article 8 of the Charter",
+# "Articles 12 to 15 of that Directive", also after further references as in "Article 25(6) or
+# Article 26(4) of Directive 95/46/EC". "of this Regulation" and "of Chapter III" stay internal.
+EXTERNAL_RE = re.compile(
+    r'(?:\s*(?:,|and|or)\s+(?:Articles?|Art\.)\s+' + NUMBER + SUBDIVISIONS + r')*'
+    r'\s*(?:TFEU|TEU|thereof\b|of\s+(?:the\s+|that\s+|those\s+)?'
+    r'(?!(?:Chapter|Section|Part|Title|Annex)\s+' + NUMBER + r')[A-Z])'
+)
+
+# The rest of a line holding only a unit and its number, as a heading does
+HEADING_LINE_RE = re.compile(r'[ \t]*(?:\n|$)')
+
+# A TOC title that names a numbered unit, as in "Article 6" or "CHAPTER III General provisions"
+TITLE_RE = re.compile(r'^\s*(?P<kind>[A-Za-z]+)\.?\s+(?P<number>' + NUMBER + r')', re.IGNORECASE)
+
+# Ranges wider than this are taken to be misreads rather than expanded
+MAX_RANGE = 200
+
+
+def index_toc_units(toc_map: Dict[str, Dict[str, Any]]) -> Dict[Tuple[str, str], List[str]]:
+    """
+    Map (kind, number) to the IDs of TOC entries whose title names that unit.
+
+    Args:
+        toc_map: Header info by section ID, as from parse_toc_md
+
+    Returns:
+        Section IDs for each unit, in TOC order; a unit numbered again in another
+        part of the document (e.g. "Section 1" of each chapter) has several
+    """
+    units: Dict[Tuple[str, str], List[str]] = {}
+    for section_id, info in toc_map.items():
+        match = TITLE_RE.match(info['title'])
+        if not match:
+            continue
+        kind = UNIT_KINDS.get(match.group('kind').lower())
+        if kind:
+            units.setdefault((kind, normalize_number(match.group('number'))), []).append(section_id)
+    return units
+
+
+def toc_ancestors(toc_map: Dict[str, Dict[str, Any]]) -> Dict[str, List[str]]:
+    """Map each TOC section ID to its ancestors' IDs, innermost first."""
+    ids = list(toc_map)
+    tree = SectionTree([toc_map[section_id]['level'] for section_id in ids])
+    ancestors: Dict[str, List[str]] = {}
+    for i, section_id in enumerate(ids):
+        parent = tree.parent[i]
+        ancestors[section_id] = [ids[parent]] + ancestors[ids[parent]] if parent >= 0 else []
+    return ancestors
+
+
+def expand_numbers(numbers: str) -> List[str]:
+    """
+    Split the number list of a reference into normalized unit numbers.
+
+    "13 and 14" gives ["13", "14"]; "12 to 15" gives ["12", "13", "14", "15"].
+    """
+    result: List[str] = []
+    range_next = False
+    for match in NUMBER_RE.finditer(numbers):
+        if match.group(2):
+            range_next = True
+            continue
+
+        number = normalize_number(match.group(1))
+        if range_next and result and result[-1].isdigit() and number.isdigit():
+            low, high = int(result[-1]), int(number)
+            if 0 < high - low <= MAX_RANGE:
+                result.extend(str(n) for n in range(low + 1, high + 1))
+                range_next = False
+                continue
+        result.append(number)
+        range_next = False
+    return result
+
+
+def resolve_unit(candidates: List[str], source_id: str,
+                 ancestors: Dict[str, List[str]]) -> Optional[str]:
+    """
+    Pick the TOC entry a reference to a unit means, or None if that is unclear.
+
+    A unit numbered only once resolves directly. Otherwise the entry sharing the
+    innermost ancestor with the referring section wins (so "Section 2" means the
+    one in the same chapter); a tie leaves the reference unresolved.
+    """
+    if len(candidates) == 1:
+        return candidates[0]
+
+    source_chain = [source_id] + ancestors.get(source_id, [])
+    for ancestor in source_chain:
+        near = [c for c in candidates if c == ancestor or ancestor in ancestors.get(c, [])]
+        if len(near) == 1:
+            return near[0]
+        if near:
+            return None
+    return None
+
+
+def is_heading_line(text: str, match: re.Match) -> bool:
+    """Whether a reference match is alone on its line, as a heading such as "Article 5" is."""
+    line_start = text.rfind('\n', 0, match.start()) + 1
+    return not text[line_start:match.start()].strip() and HEADING_LINE_RE.match(text, match.end()) is not None
+
+
+def innermost_section(index: SectionIndex, starts: List[int], pos: int) -> Optional[str]:
+    """ID of the innermost located section containing a text offset."""
+    i = bisect_right(starts, pos) - 1
+    if i < 0:
+        return None
+
+    span = index.spans[i]
+    while span is not None and span.end <= pos:
+        span = index.get(span.parent) if span.parent else None
+    return span.id if span is not None else None
+
+
+def find_local_refs(toc_map: Dict[str, Dict[str, Any]],
+                    index: SectionIndex) -> Tuple[List[Dict], List[str]]:
+    """
+    Extract cross-references from the section texts with compiled patterns.
+
+    The whole document is scanned once; each reference is attributed to the
+    innermost section containing it and resolved against the TOC titles.
+    References into other instruments ("Article 16 TFEU", "Article 8 of the
+    Charter") are skipped, as are lines holding nothing but a unit's number,
+    which are headings left in the section before them when a section was
+    placed at its snippet. References to units the TOC does not name, or names
+    ambiguously, are left unresolved.
+
+    Args:
+        toc_map: Header info by section ID, as from parse_toc_md
+        index: Located sections over the untagged text
+
+    Returns:
+        Tuple of (refs in the {"from", "to"} form returned by the LLM,
+        IDs of sections that contain unresolved references)
+    """
+    units = index_toc_units(toc_map)
+    ancestors = toc_ancestors(toc_map)
+    text = index.source
+    starts = [span.start for span in index.spans]
+
+    targets: Dict[str, List[str]] = {}
+    # Insertion-ordered set of section IDs
+    unresolved: Dict[str, None] = {}
+
+    for match in REFERENCE_RE.finditer(text):
+        if EXTERNAL_RE.match(text, match.end()) or is_heading_line(text, match):
+            continue
+
+        source_id = innermost_section(index, starts, match.start())
+        if source_id is None:
+            continue
+
+        kind = UNIT_KINDS[match.group('kind').lower().rstrip('.')]
+        for number in expand_numbers(match.group('numbers')):
+            target_id = resolve_unit(units.get((kind, number), []), source_id, ancestors)
+            if target_id is None:
+                unresolved[source_id] = None
+                continue
+
+            if target_id == source_id:
+                continue
+            section_targets = targets.setdefault(source_id, [])
+            if target_id not in section_targets:
+                section_targets.append(target_id)
+
+    refs = [{"from": source_id, "to": to_ids} for source_id, to_ids in targets.items()]
+    return refs, list(unresolved)
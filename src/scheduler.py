@@ -0,0 +1,255 @@
+"""
+Scheduler Module
+Rate-limit-aware scheduling and retrying of the LLM requests of a run.
+"""
+
+import contextvars
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from openai import APIConnectionError, APIStatusError
+
+
+CHARS_PER_TOKEN = 4
+
+# Status codes worth retrying besides 5xx: request timeout, conflict, rate limit
+RETRY_STATUS = {408, 409, 429}
+
+_current: contextvars.ContextVar[Optional["RequestScheduler"]] = contextvars.ContextVar("scheduler", default=None)
+
+
+def estimate_tokens(params: Dict[str, Any]) -> int:
+    """
+    Tokens a request counts against a tokens-per-minute limit before it is sent:
+    the prompt, estimated from its length, plus the completion tokens it allows.
+    """
+    prompt_chars = sum(len(str(message.get("content") or "")) for message in params.get("messages", []))
+    return prompt_chars // CHARS_PER_TOKEN + (params.get("max_tokens") or 0)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds to wait according to the Retry-After headers of a failed request, if it sent any."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed request may succeed when sent again: timeouts, connection errors, 429s and 5xx."""
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRY_STATUS or error.status_code >= 500
+    return False
+
+
+class RequestScheduler:
+    """
+    Admits LLM requests within a requests- and tokens-per-minute budget and retries transient failures.
+
+    Both budgets are token buckets refilled continuously, so a run can use
+    its full quota without bursting past it. Each request's token cost is
+    estimated before it is sent (see estimate_tokens). Waiting requests are
+    admitted shortest first, so small requests are not held up behind
+    requests reserving many tokens. Requests failing with a timeout,
+    connection error, 429 or 5xx are retried with exponential backoff and
+    jitter, waiting at least as long as a Retry-After header asks; a 429
+    also pauses all other requests for that time.
+
+    chat_completion sends every request through the active scheduler (see
+    activate), or through one without budgets that only retries.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 max_concurrent: Optional[int] = None, max_retries: int = 6, base_delay: float = 1.0,
+                 max_delay: float = 60.0):
+        """
+        Args:
+            requests_per_minute: Request budget, or None for no limit
+            tokens_per_minute: Token budget, or None for no limit
+            max_concurrent: Requests in flight at once, or None for no limit
+            max_retries: Retries of a failing request before its error is raised
+            base_delay: Backoff before the first retry in seconds; it doubles with each retry
+            max_delay: Upper bound of the backoff in seconds
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+        self._cond = threading.Condition()
+        self._waiting: List[Tuple[int, int]] = []
+        self._order = itertools.count()
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+
+    @contextmanager
+    def activate(self) -> Iterator["RequestScheduler"]:
+        """Make this the scheduler that LLM requests in the current context go through."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled
+        self._refilled = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _wait_time(self, tokens: int, now: float) -> Optional[float]:
+        """Seconds until a request of this many tokens fits the budgets, 0 if it fits now, None if
+        it has to wait for a request in flight to finish."""
+        if self.max_concurrent and self._in_flight >= self.max_concurrent:
+            return None
+        waits = [self._paused_until - now]
+        if self.requests_per_minute and self._requests < 1:
+            waits.append((1 - self._requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute:
+            # A request larger than the whole budget goes once the budget is full
+            needed = min(tokens, self.tokens_per_minute)
+            if self._tokens < needed:
+                waits.append((needed - self._tokens) * 60 / self.tokens_per_minute)
+        return max(0.0, max(waits))
+
+    def acquire(self, tokens: int) -> None:
+        """Block until it is this request's turn and the budgets allow it, then charge them."""
+        entry = (tokens, next(self._order))
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self._wait_time(tokens, now) if self._waiting[0] == entry else None
+                    if wait == 0:
+                        break
+                    self._cond.wait(timeout=wait)
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+
+            heapq.heappop(self._waiting)
+            if self.requests_per_minute:
+                self._requests -= 1
+            if self.tokens_per_minute:
+                self._tokens -= min(tokens, self.tokens_per_minute)
+            self._in_flight += 1
+            self._cond.notify_all()
+
+    def release(self) -> None:
+        """Mark a request admitted by acquire as finished."""
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """Admit no request for the given time, e.g. after the provider reported a rate limit."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying a request that failed on the given attempt, or None to give up."""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+        requested = retry_after(error)
+        delay = max(backoff, requested) if requested is not None else backoff
+        if getattr(error, "status_code", None) == 429:
+            self.pause(delay)
+        return delay
+
+    def _send(self, create: Callable[..., Any], params: Dict[str, Any]) -> Tuple[Any, float]:
+        """
+        Send a request within the budgets, retrying transient failures. On
+        success the request is still in flight; the caller has to release it.
+        """
+        tokens = estimate_tokens(params)
+        for attempt in itertools.count():
+            self.acquire(tokens)
+            start = time.perf_counter()
+            try:
+                result = create(**params)
+            except Exception as error:
+                self.release()
+                delay = self.retry_delay(error, attempt)
+                if delay is None:
+                    raise
+                print(f"Warning: LLM request failed ({type(error).__name__}: {error}); "
+                      f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+            except BaseException:
+                self.release()
+                raise
+            else:
+                return result, time.perf_counter() - start
+            with self._cond:
+                self.retries += 1
+            time.sleep(delay)
+
+    def call(self, create: Callable[..., Any], **params: Any) -> Tuple[Any, float]:
+        """
+        Send a request with create(**params) within the budgets, retrying transient failures.
+
+        Returns:
+            Tuple of (the result of create, wall time of the attempt that succeeded,
+            without time spent waiting for the budgets or backing off)
+        """
+        result, wall_s = self._send(create, params)
+        self.release()
+        return result, wall_s
+
+    @contextmanager
+    def admitted(self, create: Callable[..., Any], **params: Any) -> Iterator[Tuple[Any, float]]:
+        """
+        Like call, but keep the request in flight until the block ends, e.g. while
+        a streamed reply is read, so that it counts against max_concurrent until then.
+        """
+        result, wall_s = self._send(create, params)
+        try:
+            yield result, wall_s
+        finally:
+            self.release()
+
+
+# Used outside an active scheduler: no budgets, retries only
+_default = RequestScheduler()
+
+
+def current_scheduler() -> RequestScheduler:
+    """The scheduler active in the current context, or the default one."""
+    return _current.get() or _default
@@ -0,0 +1,135 @@
+"""
+Section Index Module
+Standoff index of section spans over the untagged document text.
+"""
+
+import re
+from typing import Any, Dict, Iterator, List, Optional
+
+
+TAG_RE = re.compile(r'\[(START|END) SECTION ([^:\]]+): ([^\]]*)\]')
+
+
+class SectionSpan:
+    """Location of one section in the document text."""
+
+    __slots__ = ('id', 'title', 'level', 'start', 'end', 'parent')
+
+    def __init__(self, id: str, title: str, level: int, start: int, end: int, parent: Optional[str] = None):
+        self.id = id
+        self.title = title
+        self.level = level
+        self.start = start
+        self.end = end
+        self.parent = parent
+
+    def __repr__(self) -> str:
+        return (f"SectionSpan(id={self.id!r}, level={self.level}, start={self.start}, "
+                f"end={self.end}, parent={self.parent!r})")
+
+
+class SectionIndex:
+    """
+    Sections of a document kept as offsets into the untagged text.
+
+    Spans are stored in document order together with their parent section, so
+    the text of a section at any level is a direct slice of the document rather
+    than something recovered by searching for tags and stripping nested ones.
+    """
+
+    def __init__(self, text: str, spans: List[SectionSpan]):
+        self.source = text
+        self.spans = spans
+        self.by_id: Dict[str, SectionSpan] = {span.id: span for span in spans}
+        self._order: Dict[str, int] = {span.id: i for i, span in enumerate(spans)}
+
+    @classmethod
+    def from_tagged_text(cls, tagged_text: str) -> "SectionIndex":
+        """
+        Rebuild a section index from tagged text in a single pass over its tags.
+
+        Tags are cut out of the text as they are met and span offsets refer to what
+        remains, so a section's text is what stripping every tag inside it would give.
+        Tags do not record levels, so each span's level is its nesting depth (1 for
+        top-level sections).
+        """
+        pieces = []
+        spans: List[SectionSpan] = []
+        open_spans: List[SectionSpan] = []
+        clean_pos = 0
+        prev_end = 0
+
+        for match in TAG_RE.finditer(tagged_text):
+            piece = tagged_text[prev_end:match.start()]
+            pieces.append(piece)
+            clean_pos += len(piece)
+            prev_end = match.end()
+
+            kind, section_id, title = match.groups()
+            if kind == 'START':
+                span = SectionSpan(section_id, title, len(open_spans) + 1, clean_pos, clean_pos,
+                                   parent=open_spans[-1].id if open_spans else None)
+                spans.append(span)
+                open_spans.append(span)
+                continue
+
+            # Close the innermost open section with this ID, even if tags overlap
+            for i in range(len(open_spans) - 1, -1, -1):
+                if open_spans[i].id == section_id:
+                    open_spans.pop(i).end = clean_pos
+                    break
+
+        pieces.append(tagged_text[prev_end:])
+        clean_text = ''.join(pieces)
+
+        # Sections never closed run to the end of the document
+        for span in open_spans:
+            span.end = len(clean_text)
+
+        return cls(clean_text, spans)
+
+    @classmethod
+    def from_records(cls, text: str, records: List[Dict[str, Any]]) -> "SectionIndex":
+        """Rebuild a section index over text from the records to_records returned for it."""
+        return cls(text, [SectionSpan(**record) for record in records])
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """Spans as plain dicts in document order, e.g. for saving as JSON."""
+        return [{name: getattr(span, name) for name in SectionSpan.__slots__} for span in self.spans]
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def __iter__(self) -> Iterator[SectionSpan]:
+        return iter(self.spans)
+
+    def __contains__(self, section_id: str) -> bool:
+        return section_id in self.by_id
+
+    def get(self, section_id: str) -> Optional[SectionSpan]:
+        """Return the span for a section ID, or None if it was not located."""
+        return self.by_id.get(section_id)
+
+    def text(self, section_id: str) -> str:
+        """Return the text of a section, including its subsections, or "" if it was not located."""
+        span = self.by_id.get(section_id)
+        if span is None:
+            return ""
+        return self.source[span.start:span.end].strip()
+
+    def own_text(self, section_id: str) -> str:
+        """Return the text of a section without its subsections, or "" if it was not located."""
+        span = self.by_id.get(section_id)
+        if span is None:
+            return ""
+
+        pieces = []
+        pos = span.start
+        for child in self.spans[self._order[section_id] + 1:]:
+            if child.start >= span.end:
+                break
+            if child.parent == section_id:
+                pieces.append(self.source[pos:child.start])
+                pos = max(pos, child.end)
+        pieces.append(self.source[pos:span.end])
+        return "".join(pieces).strip()
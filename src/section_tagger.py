@@ -4,7 +4,30 @@ Tags sections in raw text based on markdown structure.
 """
 
 import re
-from typing import List, Dict, Optional
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
+
+import numpy as np
+
+from .section_index import SectionIndex, SectionSpan
+from .section_tree import SectionTree
+
+
+WORD_RE = re.compile(r'\w+')
+
+# First non-blank character of each line, where a header can start
+LINE_START_RE = re.compile(r'(?:^|\n)\s*(?=\S)')
+
+# What may follow a header, in order of preference. A header in all caps alone
+# on its line is already covered by the first context.
+HEADER_CONTEXT_RES = [
+    # Header at start of line (most reliable)
+    re.compile(r'(?:\s*$|\s+[A-Z]|\s*\n)', re.IGNORECASE | re.MULTILINE),
+    # Header followed by a number (like "Article 5", "Section 1.1")
+    re.compile(r'\s+[0-9]+(?:\.[0-9]+)*(?:\s|$|\n)', re.IGNORECASE | re.MULTILINE),
+    # Header followed by a colon or dash (like "CHAPTER II:")
+    re.compile(r'\s*[:\-]', re.IGNORECASE | re.MULTILINE),
+]
 
 
 def get_header_level(line: str) -> int:
@@ -59,7 +82,42 @@ def normalize_text_for_word_matching(text: str) -> str:
     return text.strip()
 
 
-def find_word_sequence(raw_text: str, search_words: str, start_pos: int = 0) -> Optional[int]:
+class NormalizedIndex:
+    """
+    Normalized word stream of a document, built once and shared by every lookup.
+
+    Tokens are the words produced by normalize_text_for_word_matching, each
+    paired with the character offset where it starts in the original text, so
+    a match on the word stream maps straight back to a position in raw_text.
+    The same stream is kept as an array of integer token IDs for the
+    vectorized fuzzy matcher.
+    """
+
+    def __init__(self, raw_text: str):
+        self.raw_text = raw_text
+        self.tokens: List[str] = []
+        self.offsets: List[int] = []
+        self.positions: Dict[str, List[int]] = {}
+
+        for i, match in enumerate(WORD_RE.finditer(raw_text)):
+            token = match.group().lower()
+            self.tokens.append(token)
+            self.offsets.append(match.start())
+            self.positions.setdefault(token, []).append(i)
+        
+        self.vocab: Dict[str, int] = {token: token_id for token_id, token in enumerate(self.positions)}
+        self.ids = np.fromiter((self.vocab[token] for token in self.tokens), dtype=np.int32, count=len(self.tokens))
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def token_at(self, char_pos: int) -> int:
+        """Index of the first token that starts at or after a character position."""
+        return bisect_left(self.offsets, char_pos)
+
+
+def find_word_sequence(raw_text: str, search_words: str, start_pos: int = 0, end_pos: Optional[int] = None,
+                       index: Optional[NormalizedIndex] = None) -> Optional[int]:
     """Find a sequence of words in the raw text, ignoring formatting and punctuation."""
     if not search_words:
         return None
@@ -71,180 +129,162 @@ def find_word_sequence(raw_text: str, search_words: str, start_pos: int = 0) ->
     if len(search_word_list) < 5:  # Need at least 5 words for reliable matching with longer sequences
         return None
     
+    # Callers tagging many sections should pass a shared index
+    if index is None:
+        index = NormalizedIndex(raw_text)
+    
     # Try exact matching first
-    exact_pos = find_word_sequence_exact(raw_text, search_word_list, start_pos)
+    exact_pos = find_word_sequence_exact(index, search_word_list, start_pos, end_pos)
     if exact_pos is not None:
         return exact_pos
     
     # If exact matching fails, try fuzzy matching
-    return find_word_sequence_fuzzy(raw_text, search_word_list, start_pos)
+    return find_word_sequence_fuzzy(index, search_word_list, start_pos, end_pos)
 
 
-def find_word_sequence_exact(raw_text: str, search_word_list: List[str], start_pos: int = 0) -> Optional[int]:
-    """Find exact word sequence match."""
-    # Normalize the raw text in chunks to avoid memory issues with very large documents
-    chunk_size = 5000  # Process 5000 characters at a time
-    overlap = 500      # Overlap to catch sequences that span chunks
-    
-    pos = start_pos
-    while pos < len(raw_text):
-        # Get chunk with overlap
-        chunk_end = min(pos + chunk_size, len(raw_text))
-        chunk = raw_text[pos:chunk_end + overlap]
-        
-        # Normalize the chunk
-        normalized_chunk = normalize_text_for_word_matching(chunk)
-        chunk_words = normalized_chunk.split()
-        
-        # Look for the word sequence in this chunk
-        for i in range(len(chunk_words) - len(search_word_list) + 1):
-            # Check if we have a match starting at position i
-            match = True
-            for j, search_word in enumerate(search_word_list):
-                if i + j >= len(chunk_words) or chunk_words[i + j] != search_word:
-                    match = False
-                    break
-            
-            if match:
-                # Found the sequence! Now find the position in the original text
-                return estimate_position_in_original(raw_text, pos, chunk, chunk_words, i)
-        
-        # Move to next chunk
-        pos += chunk_size
-        if pos >= len(raw_text):
+def find_word_sequence_exact(index: NormalizedIndex, search_word_list: List[str], start_pos: int = 0,
+                             end_pos: Optional[int] = None) -> Optional[int]:
+    """Find exact word sequence match starting between start_pos and end_pos."""
+    return next(iter_word_sequence_exact(index, search_word_list, start_pos, end_pos), None)
+
+
+def iter_word_sequence_exact(index: NormalizedIndex, search_word_list: List[str], start_pos: int = 0,
+                             end_pos: Optional[int] = None) -> Iterator[int]:
+    """Yield the position of every exact word sequence match, in document order."""
+    first_token = index.token_at(start_pos)
+    stop_token = len(index) if end_pos is None else index.token_at(end_pos)
+    
+    # Anchor on the rarest search word so only its occurrences need checking
+    anchor = min(range(len(search_word_list)),
+                 key=lambda j: len(index.positions.get(search_word_list[j], ())))
+    occurrences = index.positions.get(search_word_list[anchor], [])
+    
+    for p in occurrences[bisect_left(occurrences, first_token + anchor):]:
+        i = p - anchor
+        if i >= stop_token:
             break
-    
-    return None
+        if index.tokens[i:i + len(search_word_list)] == search_word_list:
+            yield index.offsets[i]
 
 
-def find_word_sequence_fuzzy(raw_text: str, search_word_list: List[str], start_pos: int = 0) -> Optional[int]:
+def find_word_sequence_fuzzy(index: NormalizedIndex, search_word_list: List[str], start_pos: int = 0,
+                             end_pos: Optional[int] = None) -> Optional[int]:
     """Find fuzzy word sequence match - allows for some words to be different."""
-    chunk_size = 5000
-    overlap = 500
     min_match_ratio = 0.8  # Require at least 80% of words to match
     
-    pos = start_pos
-    best_match = None
-    best_score = 0
+    first_token = index.token_at(start_pos)
+    last_token = len(index) - len(search_word_list)
+    if end_pos is not None:
+        last_token = min(last_token, index.token_at(end_pos) - 1)
     
-    while pos < len(raw_text):
-        chunk_end = min(pos + chunk_size, len(raw_text))
-        chunk = raw_text[pos:chunk_end + overlap]
-        
-        normalized_chunk = normalize_text_for_word_matching(chunk)
-        chunk_words = normalized_chunk.split()
-        
-        # Look for fuzzy matches in this chunk
-        for i in range(len(chunk_words) - len(search_word_list) + 1):
-            # Count how many words match in sequence
-            matches = 0
-            for j, search_word in enumerate(search_word_list):
-                if i + j < len(chunk_words) and chunk_words[i + j] == search_word:
-                    matches += 1
-            
-            match_ratio = matches / len(search_word_list)
-            
-            # If this is a good enough match and better than what we've found
-            if match_ratio >= min_match_ratio and match_ratio > best_score:
-                best_score = match_ratio
-                best_match = estimate_position_in_original(raw_text, pos, chunk, chunk_words, i)
-        
-        pos += chunk_size
-        if pos >= len(raw_text):
-            break
+    if last_token < first_token:
+        return None
+    
+    # Count matching words for every window at once: one vectorized comparison
+    # of the shifted token-ID stream per search word
+    window_count = last_token - first_token + 1
+    match_counts = np.zeros(window_count, dtype=np.int32)
+    for j, search_word in enumerate(search_word_list):
+        token_id = index.vocab.get(search_word)
+        if token_id is not None:
+            shifted = index.ids[first_token + j:first_token + j + window_count]
+            match_counts += shifted == token_id
+    
+    # argmax picks the earliest of equally good windows
+    best = int(match_counts.argmax())
+    match_ratio = match_counts[best] / len(search_word_list)
     
-    return best_match
+    # Only accept the match if a good enough fraction of words agree
+    if match_ratio >= min_match_ratio:
+        return index.offsets[first_token + best]
+    
+    return None
 
 
-def estimate_position_in_original(raw_text: str, chunk_start: int, chunk: str, chunk_words: List[str], word_index: int) -> int:
-    """Estimate the position in the original text based on word position in normalized chunk."""
-    if word_index == 0:
-        return chunk_start
+class HeaderLocator:
+    """
+    Candidate header positions for a set of section titles, found in one pass over the document.
+    
+    All titles are compiled into a single case-insensitive character trie that is walked
+    from the first non-blank character of every line. Each title occurrence is recorded
+    under every header context (HEADER_CONTEXT_RES) that the text following it satisfies.
+    """
     
-    # Get the words before our match
-    words_before = chunk_words[:word_index]
-    words_before_text = ' '.join(words_before)
+    _END = ''  # Trie key marking the end of a title
     
-    # Estimate position in original chunk
-    if words_before_text:
-        # Look for a substring that contains these words
-        chunk_lower = chunk.lower()
-        estimated_pos = 0
-        for word in words_before:
-            word_pos = chunk_lower.find(word, estimated_pos)
-            if word_pos >= 0:
-                estimated_pos = word_pos + len(word)
+    def __init__(self, raw_text: str, titles: Iterable[str]):
+        self.raw_text = raw_text
+        self.candidates: Dict[str, List[List[int]]] = {}
         
-        return chunk_start + estimated_pos
-    else:
-        return chunk_start
+        trie: Dict = {}
+        for title in titles:
+            key = title.lower()
+            if not key or key in self.candidates:
+                continue
+            self.candidates[key] = [[] for _ in HEADER_CONTEXT_RES]
+            node = trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[self._END] = key
+        
+        for line_match in LINE_START_RE.finditer(raw_text):
+            self._match_titles(trie, line_match.end())
+    
+    def _match_titles(self, trie: Dict, pos: int) -> None:
+        """Record every title that starts at pos, under each context it appears in."""
+        node = trie
+        for end in range(pos, len(self.raw_text)):
+            for char in self.raw_text[end].lower():
+                node = node.get(char)
+                if node is None:
+                    return
+            key = node.get(self._END)
+            if key is not None:
+                for context_re, positions in zip(HEADER_CONTEXT_RES, self.candidates[key]):
+                    if context_re.match(self.raw_text, end + 1):
+                        positions.append(pos)
+    
+    def find_all(self, header_text: str, start_pos: int = 0, end_pos: Optional[int] = None) -> List[int]:
+        """All positions of a header between start_pos and end_pos, in its most preferred context."""
+        for positions in self.candidates.get(header_text.lower(), []):
+            first = bisect_left(positions, start_pos)
+            last = len(positions) if end_pos is None else bisect_left(positions, end_pos)
+            if first < last:
+                return positions[first:last]
+        return []
+    
+    def find(self, header_text: str, start_pos: int = 0, end_pos: Optional[int] = None) -> Optional[int]:
+        """First position of a header between start_pos and end_pos, or None."""
+        positions = self.find_all(header_text, start_pos, end_pos)
+        return positions[0] if positions else None
 
 
-def find_header_directly(raw_text: str, header_text: str, start_pos: int = 0) -> Optional[int]:
+def find_header_directly(raw_text: str, header_text: str, start_pos: int = 0,
+                         end_pos: Optional[int] = None, locator: Optional[HeaderLocator] = None) -> Optional[int]:
     """Try to find a header directly by looking for its exact text in header-like contexts only."""
     if not header_text:
         return None
     
-    # Try different variations of the header
-    header_variations = [
-        header_text,
-        header_text.upper(),
-        header_text.lower(),
-        header_text.title(),
-    ]
-    
-    for variation in header_variations:
-        escaped_header = re.escape(variation)
-        
-        # Strategy 1: Header at start of line (most reliable)
-        pattern = r'(?:^|\n)\s*' + escaped_header + r'(?:\s*$|\s+[A-Z]|\s*\n)'
-        try:
-            match = re.search(pattern, raw_text[start_pos:], re.IGNORECASE | re.MULTILINE)
-            if match:
-                # Return position of the actual header text
-                match_text = match.group()
-                header_pos_in_match = match_text.lower().find(variation.lower())
-                if header_pos_in_match >= 0:
-                    return start_pos + match.start() + header_pos_in_match
-        except re.error:
-            continue
-        
-        # Strategy 2: Header with typical context patterns
-        header_context_patterns = [
-            # Header followed by a number (like "Article 5", "Section 1.1")
-            r'(?:^|\n)\s*' + escaped_header + r'\s+[0-9]+(?:\.[0-9]+)*(?:\s|$|\n)',
-            # Header followed by a colon or dash (like "CHAPTER II:")
-            r'(?:^|\n)\s*' + escaped_header + r'\s*[:\-]',
-            # Header in all caps at start of line (like "CHAPTER II")
-            r'(?:^|\n)\s*' + escaped_header.upper() + r'(?:\s*$|\s*\n)',
-        ]
-        
-        for context_pattern in header_context_patterns:
-            try:
-                match = re.search(context_pattern, raw_text[start_pos:], re.IGNORECASE | re.MULTILINE)
-                if match:
-                    # Find where the actual header text starts within the match
-                    match_text = match.group()
-                    header_pos_in_match = match_text.lower().find(variation.lower())
-                    if header_pos_in_match >= 0:
-                        return start_pos + match.start() + header_pos_in_match
-            except re.error:
-                continue
+    # Callers tagging many sections should pass a locator built for all their titles
+    if locator is None:
+        locator = HeaderLocator(raw_text, [header_text])
     
-    return None
+    return locator.find(header_text, start_pos, end_pos)
 
 
-def find_header_position_from_sequence(raw_text: str, header_text: str, sequence_pos: int) -> Optional[int]:
+def find_header_position_from_sequence(raw_text: str, header_text: str, sequence_pos: int,
+                                       min_pos: int = 0) -> Optional[int]:
     """
     Given the position of a word sequence, find where the actual header starts.
     The sequence represents content that comes AFTER the header.
+    The header is never placed before min_pos.
     """
     if sequence_pos <= 0:
         return None
     
     # Look backwards from the sequence position to find the header
     # We'll search in a reasonable window before the sequence
-    search_start = max(0, sequence_pos - 200)  # Smaller window for word-based approach
+    search_start = max(min_pos, sequence_pos - 200)  # Smaller window for word-based approach
     search_text = raw_text[search_start:sequence_pos]
     
     # Try to find the header text in this window
@@ -261,11 +301,232 @@ def find_header_position_from_sequence(raw_text: str, header_text: str, sequence
         if pos >= 0:
             return search_start + pos
     
+    # The header may be broken over lines differently from the TOC title, as in
+    # "Article 5\n\nPrinciples ..."; leaving it out would put it in the previous section
+    words = header_text.split()
+    if words:
+        pattern = r'\s+'.join(re.escape(word) for word in words)
+        matches = list(re.finditer(pattern, search_text, re.IGNORECASE))
+        if matches:
+            return search_start + matches[-1].start()
+    
     # If we can't find the exact header text, return the sequence position
     # This is a fallback - the tag will be placed at the content start
     return sequence_pos
 
 
+def locate_section(section: Dict, raw_text: str, index: NormalizedIndex, locator: HeaderLocator,
+                   start_pos: int = 0, end_pos: Optional[int] = None) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Locate a single TOC section in the raw text, looking only between start_pos and end_pos.
+    
+    Returns:
+        Tuple of (header_pos, sequence_pos), either of which may be None
+    """
+    header_pos = None
+    sequence_pos = None
+    
+    if end_pos is not None and end_pos <= start_pos:
+        return header_pos, sequence_pos
+    
+    # Strategy 1: Use the word sequence to find the section
+    if section['start_text']:
+        sequence_pos = find_word_sequence(raw_text, section['start_text'], start_pos, end_pos, index=index)
+        if sequence_pos is not None:
+            # The sequence represents content AFTER the header
+            # So we need to find where the header actually starts
+            header_pos = find_header_position_from_sequence(raw_text, section['title'], sequence_pos, start_pos)
+    
+    # Strategy 2: If word sequence search fails, try to find the header directly
+    if header_pos is None and section['title']:
+        header_pos = find_header_directly(raw_text, section['title'], start_pos, end_pos, locator=locator)
+    
+    # Strategy 3: Try finding the section ID if it appears in text (last resort)
+    if header_pos is None and section['id']:
+        id_pattern = r'\b' + re.escape(section['id']) + r'\b'
+        try:
+            match = re.compile(id_pattern, re.IGNORECASE).search(
+                raw_text, start_pos, len(raw_text) if end_pos is None else end_pos)
+            if match:
+                header_pos = match.start()
+        except re.error:
+            pass
+    
+    return header_pos, sequence_pos
+
+
+def section_candidates(section: Dict, raw_text: str, index: NormalizedIndex,
+                       locator: HeaderLocator) -> List[Tuple[int, Optional[int]]]:
+    """
+    List the plausible placements of a section anywhere in the document.
+    
+    The first candidate is what locate_section finds searching from the top. When that
+    came from an exact word-sequence match, every later verbatim repeat of the snippet
+    (boilerplate) is added as a further candidate; when it came from the header itself,
+    every later occurrence of the header in the same context is.
+    """
+    header_pos, sequence_pos = locate_section(section, raw_text, index, locator)
+    if header_pos is None:
+        return []
+    
+    candidates = [(header_pos, sequence_pos)]
+    if sequence_pos is not None:
+        search_word_list = normalize_text_for_word_matching(section['start_text']).split()
+        for pos in iter_word_sequence_exact(index, search_word_list, sequence_pos + 1):
+            candidates.append((find_header_position_from_sequence(raw_text, section['title'], pos), pos))
+    elif header_pos == locator.find(section['title']):
+        for pos in locator.find_all(section['title'], header_pos + 1):
+            candidates.append((pos, None))
+    
+    return candidates
+
+
+def cursor_align_sections(sections: List[Dict], raw_text: str, index: NormalizedIndex,
+                          locator: HeaderLocator) -> Optional[List[Tuple[Optional[int], Optional[int]]]]:
+    """
+    Locate sections in TOC order with a cursor that only moves forward through the document.
+    
+    Each section is looked up from where the previous one was placed, by an exact
+    match of its snippet or, failing that, of its header; both come from the
+    position lists of the index and locator, so no lookup rescans the text. A
+    section found neither way is searched for afterwards, fuzzy matches included,
+    only in the gap between its placed neighbours. Returns None if a section is
+    not found in its gap either, for the caller to fall back to lis_align_sections.
+    
+    Args:
+        sections: Sections from parse_markdown_structure, in TOC order
+        raw_text: The full document text
+        index: NormalizedIndex built over raw_text
+        locator: HeaderLocator built over raw_text for the section titles
+    
+    Returns:
+        One (header_pos, sequence_pos) tuple per section, as from locate_section, or None
+    """
+    located: List[Tuple[Optional[int], Optional[int]]] = [(None, None)] * len(sections)
+    cursor = 0
+    for i, section in enumerate(sections):
+        words = normalize_text_for_word_matching(section['start_text']).split()
+        sequence_pos = find_word_sequence_exact(index, words, cursor) if len(words) >= 5 else None
+        if sequence_pos is not None:
+            header_pos = find_header_position_from_sequence(raw_text, section['title'], sequence_pos, cursor)
+        else:
+            header_pos = locator.find(section['title'], cursor) if section['title'] else None
+        if header_pos is not None:
+            located[i] = (header_pos, sequence_pos)
+            cursor = header_pos
+    
+    # Upper bound of each missed section's gap: the next placed header in TOC order
+    next_placed: List[Optional[int]] = [None] * len(sections)
+    upper = None
+    for i in range(len(sections) - 1, -1, -1):
+        next_placed[i] = upper
+        if located[i][0] is not None:
+            upper = located[i][0]
+    
+    lower = 0
+    for i, section in enumerate(sections):
+        if located[i][0] is None:
+            located[i] = locate_section(section, raw_text, index, locator, lower, next_placed[i])
+            if located[i][0] is None:
+                return None
+        lower = located[i][0]
+    
+    return located
+
+
+def align_sections(sections: List[Dict], raw_text: str, index: NormalizedIndex,
+                   locator: HeaderLocator) -> List[Tuple[Optional[int], Optional[int]]]:
+    """
+    Locate sections so that their positions follow TOC order through the document.
+    
+    The forward-cursor alignment (cursor_align_sections) is tried first; only
+    if it cannot place every section are they aligned with lis_align_sections.
+    
+    Args:
+        sections: Sections from parse_markdown_structure, in TOC order
+        raw_text: The full document text
+        index: NormalizedIndex built over raw_text
+        locator: HeaderLocator built over raw_text for the section titles
+    
+    Returns:
+        One (header_pos, sequence_pos) tuple per section, as from locate_section
+    """
+    located = cursor_align_sections(sections, raw_text, index, locator)
+    if located is None:
+        located = lis_align_sections(sections, raw_text, index, locator)
+    return located
+
+
+def lis_align_sections(sections: List[Dict], raw_text: str, index: NormalizedIndex,
+                       locator: HeaderLocator) -> List[Tuple[Optional[int], Optional[int]]]:
+    """
+    Locate sections in TOC order from candidate placements anywhere in the document.
+    
+    Candidates for every section are aligned by a longest-increasing-subsequence DP:
+    the longest chain that takes at most one candidate per section and never moves
+    backwards in the text. Sections left out of the chain are then searched for only
+    in the gap between their placed neighbours. A section found nowhere in its gap is
+    listed out of document order in the TOC, and keeps its best match from the top.
+    
+    Args:
+        sections: Sections from parse_markdown_structure, in TOC order
+        raw_text: The full document text
+        index: NormalizedIndex built over raw_text
+        locator: HeaderLocator built over raw_text for the section titles
+    
+    Returns:
+        One (header_pos, sequence_pos) tuple per section, as from locate_section
+    """
+    candidates = [section_candidates(section, raw_text, index, locator) for section in sections]
+    
+    # Patience-sort LIS over (position, section) keys. A section's candidates are fed in
+    # descending position order so no chain can pick two of them.
+    items: List[Tuple[int, Tuple[int, Optional[int]]]] = []
+    predecessors: List[int] = []
+    tails: List[Tuple[int, int]] = []
+    tail_items: List[int] = []
+    
+    for i, options in enumerate(candidates):
+        for candidate in sorted(options, key=lambda c: c[0], reverse=True):
+            key = (candidate[0], i)
+            k = bisect_left(tails, key)
+            items.append((i, candidate))
+            predecessors.append(tail_items[k - 1] if k else -1)
+            if k == len(tails):
+                tails.append(key)
+                tail_items.append(len(items) - 1)
+            else:
+                tails[k] = key
+                tail_items[k] = len(items) - 1
+    
+    located: List[Tuple[Optional[int], Optional[int]]] = [(None, None)] * len(sections)
+    item = tail_items[-1] if tail_items else -1
+    while item >= 0:
+        i, candidate = items[item]
+        located[i] = candidate
+        item = predecessors[item]
+    
+    # Upper bound of each section's gap: the next placed header in TOC order
+    next_placed: List[Optional[int]] = [None] * len(sections)
+    upper = None
+    for i in range(len(sections) - 1, -1, -1):
+        next_placed[i] = upper
+        if located[i][0] is not None:
+            upper = located[i][0]
+    
+    lower = 0
+    for i, section in enumerate(sections):
+        if located[i][0] is None:
+            located[i] = locate_section(section, raw_text, index, locator, lower, next_placed[i])
+            if located[i][0] is None and candidates[i]:
+                located[i] = candidates[i][0]
+                continue
+        if located[i][0] is not None:
+            lower = located[i][0]
+    
+    return located
+
+
 def parse_markdown_structure(markdown_text: str) -> List[Dict]:
     """Parse markdown to extract section structure with hierarchy."""
     lines = markdown_text.split('\n')
@@ -301,54 +562,63 @@ def parse_markdown_structure(markdown_text: str) -> List[Dict]:
     return sections
 
 
-def tag_sections(markdown_text: str, raw_text: str) -> str:
+def tag_sections(markdown_text: str, raw_text: str, monotonic: bool = True) -> str:
     """
     Tag sections in raw text based on markdown structure.
     
+    Callers that only need section offsets should use locate_sections, which
+    skips building the tagged string.
+    
     Args:
         markdown_text: The markdown TOC with section headers and word sequences
         raw_text: The full document text to be tagged
+        monotonic: Align sections to the document in TOC order (see align_sections),
+            as analyze_document does by default; False searches for each one
+            independently from the top
     
     Returns:
         The raw text with section tags inserted
     """
+    return render_tagged_text(raw_text, locate_sections(markdown_text, raw_text, monotonic))
+
+
+def locate_sections(markdown_text: str, raw_text: str, monotonic: bool = True) -> SectionIndex:
+    """
+    Locate the span of every section in raw text based on markdown structure.
+    
+    Args:
+        markdown_text: The markdown TOC with section headers and word sequences
+        raw_text: The full document text
+        monotonic: Align sections to the document in TOC order (see align_sections),
+            as analyze_document does by default; False searches for each one
+            independently from the top
+    
+    Returns:
+        SectionIndex over raw_text with spans in document order, including the
+        auto-introduction/auto-conclusion sections
+    """
     # Parse markdown structure
     sections = parse_markdown_structure(markdown_text)
     if not sections:
-        return raw_text
+        return SectionIndex(raw_text, [])
     
     # Sort sections by their appearance order
     sections.sort(key=lambda x: x['line_index'])
     
+    # Normalize the document and find every title's header candidates once;
+    # every lookup below shares them
+    index = NormalizedIndex(raw_text)
+    locator = HeaderLocator(raw_text, [section['title'] for section in sections])
+    
     # First pass: Find all section positions
     section_positions = {}
     
-    for i, section in enumerate(sections):
-        header_pos = None
-        sequence_pos = None
-        
-        # Strategy 1: Use the word sequence to find the section
-        if section['start_text']:
-            sequence_pos = find_word_sequence(raw_text, section['start_text'], 0)
-            if sequence_pos is not None:
-                # The sequence represents content AFTER the header
-                # So we need to find where the header actually starts
-                header_pos = find_header_position_from_sequence(raw_text, section['title'], sequence_pos)
-        
-        # Strategy 2: If word sequence search fails, try to find the header directly
-        if header_pos is None and section['title']:
-            header_pos = find_header_directly(raw_text, section['title'], 0)
-        
-        # Strategy 3: Try finding the section ID if it appears in text (last resort)
-        if header_pos is None and section['id']:
-            id_pattern = r'\b' + re.escape(section['id']) + r'\b'
-            try:
-                match = re.search(id_pattern, raw_text, re.IGNORECASE)
-                if match:
-                    header_pos = match.start()
-            except re.error:
-                pass
-        
+    if monotonic:
+        located = align_sections(sections, raw_text, index, locator)
+    else:
+        located = [locate_section(section, raw_text, index, locator) for section in sections]
+    
+    for section, (header_pos, sequence_pos) in zip(sections, located):
         if header_pos is not None:
             section_positions[section['id']] = {
                 'section': section,
@@ -366,32 +636,22 @@ def tag_sections(markdown_text: str, raw_text: str) -> str:
     sorted_positions = sorted(section_positions.items(), key=lambda x: x[1]['start'])
     
     # Second pass: Determine end positions based on hierarchy
+    # A section ends where the next section at the same level or higher (lower number)
+    # starts, which is where its subtree in document order ends
+    tree = SectionTree([pos_info['section']['level'] for _, pos_info in sorted_positions])
     tagged_positions = []
     
     for i, (sec_id, pos_info) in enumerate(sorted_positions):
         section = pos_info['section']
-        start_pos = pos_info['start']
-        
-        # Find where this section ends
-        # Look through all subsequent sections in document order
-        end_pos = len(raw_text)  # Default to end of document
-        
-        for j in range(i + 1, len(sorted_positions)):
-            next_id, next_pos_info = sorted_positions[j]
-            next_section = next_pos_info['section']
-            next_start = next_pos_info['start']
-            
-            # If the next section is at the same level or higher (lower number), this is our end
-            if next_section['level'] <= section['level']:
-                end_pos = next_start
-                break
+        subtree_end = tree.subtree_end[i]
         
         tagged_positions.append({
             'id': section['id'],
             'title': section['title'],
             'level': section['level'],
-            'start': start_pos,
-            'end': end_pos
+            'start': pos_info['start'],
+            'end': sorted_positions[subtree_end][1]['start'] if subtree_end < len(tree) else len(raw_text),
+            'parent': sorted_positions[tree.parent[i]][0] if tree.parent[i] >= 0 else None
         })
     
     # Add auto-introduction and auto-conclusion sections
@@ -434,18 +694,47 @@ def tag_sections(markdown_text: str, raw_text: str) -> str:
                 'end': len(raw_text)
             }]
     
-    # Sort positions by start position (in reverse for insertion)
-    tagged_positions.sort(key=lambda x: x['start'], reverse=True)
+    spans = [SectionSpan(pos['id'], pos['title'], pos['level'], pos['start'], pos['end'], pos.get('parent'))
+             for pos in tagged_positions]
     
-    # Insert tags into the text
-    result = raw_text
-    for pos in tagged_positions:
-        # Insert end tag
-        end_tag = f" [END SECTION {pos['id']}: {pos['title']}]"
-        result = result[:pos['end']] + end_tag + result[pos['end']:]
-        
-        # Insert start tag
-        start_tag = f"[START SECTION {pos['id']}: {pos['title']}] "
-        result = result[:pos['start']] + start_tag + result[pos['start']:]
+    return SectionIndex(raw_text, spans)
+
+
+def render_tagged_text(raw_text: str, spans: Iterable[SectionSpan]) -> str:
+    """
+    Insert START/END tags for located section spans into the raw text.
+    
+    All tag boundaries are sorted once and the text is joined in a single pass.
+    Where several boundaries share an offset, sections ending there close before
+    sections starting there open, and nested sections close in reverse order of
+    opening, so the tags always nest properly.
+    
+    Args:
+        raw_text: The full document text
+        spans: Section spans, e.g. the SectionIndex returned by locate_sections
     
-    return result
\ No newline at end of file
+    Returns:
+        The raw text with section tags inserted
+    """
+    events = []
+    for order, span in enumerate(spans):
+        start_tag = f"[START SECTION {span.id}: {span.title}] "
+        end_tag = f" [END SECTION {span.id}: {span.title}]"
+        
+        # Sort keys: offset, then closing (0) before opening (1); an empty span
+        # must open before it closes, so its end sorts last (2)
+        closing_rank = 0 if span.end > span.start else 2
+        events.append((span.start, 1, -span.end, order, start_tag))
+        events.append((span.end, closing_rank, -span.start, -order, end_tag))
+    
+    events.sort()
+    
+    pieces = []
+    prev_pos = 0
+    for pos, _, _, _, tag in events:
+        pieces.append(raw_text[prev_pos:pos])
+        pieces.append(tag)
+        prev_pos = pos
+    pieces.append(raw_text[prev_pos:])
+    
+    return ''.join(pieces)
\ No newline at end of file
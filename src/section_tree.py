@@ -0,0 +1,63 @@
+"""
+Section Tree Module
+Builds the section hierarchy from sections listed in order with their levels.
+"""
+
+from typing import Dict, List, Sequence
+
+
+class SectionTree:
+    """
+    Section hierarchy built with a single stack pass over sections in order.
+
+    Node i is the i-th section given. Its parent is the nearest earlier section
+    with a lower level, and its subtree is the contiguous run of nodes that ends
+    at the next section with the same or a lower level.
+
+    Attributes:
+        levels: Level of each node
+        parent: Parent node index, or -1 for top-level nodes
+        children: Child node indices in order
+        depth: 0 for top-level nodes, parent depth + 1 otherwise
+        subtree_end: Index one past the last node of each node's subtree
+    """
+
+    def __init__(self, levels: Sequence[int]):
+        count = len(levels)
+        self.levels = list(levels)
+        self.parent = [-1] * count
+        self.children: List[List[int]] = [[] for _ in range(count)]
+        self.depth = [0] * count
+        self.subtree_end = [count] * count
+
+        stack: List[int] = []
+        for i, level in enumerate(self.levels):
+            # Every open section at this level or deeper ends where this one starts
+            while stack and self.levels[stack[-1]] >= level:
+                self.subtree_end[stack.pop()] = i
+
+            if stack:
+                self.parent[i] = stack[-1]
+                self.children[stack[-1]].append(i)
+                self.depth[i] = self.depth[stack[-1]] + 1
+            stack.append(i)
+
+    @classmethod
+    def from_sections(cls, sections: List[Dict]) -> "SectionTree":
+        """Build the tree for section dicts with a 'level' key, as from parse_markdown_structure."""
+        return cls([section['level'] for section in sections])
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def is_leaf(self, node: int) -> bool:
+        """Whether a node has no subsections."""
+        return not self.children[node]
+
+    def leaves(self) -> List[int]:
+        """Indices of all leaf nodes, in order."""
+        return [i for i in range(len(self.levels)) if not self.children[i]]
+
+    def subtree(self, node: int) -> range:
+        """Indices of a node and all its descendants."""
+        return range(node, self.subtree_end[node])
@@ -0,0 +1,174 @@
+"""
+Telemetry Module
+Records timings, memory, token usage and estimated cost of pipeline stages and LLM calls.
+"""
+
+import contextvars
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+# USD per million tokens: (input, cached input, output)
+MODEL_PRICES = {
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+_current: contextvars.ContextVar[Optional["Telemetry"]] = contextvars.ContextVar("telemetry", default=None)
+_current_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("telemetry_stage", default=None)
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, cached_tokens: int,
+                  completion_tokens: int) -> Optional[float]:
+    """Estimated USD cost of a call, with cached prompt tokens at the discounted rate, or None for unknown models."""
+    prices = MODEL_PRICES.get(model or "")
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1_000_000
+
+
+def process_peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of the whole process since it started in MB, where the platform reports it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class Telemetry:
+    """
+    Collects one record per pipeline stage and per LLM call of a run.
+
+    A run activates its Telemetry (see activate) and wraps each stage in
+    stage(name); chat_completion reports every call to the active Telemetry
+    through record_call, so no extra argument has to be passed down to the
+    functions making the calls. Work submitted to thread pools must run in a
+    copy of the submitting context (contextvars.copy_context().run) for its
+    calls to be attributed.
+
+    CPU and memory figures are process-wide: cpu_s includes the CPU time of
+    every thread of the process during the stage, so stages overlapping each
+    other or another document of a batch are counted in each, and the memory
+    figures are the process's peak resident memory, which only ever grows.
+    Work run in other processes (see local_executor) is not counted. Use
+    --profile for per-stage allocations.
+    """
+
+    def __init__(self):
+        self.stages: List[Dict[str, Any]] = []
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self) -> Iterator["Telemetry"]:
+        """Make this the Telemetry that LLM calls in the current context report to."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Measure wall time, process CPU time and process peak memory of a stage,
+        and attribute LLM calls made in it. rss_growth_mb is how far the
+        process's peak resident memory rose during the stage.
+        """
+        token = _current_stage.set(name)
+        rss_start = process_peak_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            record = {
+                "stage": name,
+                "wall_s": round(time.perf_counter() - wall_start, 4),
+                "cpu_s": round(time.process_time() - cpu_start, 4),
+                "process_peak_rss_mb": process_peak_rss_mb(),
+            }
+            record["rss_growth_mb"] = (round(record["process_peak_rss_mb"] - rss_start, 1)
+                                       if rss_start is not None else None)
+            _current_stage.reset(token)
+            with self._lock:
+                self.stages.append(record)
+
+    def add_call(self, model: Optional[str], usage: Any, wall_s: float, cache_hit: bool = False,
+                 aborted: bool = False) -> None:
+        """
+        Record one LLM call with its token usage from rsp.usage (None for local
+        cache hits, and for streams closed before the end, which are aborted).
+        """
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+
+        record = {
+            "stage": _current_stage.get(),
+            "model": model,
+            "wall_s": round(wall_s, 4),
+            "cache_hit": cache_hit,
+            "aborted": aborted,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": estimate_cost(model, prompt_tokens, cached_tokens, completion_tokens),
+        }
+        with self._lock:
+            self.calls.append(record)
+
+    def summary(self) -> Dict[str, Any]:
+        """Stage records with the token usage and cost of their calls added, plus run totals."""
+        with self._lock:
+            calls = list(self.calls)
+            stages = [dict(stage) for stage in self.stages]
+
+        def totals(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+            costs = [r["cost_usd"] for r in records if r["cost_usd"] is not None]
+            return {
+                "llm_calls": len(records),
+                "cache_hits": sum(1 for r in records if r["cache_hit"]),
+                "aborted_calls": sum(1 for r in records if r["aborted"]),
+                "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+                "cached_tokens": sum(r["cached_tokens"] for r in records),
+                "completion_tokens": sum(r["completion_tokens"] for r in records),
+                "cost_usd": round(sum(costs), 6),
+            }
+
+        for stage in stages:
+            stage.update(totals([c for c in calls if c["stage"] == stage["stage"]]))
+
+        run_totals = totals(calls)
+        run_totals["wall_s"] = round(sum(stage["wall_s"] for stage in stages), 4)
+        run_totals["cpu_s"] = round(sum(stage["cpu_s"] for stage in stages), 4)
+        return {"stages": stages, "calls": calls, "totals": run_totals}
+
+    def write_trace(self, path: Union[str, Path]) -> None:
+        """Write the summary as a JSON trace file."""
+        Path(path).write_text(json.dumps(self.summary(), indent=2), encoding="utf-8")
+
+
+def record_call(model: Optional[str], usage: Any, wall_s: float, cache_hit: bool = False,
+                aborted: bool = False) -> None:
+    """Report an LLM call to the active Telemetry, if any."""
+    telemetry = _current.get()
+    if telemetry is not None:
+        telemetry.add_call(model, usage, wall_s, cache_hit, aborted)
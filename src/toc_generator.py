@@ -4,9 +4,34 @@ Generates table of contents from documents using OpenAI API.
 """
 
 import re
-from typing import Optional
+import json
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
 from openai import OpenAI
 
+from .header_ids import add_header_ids
+from .llm import SYSTEM_PROMPT, chat_completion, document_messages, stream_chat_completion
+from .llm_cache import ResponseCache
+from .section_tagger import (
+    NormalizedIndex, extract_header_text, extract_section_start_text, find_word_sequence_exact,
+    find_word_sequence_fuzzy, get_header_level, locate_sections, normalize_text_for_word_matching,
+    parse_markdown_structure,
+)
+from .section_tree import SectionTree
+from .toc_heuristics import detect_headings, infer_scheme_levels, nest_heading_levels
+
+
+# A streamed TOC with more text than this outside headings and snippets is
+# copying the document rather than listing headings
+MAX_STRAY_CHARS = 2000
+# Quoted lines longer than this are copied text rather than a 12-15 word snippet
+MAX_SNIPPET_WORDS = 40
+# How far before its snippet a heading's title is looked for
+HEADER_LOOKBACK_CHARS = 300
+# Shorter snippets are not matched, as in find_word_sequence
+MIN_SNIPPET_MATCH_WORDS = 5
+
 
 def escape_markdown(text: str) -> str:
     """Escape characters that can break Markdown when we embed raw excerpts."""
@@ -26,7 +51,8 @@ def first_pass_prompt(doc_txt: str) -> tuple[str, str]:
     HEADER_INFO = """Use markdown headers (#, ##, ###, ####, #####, ######) to reflect levels 1-6. After each header line, on the *next* line include a quoted snippet containing EXACTLY 12-15 words that follow the header, exactly as they appear in the document. This word sequence will be used to locate the section in the original document."""
     
     instructions = f"""
-Extract the top-level headings (level 1) from the following document and present them in Markdown.
+Create a concise table of contents with markdown headers for the document above.
+Extract the top-level headings (level 1) and present them in Markdown.
 
 {HEADER_INFO}
 
@@ -64,10 +90,7 @@ def next_pass_prompt(pass_number: int, current_toc_md: str, doc_txt: str) -> tup
     HEADER_INFO = """Use markdown headers (#, ##, ###, ####, #####, ######) to reflect levels 1-6. After each header line, on the *next* line include a quoted snippet containing EXACTLY 12-15 words that follow the header, exactly as they appear in the document. This word sequence will be used to locate the section in the original document."""
     
     instructions = f"""
-Expand the current Table of Contents by adding ONE MORE level of sub-headings.
-
-CURRENT TOC (Pass {pass_number-1}):
-{current_toc_md}
+Expand the current Table of Contents of the document above by adding ONE MORE level of sub-headings.
 
 {HEADER_INFO}
 
@@ -98,41 +121,566 @@ CRITICAL RULES:
 5. If no new sub-headings anywhere, return the same TOC as input
 6. Use the exact words as they appear, don't skip or change anything
 7. Do NOT copy large blocks of text - only extract section headers with their brief following text
+
+CURRENT TOC (Pass {pass_number-1}):
+{current_toc_md}
 """
     
     safe_doc = escape_for_fstring(doc_txt)
     return instructions, safe_doc
 
 
-def get_next_level_toc(doc_txt: str, current_toc: str, client: OpenAI, pass_number: int) -> Optional[str]:
-    """Get the next level of TOC using OpenAI."""
+def delta_pass_prompt(pass_number: int, entries: List[Dict], doc_txt: str) -> tuple[str, str]:
+    """Generate prompt for a pass that returns only the new sub-headings as JSON. Returns (instructions, document)."""
+    toc_with_ids = render_toc_entries(entries, with_ids=True)
+    
+    instructions = f"""
+Find the sub-headings in the document above ONE level below the headings in the current Table of Contents (given at the end).
+
+Return ONLY the new sub-headings as a JSON object, in exact document order:
+{{"insertions": [
+   {{"parent": "t3", "title": "Article 1", "level": 3, "snippet": "Definitions For the purposes of this regulation the following definitions shall apply to all processing"}},
+   {{"parent": "t3", "title": "Article 2", "level": 3, "snippet": "Scope This article applies to the processing of personal data wholly or partly by automated means"}}
+]}}
+
+Where "parent" is the {{#id}} of the existing heading the sub-heading belongs under, "level" is the parent's level plus one, and "snippet" contains EXACTLY 12-15 words that follow the sub-heading, exactly as they appear in the document.
+
+If *no* new sub-headings exist anywhere, return {{"insertions": []}}.
+
+CRITICAL RULES:
+1. Look for any text that appears to be a structural heading or section title
+2. Each snippet must be EXACTLY 12-15 words, no more, no less
+3. Do NOT repeat headings that are already in the TOC
+4. Use the exact words as they appear, don't skip or change anything
+5. Do NOT copy large blocks of text - only extract section headers with their brief following text
+
+CURRENT TOC (Pass {pass_number-1}), each heading ends with its {{#id}} anchor:
+{toc_with_ids}
+"""
+    
+    safe_doc = escape_for_fstring(doc_txt)
+    return instructions, safe_doc
+
+
+def scheme_levels_prompt(headings: List[Dict], levels: Dict[str, Optional[int]]) -> str:
+    """Generate prompt asking for the TOC level of each heading numbering scheme, given a few examples of each."""
+    lines = []
+    for scheme, level in levels.items():
+        examples = [h['title'] for h in headings if h['scheme'] == scheme][:3]
+        known = f"level {level}" if level is not None else "level unknown"
+        lines.append(f'- "{scheme}" ({known}), e.g. ' + "; ".join(f'"{e}"' for e in examples))
+    outline = "\n".join(f"{h['title']}" for h in headings[:60])
+    
+    return f"""
+The headings of a document were detected with numbering patterns and grouped into schemes:
+{chr(10).join(lines)}
+
+The first headings in document order are:
+{outline}
+
+Assign every scheme a table of contents level from 1 (outermost) to 6, keeping the levels that are already known unless they are clearly wrong for this document.
+
+Return ONLY a JSON object of the form:
+{{"levels": {{"chapter": 1, "article": 2}}}}
+"""
+
+
+def classify_scheme_levels(headings: List[Dict], levels: Dict[str, Optional[int]], client: OpenAI,
+                           cache: Optional[ResponseCache] = None) -> Dict[str, int]:
+    """
+    Fill in the levels the heuristics left unknown with a single LLM call.
+    
+    The model only sees the schemes and heading titles, not the document. A
+    scheme it does not return a valid level for goes below every known level.
+    """
+    content = chat_completion(
+        client,
+        cache,
+        model="gpt-4.1-mini",
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": scheme_levels_prompt(headings, levels)},
+        ],
+        temperature=0,
+        max_tokens=1000,
+        response_format={"type": "json_object"},
+    )
+    try:
+        reply = json.loads(content)
+    except json.JSONDecodeError:
+        reply = None
+    suggested = reply.get("levels") if isinstance(reply, dict) else None
+    if not isinstance(suggested, dict):
+        suggested = {}
+    
+    fallback = min(max((l for l in levels.values() if l is not None), default=0) + 1, 6)
+    filled = {}
+    for scheme, level in levels.items():
+        if level is None:
+            level = suggested.get(scheme)
+            if not isinstance(level, int) or not 1 <= level <= 6:
+                level = fallback
+        filled[scheme] = level
+    return filled
+
+
+def bootstrap_toc(doc_txt: str, client: OpenAI, cache: Optional[ResponseCache] = None,
+                  include_points: bool = False) -> Optional[str]:
+    """
+    Build the TOC from numbered headings found locally, without full-document LLM passes.
+    
+    Numbering schemes are ranked locally (see infer_scheme_levels) and each
+    heading goes one level below the nearest heading it falls under (see
+    nest_heading_levels); the LLM is only asked, once and without the
+    document, about schemes the heuristics cannot place. Returns None when
+    the document has no recognisable numbering, so the caller can fall back
+    to generating the TOC with the LLM.
+    """
+    headings = detect_headings(doc_txt, include_points)
+    if len(headings) < 2:
+        return None
+    
+    levels = infer_scheme_levels(headings)
+    if any(level is None for level in levels.values()):
+        print(f"Asking for levels of heading schemes: {[s for s, l in levels.items() if l is None]}")
+        levels = classify_scheme_levels(headings, levels, client, cache)
+    
+    print(f"Found {len(headings)} numbered headings locally")
+    entries = [{'level': level, 'title': h['title'], 'snippet': h['snippet']}
+               for h, level in zip(headings, nest_heading_levels(headings, levels))]
+    return render_toc_entries(entries)
+
+
+def parse_toc_entries(toc_md: str) -> List[Dict]:
+    """Parse TOC markdown into a list of headings with their level, title and snippet."""
+    entries = []
+    for line in toc_md.splitlines():
+        line = line.strip()
+        level = get_header_level(line)
+        if level:
+            entries.append({'level': level, 'title': extract_header_text(line),
+                            'snippet': extract_section_start_text(line)})
+        elif entries and not entries[-1]['snippet']:
+            entries[-1]['snippet'] = extract_section_start_text(line)
+    return entries
+
+
+def render_toc_entries(entries: List[Dict], with_ids: bool = False) -> str:
+    """Render TOC entries as markdown, optionally anchoring each heading with its list index as {#tN}."""
+    lines = []
+    for i, entry in enumerate(entries):
+        anchor = f" {{#t{i}}}" if with_ids else ""
+        lines.append(f"{'#' * entry['level']} {entry['title']}{anchor}")
+        if entry['snippet']:
+            # Double quotes would end the snippet early when it is parsed back
+            lines.append('"' + entry['snippet'].replace('"', "'") + '"')
+    return "\n".join(lines)
+
+
+def apply_toc_insertions(entries: List[Dict], insertions: List[Dict]) -> List[Dict]:
+    """
+    Insert new sub-headings into a copy of the TOC entries.
+    
+    Each new heading goes after everything already under its parent (given as a
+    "tN" ID from delta_pass_prompt), keeping the order the insertions came in,
+    and always one level below the parent whatever level the model reported.
+    Insertions that are not objects, have an unknown parent or repeat an
+    existing child are dropped.
+    """
+    tree = SectionTree.from_sections(entries)
+    added: Dict[int, List[Dict]] = {}
+    
+    for insertion in insertions:
+        if not isinstance(insertion, dict):
+            continue
+        parent_id = str(insertion.get("parent", "")).lstrip("#")
+        title = str(insertion.get("title", "")).strip()
+        if not re.fullmatch(r't\d+', parent_id) or not title:
+            continue
+        parent = int(parent_id[1:])
+        if parent >= len(entries):
+            continue
+        
+        existing = {entries[c]['title'] for c in tree.children[parent]}
+        existing.update(e['title'] for e in added.get(parent, []))
+        if title in existing:
+            continue
+        
+        level = min(entries[parent]['level'] + 1, 6)
+        added.setdefault(parent, []).append({'level': level, 'title': title,
+                                             'snippet': str(insertion.get("snippet", "")).strip()})
+    
+    # New children go where their parent's subtree ends; when several parents share
+    # that point, deeper parents (which come later in the list) go first
+    by_position: Dict[int, List[int]] = {}
+    for parent in added:
+        by_position.setdefault(tree.subtree_end[parent], []).append(parent)
+    
+    result = []
+    for i in range(len(entries) + 1):
+        for parent in sorted(by_position.get(i, []), reverse=True):
+            result.extend(added[parent])
+        if i < len(entries):
+            result.append(entries[i])
+    return result
+
+
+def get_next_level_toc_delta(doc_txt: str, current_toc: str, client: OpenAI, pass_number: int,
+                             cache: Optional[ResponseCache] = None) -> Optional[str]:
+    """
+    Get the next level of TOC by asking only for the new headings and inserting them locally.
+    
+    Returns current_toc unchanged when the model finds nothing to add. A reply
+    that is not a JSON object with a list of insertions is discarded and the
+    pass is rerun in full.
+    """
+    entries = parse_toc_entries(current_toc)
+    instructions, document = delta_pass_prompt(pass_number, entries, doc_txt)
+    
+    content = chat_completion(
+        client,
+        cache,
+        model="gpt-4.1-mini",
+        messages=document_messages(document, instructions),
+        temperature=0,
+        max_tokens=32768,
+        response_format={"type": "json_object"},
+    )
+    try:
+        reply = json.loads(content)
+    except json.JSONDecodeError:
+        reply = None
+    insertions = reply.get("insertions", []) if isinstance(reply, dict) else None
+    if not isinstance(insertions, list):
+        print(f"Warning: unusable reply to delta pass {pass_number}, running a full pass instead")
+        return get_next_level_toc(doc_txt, current_toc, client, pass_number, cache)
+    
+    new_entries = apply_toc_insertions(entries, insertions)
+    if len(new_entries) == len(entries):
+        return current_toc
+    return render_toc_entries(new_entries)
+
+
+class TocStreamParser:
+    """
+    Parses a TOC reply while it streams in, checking each heading against the document.
+    
+    Text is fed in as it arrives; a heading is complete once its snippet line
+    is, or once the next heading starts. Each entry keeps its lines as the
+    model wrote them ("lines"), and the whole reply is kept in text. Each completed entry gets the position
+    of its heading in the document ("pos"), found from its snippet with the
+    exact and fuzzy word matching used for tagging, or None if the snippet is
+    not in the document. Text that is neither a heading nor a short quoted
+    snippet counts as stray; once there is more than MAX_STRAY_CHARS of it,
+    copying is set, telling the caller to stop the stream.
+    """
+    
+    def __init__(self, doc_txt: str, index: Optional[NormalizedIndex] = None):
+        self.doc_txt = doc_txt
+        self.index = index or NormalizedIndex(doc_txt)
+        self.entries: List[Dict] = []
+        self.text = ""
+        self.stray_chars = 0
+        self.copying = False
+        self._buffer = ""
+        self._open: Optional[Dict] = None
+        self._search_from = 0
+    
+    def feed(self, text: str) -> List[Dict]:
+        """Add streamed text and return the entries it completed."""
+        self.text += text
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        completed = []
+        for line in lines:
+            completed.extend(self._add_line(line.strip()))
+        if len(self._buffer) > MAX_STRAY_CHARS:
+            # A line this long is never a heading or a snippet
+            self.stray_chars += len(self._buffer)
+            self._buffer = ""
+        self.copying = self.stray_chars > MAX_STRAY_CHARS
+        return completed
+    
+    def finish(self) -> List[Dict]:
+        """Parse what is left once the stream has ended and return the entries it completed."""
+        completed = self._add_line(self._buffer.strip())
+        self._buffer = ""
+        if self._open is not None:
+            completed.append(self._complete())
+        return completed
+    
+    def _add_line(self, line: str) -> List[Dict]:
+        if not line or line.startswith("```"):
+            return []
+        completed = []
+        level = get_header_level(line)
+        if level:
+            if self._open is not None:
+                completed.append(self._complete())
+            self._open = {'level': level, 'title': extract_header_text(line), 'snippet': "", 'lines': [line]}
+        elif line[0] in '"\u201c' and self._open is not None and len(line.split()) <= MAX_SNIPPET_WORDS:
+            self._open['snippet'] = extract_section_start_text(line) or line.strip('"\u201c\u201d ')
+            self._open['lines'].append(line)
+            completed.append(self._complete())
+        else:
+            self.stray_chars += len(line)
+        return completed
+    
+    def _complete(self) -> Dict:
+        entry, self._open = self._open, None
+        entry['pos'] = self._locate(entry)
+        self.entries.append(entry)
+        return entry
+    
+    def _locate(self, entry: Dict) -> Optional[int]:
+        """
+        Position of the heading in the document, searching on from the last
+        heading matched exactly. Fuzzy matches do not move the search on, so one
+        wrong fuzzy match cannot hide the headings that follow it.
+        """
+        words = normalize_text_for_word_matching(entry['snippet']).split()
+        if len(words) < MIN_SNIPPET_MATCH_WORDS:
+            return None
+        pos = find_word_sequence_exact(self.index, words, self._search_from)
+        if pos is not None:
+            self._search_from = pos
+        else:
+            pos = find_word_sequence_fuzzy(self.index, words, self._search_from)
+        if pos is None:
+            return None
+        # Start the section at its title when it comes shortly before the snippet
+        window = self.doc_txt[max(0, pos - HEADER_LOOKBACK_CHARS):pos].lower()
+        title_at = window.rfind(entry['title'].lower()) if entry['title'] else -1
+        return pos - len(window) + title_at if title_at >= 0 else pos
+
+
+def entry_lines(entries: List[Dict]) -> str:
+    """The TOC lines of streamed entries, as the model wrote them."""
+    return "\n".join(line for entry in entries for line in entry['lines'])
+
+
+def stream_toc_pass(doc_txt: str, current_toc: str, client: OpenAI, pass_number: int,
+                    cache: Optional[ResponseCache] = None, index: Optional[NormalizedIndex] = None,
+                    on_entry: Optional[Callable[[Dict], None]] = None) -> str:
+    """
+    Run a full TOC pass with a streamed reply, parsing headings as they arrive.
+    
+    Each heading is passed to on_entry, with its position in the document (see
+    TocStreamParser), as soon as it is complete, so callers can start work on
+    it while the model is still generating. When the reply turns out to copy
+    the document instead of listing headings, the stream is closed at once and
+    only the heading and snippet lines received until then are kept.
+    """
     if pass_number == 1:
         instructions, document = first_pass_prompt(doc_txt)
     else:
         instructions, document = next_pass_prompt(pass_number, current_toc, doc_txt)
+    
+    parser = TocStreamParser(doc_txt, index)
+    chunks = stream_chat_completion(
+        client,
+        cache,
+        model="gpt-4.1-mini",
+        messages=document_messages(document, instructions),
+        temperature=0,
+        max_tokens=32768,
+    )
+    try:
+        for text in chunks:
+            for entry in parser.feed(text):
+                if on_entry is not None:
+                    on_entry(entry)
+            if parser.copying:
+                print(f"Warning: pass {pass_number} is copying the document instead of listing headings; "
+                      f"stopped after {len(parser.entries)} headings")
+                break
+    finally:
+        chunks.close()
+    
+    for entry in parser.finish():
+        if on_entry is not None:
+            on_entry(entry)
+    
+    located = sum(1 for entry in parser.entries if entry['pos'] is not None)
+    print(f"Streamed {len(parser.entries)} headings, {located} located in the document")
+    if not parser.copying:
+        # The reply as the model wrote it, exactly as a pass without streaming returns it
+        return parser.text.strip()
+    return entry_lines(parser.entries)
+
 
-    rsp = client.chat.completions.create(
+def get_next_level_toc(doc_txt: str, current_toc: str, client: OpenAI, pass_number: int,
+                       cache: Optional[ResponseCache] = None, delta: bool = False, stream: bool = False,
+                       index: Optional[NormalizedIndex] = None) -> Optional[str]:
+    """
+    Get the next level of TOC using OpenAI.
+    
+    With delta=True, passes after the first return only the new headings
+    (see get_next_level_toc_delta) instead of re-emitting the whole TOC.
+    Otherwise, with stream=True, the reply is streamed and parsed as it
+    arrives (see stream_toc_pass); index is the NormalizedIndex of doc_txt,
+    if one was already built.
+    """
+    if delta and pass_number > 1:
+        return get_next_level_toc_delta(doc_txt, current_toc, client, pass_number, cache)
+    if stream:
+        return stream_toc_pass(doc_txt, current_toc, client, pass_number, cache, index)
+    
+    if pass_number == 1:
+        instructions, document = first_pass_prompt(doc_txt)
+    else:
+        instructions, document = next_pass_prompt(pass_number, current_toc, doc_txt)
+
+    content = chat_completion(
+        client,
+        cache,
         model="gpt-4.1-mini",
-        messages=[
-            {"role": "system", "content": "You are a document analyzer. Create a concise table of contents with markdown headers and EXACTLY 12-15 word snippets. Do NOT reproduce large blocks of text. Extract any structural headings or section titles you identify in the document."},
-            {"role": "user", "content": instructions},
-            {"role": "user", "content": document},
-        ],
+        messages=document_messages(document, instructions),
         temperature=0,
         max_tokens=32768,
     )
-    return rsp.choices[0].message.content.strip()
+    return content.strip()
 
 
-def generate_toc(doc_txt: str, client: OpenAI, max_passes: int = 10) -> str:
-    """Generate complete TOC for document."""
+def generate_toc(doc_txt: str, client: OpenAI, max_passes: int = 10, cache: Optional[ResponseCache] = None,
+                 concurrent: bool = False, max_workers: int = 4, delta: bool = False,
+                 heuristic: bool = False, stream: bool = False) -> str:
+    """
+    Generate complete TOC for document.
+    
+    With heuristic=True, numbered headings are detected locally first and the
+    LLM passes are only run if none are found; see bootstrap_toc. When
+    headings are found, the TOC is built from them alone: max_passes,
+    concurrent, delta and stream are ignored, and the LLM is only asked about
+    the levels of numbering schemes the heuristics cannot place. With
+    concurrent=True, only the first pass is run on the whole document; see
+    generate_toc_concurrent. With delta=True, later passes return only the new
+    headings; see get_next_level_toc_delta. With stream=True, full passes are
+    streamed and parsed as they arrive; see stream_toc_pass.
+    """
+    if heuristic:
+        toc_md = bootstrap_toc(doc_txt, client, cache)
+        if toc_md:
+            return toc_md
+        print("No numbered headings found, generating TOC with the LLM")
+    
+    if concurrent:
+        return generate_toc_concurrent(doc_txt, client, max_passes, cache, max_workers, delta, stream)
+    
+    index = NormalizedIndex(doc_txt) if stream else None
     toc_md = ""
     for p in range(1, max_passes + 1):
         print(f"\nPASS {p}")
-        new_md = get_next_level_toc(doc_txt, toc_md, client, p)
+        new_md = get_next_level_toc(doc_txt, toc_md, client, p, cache, delta, stream, index)
         if not new_md or new_md == toc_md:
             print("No further expansion. Done.")
             break
         toc_md = new_md
         print(f"Completed pass {p}")
-    return toc_md
\ No newline at end of file
+    return toc_md
+
+
+def expand_subtree(section_txt: str, subtree_md: str, client: OpenAI, max_passes: int,
+                   cache: Optional[ResponseCache] = None, delta: bool = False, stream: bool = False) -> str:
+    """Expand the TOC of one top-level section from that section's text alone, one level per pass."""
+    index = NormalizedIndex(section_txt) if stream else None
+    for p in range(2, max_passes + 1):
+        new_md = get_next_level_toc(section_txt, subtree_md, client, p, cache, delta, stream, index)
+        if not new_md or new_md == subtree_md:
+            break
+        subtree_md = new_md
+    return subtree_md
+
+
+def generate_toc_concurrent(doc_txt: str, client: OpenAI, max_passes: int = 10,
+                            cache: Optional[ResponseCache] = None, max_workers: int = 4,
+                            delta: bool = False, stream: bool = False) -> str:
+    """
+    Generate complete TOC for document, expanding top-level sections independently.
+    
+    The first pass finds the top-level headings in the whole document. Each one is
+    then located in the text, and its subtree is expanded by sending only its own
+    slice of the document, with up to max_workers subtrees in flight at once. A
+    subtree stops as soon as a pass adds nothing, and the expanded subtrees are
+    merged back in TOC order. Headings that cannot be located are kept as they are.
+    With stream=True, see generate_toc_concurrent_streamed.
+    """
+    if stream and max_passes >= 2:
+        return generate_toc_concurrent_streamed(doc_txt, client, max_passes, cache, max_workers, delta)
+    
+    print("\nPASS 1")
+    toc_md = get_next_level_toc(doc_txt, "", client, 1, cache)
+    if not toc_md or max_passes < 2:
+        return toc_md or ""
+    print("Completed pass 1")
+    
+    # Locate every top-level section using a copy of the TOC with IDs
+    toc_ids, _ = add_header_ids(toc_md)
+    top_sections = [s for s in parse_markdown_structure(toc_ids) if s['level'] == 1]
+    if not top_sections:
+        return toc_md
+    spans = locate_sections(toc_ids, doc_txt)
+    
+    # Split the TOC into the block of lines under each top-level heading
+    lines = toc_md.splitlines()
+    preamble = "\n".join(lines[:top_sections[0]['line_index']]).strip()
+    blocks = []
+    for i, section in enumerate(top_sections):
+        end_line = top_sections[i + 1]['line_index'] if i + 1 < len(top_sections) else len(lines)
+        blocks.append(("\n".join(lines[section['line_index']:end_line]).strip(), spans.get(section['id'])))
+    
+    print(f"\nExpanding {len(blocks)} top-level sections (up to {max_workers} at a time)")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, expand_subtree, doc_txt[span.start:span.end], block,
+                            client, max_passes, cache, delta)
+            if span is not None else None
+            for block, span in blocks
+        ]
+        expanded = [future.result() if future is not None else block
+                    for future, (block, _) in zip(futures, blocks)]
+    
+    return "\n\n".join(part for part in [preamble] + expanded if part)
+
+
+def generate_toc_concurrent_streamed(doc_txt: str, client: OpenAI, max_passes: int = 10,
+                                     cache: Optional[ResponseCache] = None, max_workers: int = 4,
+                                     delta: bool = False) -> str:
+    """
+    Like generate_toc_concurrent, but expanding top-level sections while the first pass still streams.
+    
+    A top-level section is complete once the next top-level heading has been
+    located after it, so its expansion is submitted right then. Top-level
+    headings that cannot be located stay in the section before them, and
+    headings before the first located one are kept as they are.
+    """
+    print("\nPASS 1")
+    blocks = []
+    pending: List[Dict] = []
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def flush(end: int) -> None:
+            if not pending:
+                return
+            block = entry_lines(pending)
+            start = pending[0]['pos']
+            if pending[0]['level'] == 1 and start is not None:
+                blocks.append((block, executor.submit(contextvars.copy_context().run, expand_subtree,
+                                                      doc_txt[start:end], block, client, max_passes, cache,
+                                                      delta, True)))
+            else:
+                blocks.append((block, None))
+            pending.clear()
+        
+        def on_entry(entry: Dict) -> None:
+            start = pending[0]['pos'] if pending else None
+            if entry['level'] == 1 and entry['pos'] is not None and (start is None or entry['pos'] > start):
+                flush(entry['pos'])
+            pending.append(entry)
+        
+        stream_toc_pass(doc_txt, "", client, 1, cache, on_entry=on_entry)
+        flush(len(doc_txt))
+        print(f"Completed pass 1; expanding {sum(1 for _, f in blocks if f is not None)} top-level sections")
+        expanded = [future.result() if future is not None else block for block, future in blocks]
+    
+    return "\n\n".join(part for part in expanded if part)
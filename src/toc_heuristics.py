@@ -0,0 +1,203 @@
+"""
+TOC Heuristics Module
+Detects numbered headings ("CHAPTER I", "Section 1", "Article 5", "2.01") with line patterns.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from .numbering import ARABIC, ROMAN, normalize_number
+
+
+# Rank of each kind of numbered unit in the usual legal hierarchy (lower is outer)
+KNOWN_RANKS = {
+    'part': 0, 'book': 0,
+    'title': 1,
+    'chapter': 2,
+    'subchapter': 3,
+    'section': 4,
+    'subsection': 5,
+    'article': 6,
+    'annex': 0, 'appendix': 0, 'schedule': 0,
+}
+
+# A heading number: arabic (optionally dotted or lettered), upper-case roman, or a single capital letter
+NUMBER = r'(?:' + ARABIC + r'|(?-i:' + ROMAN + r'|[A-Z])\b)'
+
+HEADING_RE = re.compile(
+    r'^[ \t]*(?:'
+    # "CHAPTER I", "Article 5", "Article 5    Principles relating to ...", "Section 2.01 - Term"
+    r'(?P<kind>(?i:' + '|'.join(KNOWN_RANKS) + r'))[ \t]+(?P<number>' + NUMBER + r')'
+    r'(?=[ \t]*$|[ \t]*[-–—:.]?[ \t]+[A-Z‘"\'(])'
+    # Any other capitalised word and number alone on a line, as in "Schedule 2" or "Rule 14"
+    r'|(?P<other>[A-Z][A-Za-z]+)[ \t]+(?P<other_number>' + NUMBER + r')[ \t]*$'
+    # Dotted decimal numbering followed by a title, as in "3.2 Payment terms"
+    r'|(?P<decimal>\d+(?:\.\d+)+)\.?[ \t]+(?=[A-Z])'
+    # Lettered or numbered points, as in "(a)"
+    r'|(?P<point>\((?:[a-z]{1,3}|\d{1,3})\))[ \t]+'
+    r')',
+    re.MULTILINE
+)
+
+# Headings with a dotted title longer than this are taken to be numbered paragraphs
+MAX_DECIMAL_TITLE_WORDS = 12
+
+# Kinds seen fewer times than this are ignored, except known ones
+MIN_SCHEME_COUNT = 2
+
+SNIPPET_WORDS = 14
+
+
+def snippet_after(doc_txt: str, pos: int) -> str:
+    """The words following a heading, in the quoted snippet form used by the TOC."""
+    words = doc_txt[pos:pos + 50 * SNIPPET_WORDS].split()[:SNIPPET_WORDS]
+    return " ".join(words).replace('"', "'")
+
+
+def detect_headings(doc_txt: str, include_points: bool = False) -> List[Dict]:
+    """
+    Find heading candidates in the document with line-level patterns.
+
+    Each heading belongs to a numbering scheme: the kind of unit for keyword
+    headings ("article", "chapter"), "decimalN" for dotted numbers with N parts,
+    or "point" for "(a)"-style points. Schemes of unknown kinds that occur only
+    once are dropped as prose.
+
+    Args:
+        doc_txt: Full document text
+        include_points: Also return "(a)"-style points, which are usually list
+            items rather than headings
+
+    Returns:
+        Headings in document order, as dicts with scheme, number, title, snippet
+        and pos (offset of the heading in the text)
+    """
+    headings = []
+    for match in HEADING_RE.finditer(doc_txt):
+        line_end = doc_txt.find('\n', match.end())
+        if line_end < 0:
+            line_end = len(doc_txt)
+
+        if match.group('kind'):
+            kind = match.group('kind').lower()
+            number = match.group('number')
+            title = f"{match.group('kind')} {number}"
+            title_end = match.end('number')
+        elif match.group('other'):
+            kind = match.group('other').lower()
+            number = match.group('other_number')
+            title = f"{match.group('other')} {number}"
+            title_end = match.end('other_number')
+        elif match.group('decimal'):
+            line = doc_txt[match.start('decimal'):line_end].strip()
+            if len(line.split()) > MAX_DECIMAL_TITLE_WORDS:
+                continue
+            number = match.group('decimal')
+            kind = f"decimal{number.count('.') + 1}"
+            title = line
+            title_end = line_end
+        else:
+            if not include_points:
+                continue
+            kind = 'point'
+            number = match.group('point')
+            title = number
+            title_end = match.end('point')
+
+        headings.append({'scheme': kind, 'number': normalize_number(number), 'title': title,
+                         'snippet': snippet_after(doc_txt, title_end), 'pos': match.start()})
+
+    counts: Dict[str, int] = {}
+    for heading in headings:
+        counts[heading['scheme']] = counts.get(heading['scheme'], 0) + 1
+    return [h for h in headings if h['scheme'] in KNOWN_RANKS or counts[h['scheme']] >= MIN_SCHEME_COUNT]
+
+
+def infer_scheme_levels(headings: List[Dict]) -> Dict[str, Optional[int]]:
+    """
+    Assign a level (1-6) to each numbering scheme, or None where it is unclear.
+
+    Levels rank the schemes from outermost to innermost; the TOC level of each
+    heading follows from how the headings nest (see nest_heading_levels).
+
+    Known kinds follow the usual legal hierarchy (part, title, chapter, section,
+    article). Dotted numbers override that: a scheme whose numbers start with
+    the current number of another scheme ("Section 3.02" after "ARTICLE III",
+    "3.2" after "3") is placed just below it. Points always come last. Other
+    kinds, and dotted numbers with no such parent in a document that also has
+    keyword headings, are left as None.
+    """
+    schemes = list(dict.fromkeys(h['scheme'] for h in headings))
+    has_keywords = any(s in KNOWN_RANKS for s in schemes)
+
+    # For each dotted scheme, count which other scheme's current number its prefix matches
+    votes: Dict[str, Dict[str, int]] = {}
+    totals: Dict[str, int] = {}
+    current: Dict[str, str] = {}
+    for heading in headings:
+        scheme, number = heading['scheme'], heading['number']
+        if '.' in number:
+            prefix = number.rsplit('.', 1)[0]
+            totals[scheme] = totals.get(scheme, 0) + 1
+            for other, other_number in current.items():
+                if other != scheme and other_number == prefix:
+                    scheme_votes = votes.setdefault(scheme, {})
+                    scheme_votes[other] = scheme_votes.get(other, 0) + 1
+        current[scheme] = number
+
+    parents: Dict[str, str] = {}
+    for scheme, scheme_votes in votes.items():
+        parent, count = max(scheme_votes.items(), key=lambda item: item[1])
+        if count * 2 >= totals[scheme]:
+            parents[scheme] = parent
+
+    ranks: Dict[str, Optional[float]] = {}
+
+    def rank_of(scheme: str, seen: frozenset = frozenset()) -> Optional[float]:
+        if scheme in ranks:
+            return ranks[scheme]
+        if scheme in parents and parents[scheme] not in seen:
+            parent_rank = rank_of(parents[scheme], seen | {scheme})
+            rank = parent_rank + 0.5 if parent_rank is not None else None
+        elif scheme in KNOWN_RANKS:
+            rank = float(KNOWN_RANKS[scheme])
+        elif scheme.startswith('decimal') and not has_keywords:
+            rank = float(scheme[len('decimal'):])
+        else:
+            rank = None
+        ranks[scheme] = rank
+        return rank
+
+    for scheme in schemes:
+        if scheme != 'point':
+            rank_of(scheme)
+
+    known = sorted(set(r for r in ranks.values() if r is not None))
+    levels: Dict[str, Optional[int]] = {
+        scheme: min(known.index(rank) + 1, 6) if rank is not None else None
+        for scheme, rank in ranks.items()
+    }
+    if 'point' in schemes:
+        levels['point'] = min(len(known) + 1, 6)
+    return levels
+
+
+def nest_heading_levels(headings: List[Dict], levels: Dict[str, int]) -> List[int]:
+    """
+    TOC level of each heading from how it actually nests, one below its nearest enclosing heading.
+
+    Scheme levels (from infer_scheme_levels) only rank the schemes: a heading is
+    enclosed by the closest preceding heading of an outer scheme. So where a
+    chapter has no sections, its articles come out one level below the chapter
+    rather than two.
+    """
+    nested = []
+    stack: List[Tuple[int, int]] = []  # (scheme level, TOC level) of the enclosing headings
+    for heading in headings:
+        scheme_level = levels[heading['scheme']]
+        while stack and stack[-1][0] >= scheme_level:
+            stack.pop()
+        level = min(stack[-1][1] + 1, 6) if stack else 1
+        stack.append((scheme_level, level))
+        nested.append(level)
+    return nested
@@ -0,0 +1,46 @@
+"""
+Shared test helpers: the repository root on sys.path and a fake OpenAI client.
+"""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+EU_DOCUMENT = ROOT / "examples" / "EU_document.txt"
+EU_TOC = ROOT / "out" / "EU_document_toc.md"
+
+
+class FakeClient:
+    """Stands in for OpenAI: every chat completion returns reply(request params)."""
+
+    def __init__(self, reply: Callable[[Dict[str, Any]], str]):
+        self.reply = reply
+        self.requests: List[Dict[str, Any]] = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **params: Any) -> SimpleNamespace:
+        self.requests.append(params)
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=10,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=0))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.reply(params)),
+                                                        finish_reason="stop")],
+                               usage=usage)
+
+
+@pytest.fixture(scope="session")
+def eu_text() -> str:
+    return EU_DOCUMENT.read_text(encoding="utf-8")
+
+
+@pytest.fixture(scope="session")
+def eu_toc_ids() -> str:
+    from src.header_ids import add_header_ids
+    toc_ids, _ = add_header_ids(EU_TOC.read_text(encoding="utf-8"))
+    return toc_ids
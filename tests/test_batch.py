@@ -0,0 +1,77 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from conftest import FakeClient
+from src import batch
+from src.batch import find_documents, run_batch
+
+
+DOCUMENT = (
+    "Article 1\nSubject-matter\nThis Regulation lays down rules on the processing of data.\n"
+    "Article 2\nScope\nThis Regulation applies to processing as set out in Article 1.\n"
+)
+TOC = (
+    "# Article 1\n\"Subject-matter This Regulation lays down rules on the processing\"\n"
+    "# Article 2\n\"Scope This Regulation applies to processing as set out\"\n"
+)
+
+
+def reply(params):
+    """The TOC for TOC requests and one reference from Article 2 to Article 1 otherwise."""
+    return json.dumps({"refs": [{"from": "h2", "to": ["h1"]}]}) if params.get("response_format") else TOC
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """The fake client every document of a batch shares."""
+    client = FakeClient(reply)
+    monkeypatch.setattr(batch, "OpenAI", lambda **kwargs: client)
+    return client
+
+
+def test_documents_come_from_a_directory_or_a_manifest(tmp_path):
+    for name in ["b.txt", "a.txt", "notes.md"]:
+        (tmp_path / name).write_text(DOCUMENT, encoding="utf-8")
+    (tmp_path / "list.txt").write_text("# documents\nb.txt\n\n  /abs/c.txt\n", encoding="utf-8")
+    (tmp_path / "list.json").write_text(json.dumps(["a.txt"]), encoding="utf-8")
+
+    assert [path.name for path in find_documents(str(tmp_path))] == ["a.txt", "b.txt", "list.txt"]
+    assert [path.name for path in find_documents(str(tmp_path), "*.md")] == ["notes.md"]
+    assert find_documents(str(tmp_path / "list.txt")) == [tmp_path / "b.txt", Path("/abs/c.txt")]
+    assert find_documents(str(tmp_path / "list.json")) == [tmp_path / "a.txt"]
+    with pytest.raises(FileNotFoundError):
+        find_documents(str(tmp_path / "missing.txt"))
+
+
+def test_documents_need_distinct_names(tmp_path, client):
+    for directory in ["one", "two"]:
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / "regulation.txt").write_text(DOCUMENT, encoding="utf-8")
+    (tmp_path / "list.txt").write_text("one/regulation.txt\ntwo/regulation.txt\n", encoding="utf-8")
+
+    with pytest.raises(ValueError, match="regulation"):
+        run_batch(str(tmp_path / "list.txt"), "key", str(tmp_path / "out"))
+    assert client.requests == []
+
+
+def test_batches_record_every_document_and_carry_on_past_failures(tmp_path, client):
+    source = tmp_path / "documents"
+    source.mkdir()
+    for name in ["first", "second"]:
+        (source / f"{name}.txt").write_text(DOCUMENT, encoding="utf-8")
+    (source / "broken.txt").write_bytes(b"\xff\xfe not utf-8")
+
+    summary = run_batch(str(source), "key", str(tmp_path / "out"), max_documents=2, processes=1, max_passes=1)
+
+    records = {record["document"]: record for record in summary["documents"]}
+    assert [records[str(source / f"{name}.txt")]["status"] for name in ["broken", "first", "second"]] == [
+        "failed", "ok", "ok"]
+    assert records[str(source / "broken.txt")]["error"].startswith("UnicodeDecodeError")
+    assert records[str(source / "first.txt")]["bytes"] == len(DOCUMENT.encode("utf-8"))
+    totals = summary["totals"]
+    assert (totals["documents"], totals["succeeded"], totals["failed"]) == (3, 2, 1)
+    assert totals["llm_calls"] == len(client.requests) == 4
+    assert json.loads((tmp_path / "out" / "batch_summary.json").read_text(encoding="utf-8")) == summary
+    assert (tmp_path / "out" / "second" / "second_all_refs.json").exists()
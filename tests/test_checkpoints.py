@@ -0,0 +1,135 @@
+import json
+
+import pytest
+
+from conftest import FakeClient
+from src.checkpoints import RunManifest, content_hash
+from src.main import analyze_document
+
+
+DOCUMENT = (
+    "CHAPTER I\nGeneral provisions\n"
+    "Article 1\nSubject-matter\nThis Regulation lays down rules on the processing of data.\n"
+    "Article 2\nScope\nThis Regulation applies to processing as set out in Article 1.\n"
+)
+TOC = (
+    "# CHAPTER I\n\"General provisions Article 1 Subject-matter This Regulation\"\n"
+    "## Article 1\n\"Subject-matter This Regulation lays down rules on the processing\"\n"
+    "## Article 2\n\"Scope This Regulation applies to processing as set out\"\n"
+)
+REFS = json.dumps({"refs": [{"from": "h3", "to": ["h2"]}]})
+
+
+def reply(params):
+    """The TOC for TOC requests and one reference from Article 2 to Article 1 otherwise."""
+    return REFS if params.get("response_format") else TOC
+
+
+@pytest.fixture
+def manifest_path(tmp_path):
+    """Manifest of a run that completed the toc stage, writing toc.md next to it."""
+    (tmp_path / "toc.md").write_text(TOC, encoding="utf-8")
+    manifest = RunManifest(tmp_path / "manifest.json", "doc")
+    with manifest.run("toc", "key", {}, [tmp_path / "toc.md"]):
+        pass
+    return manifest.path
+
+
+@pytest.fixture
+def analysis(tmp_path):
+    """Runs analyze_document on DOCUMENT into tmp_path/out; returns the client it used."""
+    document = tmp_path / "regulation.txt"
+    document.write_text(DOCUMENT, encoding="utf-8")
+
+    def run(**options):
+        client = FakeClient(reply)
+        analyze_document(str(document), "key", str(tmp_path / "out"), max_passes=1, client=client, **options)
+        return client
+    return run
+
+
+def stages(directory):
+    return json.loads((directory / "regulation_manifest.json").read_text(encoding="utf-8"))["stages"]
+
+
+def test_stage_keys_cover_params_and_inputs():
+    key = RunManifest.stage_key({"a": 1, "b": 2}, ["x"])
+
+    assert key == RunManifest.stage_key({"b": 2, "a": 1}, ["x"])
+    assert key != RunManifest.stage_key({"a": 1, "b": 3}, ["x"])
+    assert key != RunManifest.stage_key({"a": 1, "b": 2}, ["y"])
+
+
+def test_complete_stages_are_current_only_when_resuming(manifest_path):
+    assert RunManifest(manifest_path, "doc", resume=True).is_current("toc", "key")
+    assert not RunManifest(manifest_path, "doc").is_current("toc", "key")
+    assert not RunManifest(manifest_path, "doc", enabled=False, resume=True).is_current("toc", "key")
+    assert not RunManifest(manifest_path, "doc", resume=True, force=["toc"]).is_current("toc", "key")
+    assert not RunManifest(manifest_path, "doc", resume=True).is_current("toc", "other key")
+    assert not RunManifest(manifest_path, "doc", resume=True).is_current("tagging", "key")
+
+
+def test_edited_or_deleted_outputs_are_stale(manifest_path):
+    output = manifest_path.parent / "toc.md"
+    output.write_text(TOC + "## Article 3\n", encoding="utf-8")
+    assert not RunManifest(manifest_path, "doc", resume=True).is_current("toc", "key")
+
+    output.unlink()
+    assert not RunManifest(manifest_path, "doc", resume=True).is_current("toc", "key")
+
+
+def test_failed_stages_are_recorded_and_not_reused(tmp_path):
+    manifest = RunManifest(tmp_path / "manifest.json", "doc", resume=True)
+
+    with pytest.raises(RuntimeError):
+        with manifest.run("toc", "key", {}, []):
+            raise RuntimeError("no reply")
+
+    entry = json.loads(manifest.path.read_text(encoding="utf-8"))["stages"]["toc"]
+    assert entry["status"] == "failed" and entry["error"] == "RuntimeError: no reply"
+    assert not RunManifest(manifest.path, "doc", resume=True).is_current("toc", "key")
+
+
+def test_unreadable_manifests_are_ignored(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text("{not json", encoding="utf-8")
+
+    assert RunManifest(path, "doc", resume=True).stages == {}
+
+
+def test_unknown_stages_cannot_be_forced(tmp_path):
+    with pytest.raises(ValueError, match="toc_pass"):
+        RunManifest(tmp_path / "manifest.json", "doc", force=["toc_pass"])
+
+
+def test_resumed_runs_reuse_every_stage(analysis, tmp_path):
+    first = analysis()
+    manifest = json.loads((tmp_path / "out" / "regulation_manifest.json").read_text(encoding="utf-8"))
+
+    resumed = analysis(resume=True)
+
+    assert len(first.requests) == 2
+    assert resumed.requests == []
+    assert manifest["input_sha256"] == content_hash(DOCUMENT)
+    assert stages(tmp_path / "out") == manifest["stages"]
+
+
+def test_resumed_runs_recompute_from_the_first_stale_stage(analysis, tmp_path):
+    analysis()
+    before = stages(tmp_path / "out")
+
+    client = analysis(resume=True, compact_prompts=True)
+
+    after = stages(tmp_path / "out")
+    assert len(client.requests) == 1 and client.requests[0].get("response_format")
+    # The graph came out the same, so collecting the refs from it is not repeated
+    assert [after[stage] == before[stage] for stage in after] == [True, True, True, False, True]
+
+
+def test_forced_and_edited_stages_are_recomputed(analysis, tmp_path):
+    analysis()
+    (tmp_path / "out" / "regulation_refs.json").write_text("{}", encoding="utf-8")
+
+    assert len(analysis(resume=True).requests) == 1
+    assert len(analysis(resume=True, force_stages=["toc"]).requests) == 1
+    assert analysis(resume=True).requests == []
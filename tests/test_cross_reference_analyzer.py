@@ -0,0 +1,141 @@
+import json
+
+import pytest
+
+from conftest import FakeClient
+from src.cross_reference_analyzer import (analyse_references, build_levels_info, collect_all_refs,
+                                          collect_refs_texts, escalation_text, find_refs, find_shard_refs, merge_refs,
+                                          parse_toc_md, shard_tagged_text)
+from src.section_index import SectionIndex, SectionSpan
+
+
+TOC = "# A {#h1}\n## A.1 {#h2}\n# B {#h3}"
+TAGGED = ("[START SECTION h1: A] A intro [START SECTION h2: A.1] A.1 text [END SECTION h2: A.1]"
+          " [END SECTION h1: A] [START SECTION h3: B] B text [END SECTION h3: B]")
+
+
+def chunk_refs(levels_info):
+    return {chunk["section_id"]: chunk["references"] for level in levels_info for chunk in level["chunks"]}
+
+
+def test_levels_info_takes_section_text_from_the_spans():
+    index = SectionIndex.from_tagged_text(TAGGED)
+
+    levels_info = build_levels_info(parse_toc_md(TOC), [{"from": "h3", "to": ["h2"]}], index)
+
+    assert [[chunk["section_id"] for chunk in level["chunks"]] for level in levels_info] == [["h1", "h3"], ["h2"]]
+    assert chunk_refs(levels_info) == {"h1": [], "h3": ["h2"], "h2": []}
+    assert collect_refs_texts("h3", levels_info) == ["A.1 text"]
+    assert collect_refs_texts("h3", levels_info, TAGGED) == ["A.1 text"]
+    assert collect_all_refs(levels_info, sections=index) == {"h1": [], "h3": ["A.1 text"], "h2": []}
+
+
+def test_levels_info_without_spans_has_no_text():
+    levels_info = build_levels_info(parse_toc_md(TOC), [{"from": "h3", "to": ["h2"]}])
+
+    assert all("text" not in chunk for level in levels_info for chunk in level["chunks"])
+    assert collect_refs_texts("h3", levels_info) == []
+    assert collect_all_refs(levels_info, TAGGED)["h3"] == ["A.1 text"]
+
+
+def test_merge_refs_unions_targets_in_first_seen_order():
+    merged = merge_refs([
+        [{"from": "h1", "to": ["h3", "h2"]}, {"from": "h2", "to": ["h3"]}],
+        [{"from": "h1", "to": ["h2", "h4"]}, {"from": "h5", "to": []}],
+    ])
+
+    assert merged == [{"from": "h1", "to": ["h3", "h2", "h4"]}, {"from": "h2", "to": ["h3"]},
+                      {"from": "h5", "to": []}]
+
+
+def test_merge_refs_skips_malformed_items():
+    assert merge_refs([["h1", {"to": ["h2"]}, {"from": "h1"}]]) == [{"from": "h1", "to": []}]
+
+
+def test_unsharded_refs_are_passed_through():
+    refs = [{"from": "h1", "to": ["h3", "h3"]}, {"from": "h1", "to": ["h2"]}]
+    client = FakeClient(lambda params: json.dumps({"refs": refs}))
+
+    levels_info = analyse_references(TOC, TAGGED, client)
+
+    assert chunk_refs(levels_info) == {"h1": ["h2"], "h2": [], "h3": []}
+    assert [chunk["text"] for level in levels_info for chunk in level["chunks"]] == [
+        "A intro  A.1 text", "B text", "A.1 text"]
+
+
+def test_non_object_replies_are_retried_at_once():
+    replies = iter(["[]", "{\"refs\": \"h3\"}", "{\"refs\": [{\"from\": \"h3\", \"to\": [\"h1\"]}]}"])
+    client = FakeClient(lambda params: next(replies))
+
+    assert find_shard_refs(TOC, TAGGED, client) == [{"from": "h3", "to": ["h1"]}]
+    assert len(client.requests) == 3
+
+
+def test_replies_still_malformed_after_the_retries_raise():
+    client = FakeClient(lambda params: "not json")
+
+    with pytest.raises(ValueError):
+        find_shard_refs(TOC, TAGGED, client, max_retries=1)
+    assert len(client.requests) == 2
+
+
+def test_shards_are_cut_only_before_start_tags():
+    shards = shard_tagged_text(TAGGED, 10)
+
+    assert "".join(shards) == TAGGED
+    assert [shard.startswith("[START SECTION") for shard in shards] == [True] * len(shards)
+    assert len(shards) == 3
+    assert shard_tagged_text(TAGGED, 10 ** 6) == [TAGGED]
+
+
+def test_shard_replies_are_merged_in_shard_order():
+    def reply(params):
+        document = params["messages"][1]["content"]
+        if "START SECTION h3" in document:
+            return json.dumps({"refs": [{"from": "h3", "to": ["h2"]}, {"from": "h1", "to": ["h3"]}]})
+        return json.dumps({"refs": [{"from": "h1", "to": ["h2"]}]})
+
+    client = FakeClient(reply)
+
+    refs = find_refs(TOC, TAGGED, client, shard_tokens=10)
+
+    assert len(client.requests) == 3
+    assert refs == [{"from": "h1", "to": ["h2", "h3"]}, {"from": "h3", "to": ["h2"]}]
+
+
+def test_escalation_text_sends_nested_sections_once():
+    index = SectionIndex.from_tagged_text(TAGGED)
+
+    text = escalation_text(index, ["h2", "h1"])
+
+    assert text.count("[START SECTION h2: A.1]") == 1
+    assert text.count("A.1 text") == 1
+    assert text.startswith("[START SECTION h1: A]")
+    assert "h3" not in text
+    assert SectionIndex.from_tagged_text(text).text("h2") == "A.1 text"
+
+
+def test_escalation_text_keeps_tags_of_resolved_subsections():
+    source = "Intro. Part one. Part two."
+    index = SectionIndex(source, [SectionSpan("h1", "A", 1, 0, len(source)),
+                                  SectionSpan("h2", "A.1", 2, 7, 16, "h1"),
+                                  SectionSpan("h3", "A.2", 2, 17, len(source), "h1")])
+
+    text = escalation_text(index, ["h1"])
+
+    assert [span.id for span in SectionIndex.from_tagged_text(text)] == ["h1", "h2", "h3"]
+
+
+def test_only_sections_with_unresolved_references_go_to_the_llm():
+    toc = "# Article 1 {#h1}\n# Article 2 {#h2}\n# Article 3 {#h3}"
+    tagged = ("[START SECTION h1: Article 1] See Article 2. [END SECTION h1: Article 1] "
+              "[START SECTION h2: Article 2] See Article 7 and the next one. [END SECTION h2: Article 2] "
+              "[START SECTION h3: Article 3] Nothing. [END SECTION h3: Article 3]")
+    client = FakeClient(lambda params: json.dumps({"refs": [{"from": "h2", "to": ["h3"]}]}))
+
+    levels_info = analyse_references(toc, tagged, client, local=True)
+
+    assert chunk_refs(levels_info) == {"h1": ["h2"], "h2": ["h3"], "h3": []}
+    assert len(client.requests) == 1
+    document = client.requests[0]["messages"][1]["content"]
+    assert "START SECTION h2" in document and "START SECTION h1" not in document
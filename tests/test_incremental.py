@@ -0,0 +1,130 @@
+import json
+import re
+
+import pytest
+
+from conftest import FakeClient
+from src.incremental import add_new_headings, diff_sections, update_analysis
+from src.main import analyze_document
+from src.section_index import SectionIndex, SectionSpan
+from src.section_tagger import locate_sections, parse_markdown_structure
+
+
+DOCUMENT = (
+    "CHAPTER I\nGeneral provisions\n"
+    "Article 1\nSubject-matter\nThis Regulation lays down rules on the processing of data.\n"
+    "Article 2\nScope\nThis Regulation applies to processing as set out in Article 1.\n"
+    "CHAPTER II\nPrinciples\n"
+    "Article 3\nLawfulness\nProcessing shall be lawful only where Article 2 allows it.\n"
+)
+TOC = (
+    "# CHAPTER I\n\"General provisions Article 1 Subject-matter This Regulation\"\n"
+    "## Article 1\n\"Subject-matter This Regulation lays down rules on the processing\"\n"
+    "## Article 2\n\"Scope This Regulation applies to processing as set out\"\n"
+    "# CHAPTER II\n\"Principles Article 3 Lawfulness Processing shall be lawful\"\n"
+    "## Article 3\n\"Lawfulness Processing shall be lawful only where Article 2\"\n"
+)
+NEW_ARTICLE = "Article 2a\nExemptions\nThis Regulation does not apply to archives.\n"
+START_RE = re.compile(r'\[START SECTION ([^:\]]+):')
+
+
+def reply(params):
+    """The TOC for TOC requests; for reference requests, every section sent referencing Article 1 (h2)."""
+    if not params.get("response_format"):
+        return TOC
+    ids = START_RE.findall(params["messages"][1]["content"])
+    return json.dumps({"refs": [{"from": section_id, "to": ["h2"]} for section_id in ids if section_id != "h2"]})
+
+
+@pytest.fixture
+def previous_run(tmp_path):
+    """Output directory of an analysis of DOCUMENT, and the path to amend it at."""
+    document = tmp_path / "regulation.txt"
+    document.write_text(DOCUMENT, encoding="utf-8")
+    analyze_document(str(document), "key", str(tmp_path / "previous"), max_passes=1, client=FakeClient(reply))
+    return tmp_path / "previous", document
+
+
+def snapshot(directory):
+    return {path.name: path.read_bytes() for path in directory.iterdir()}
+
+
+def test_diff_sections_compares_own_text():
+    toc_map = {"h1": {}, "h2": {}, "h3": {}, "h4": {}}
+    old_text = "A intro. A.1 text. B text."
+    old = SectionIndex(old_text, [SectionSpan("h1", "A", 1, 0, 18), SectionSpan("h2", "A.1", 2, 9, 18, "h1"),
+                                  SectionSpan("h3", "B", 1, 19, len(old_text))])
+    new_text = "A  intro.\nA.1 new text. C text."
+    new = SectionIndex(new_text, [SectionSpan("h1", "A", 1, 0, 23), SectionSpan("h2", "A.1", 2, 10, 23, "h1"),
+                                  SectionSpan("h4", "C", 1, 24, len(new_text))])
+
+    changed, removed = diff_sections(old, new, toc_map)
+
+    # Whitespace changes in h1's own text do not count
+    assert changed == ["h2", "h4"]
+    assert removed == ["h3"]
+
+
+def test_new_headings_of_known_kinds_are_added_after_their_predecessor():
+    toc_ids = "# CHAPTER I {#h1}\n## Article 1 {#h2}\n## Article 2 {#h3}\n# CHAPTER II {#h4}\n## Article 3 {#h5}\n"
+    amended = DOCUMENT.replace("CHAPTER II", NEW_ARTICLE + "Schedule 1\nForms\nCHAPTER II")
+    sections = locate_sections(toc_ids, amended)
+
+    updated, added = add_new_headings(toc_ids, amended, sections, {"h3"})
+
+    assert added == ["h6"]
+    assert [(s['level'], s['title'], s['id']) for s in parse_markdown_structure(updated)] == [
+        (1, "CHAPTER I", "h1"), (2, "Article 1", "h2"), (2, "Article 2", "h3"), (2, "Article 2a", "h6"),
+        (1, "CHAPTER II", "h4"), (2, "Article 3", "h5")]
+    assert add_new_headings(toc_ids, amended, sections, {"h2"}) == (toc_ids, [])
+
+
+def test_inserted_article_only_requeries_itself(previous_run):
+    previous, document = previous_run
+    document.write_text(DOCUMENT.replace("CHAPTER II", NEW_ARTICLE + "CHAPTER II"), encoding="utf-8")
+    client = FakeClient(reply)
+
+    result = update_analysis(str(document), str(previous), "key", str(previous.parent / "updated"), client=client)
+
+    assert result["changed"] == [] and result["removed"] == []
+    assert result["added"] == ["h6"]
+    assert result["requeried"] == ["h6"]
+    assert len(client.requests) == 1
+    assert result["all_refs"]["h6"] == [result["sections"].text("h2")]
+    assert result["sections"].text("h3").endswith("as set out in Article 1.")
+
+
+def test_changed_sections_and_their_referrers_are_requeried(previous_run):
+    previous, document = previous_run
+    document.write_text(DOCUMENT.replace("lays down rules", "lays down new rules"), encoding="utf-8")
+
+    result = update_analysis(str(document), str(previous), "key", str(previous.parent / "updated"),
+                             client=FakeClient(reply))
+
+    assert result["changed"] == ["h2"]
+    assert result["requeried"] == ["h1", "h2", "h3", "h4", "h5"]
+
+
+def test_updates_leave_the_previous_run_untouched(previous_run):
+    previous, document = previous_run
+    before = snapshot(previous)
+    document.write_text(DOCUMENT.replace("lays down rules", "lays down new rules"), encoding="utf-8")
+
+    with pytest.raises(ValueError):
+        update_analysis(str(document), str(previous), "key", str(previous), client=FakeClient(reply))
+    update_analysis(str(document), str(previous), "key", str(previous.parent / "updated"), client=FakeClient(reply))
+
+    assert snapshot(previous) == before
+
+
+def test_updated_outputs_are_reused_by_a_resumed_analysis(previous_run):
+    previous, document = previous_run
+    document.write_text(DOCUMENT.replace("CHAPTER II", NEW_ARTICLE + "CHAPTER II"), encoding="utf-8")
+    updated = previous.parent / "updated"
+    update_analysis(str(document), str(previous), "key", str(updated), client=FakeClient(reply))
+    client = FakeClient(reply)
+
+    result = analyze_document(str(document), "key", str(updated), max_passes=1, client=client, resume=True)
+
+    assert client.requests == []
+    assert "h6" in result["sections"]
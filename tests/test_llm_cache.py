@@ -0,0 +1,96 @@
+import sqlite3
+
+import pytest
+
+from conftest import FakeClient
+from src import llm_cache
+from src.llm import chat_completion
+from src.llm_cache import CACHE_FILE, ResponseCache, closing, open_cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable stand-in for time.time in the cache module."""
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_keys_cover_every_request_parameter():
+    key = ResponseCache.make_key(model="m", messages=[{"content": "a"}], temperature=0)
+
+    assert key == ResponseCache.make_key(temperature=0, messages=[{"content": "a"}], model="m")
+    assert key != ResponseCache.make_key(model="m", messages=[{"content": "a"}], temperature=1)
+
+
+def test_entries_persist_across_instances(tmp_path):
+    with ResponseCache(tmp_path / "cache.sqlite3") as cache:
+        cache.put("k", "reply")
+
+    with ResponseCache(tmp_path / "cache.sqlite3") as cache:
+        assert cache.get("k") == "reply"
+        assert cache.get("missing") is None
+
+
+def test_least_recently_used_entries_are_evicted_first(tmp_path, clock):
+    cache = ResponseCache(tmp_path / "cache.sqlite3", max_bytes=10)
+    cache.put("a", "aaaa")
+    clock[0] += 1
+    cache.put("b", "bbbb")
+    clock[0] += 1
+    assert cache.get("a") == "aaaa"
+    clock[0] += 1
+
+    cache.put("c", "cccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa"
+    assert cache.get("c") == "cccc"
+    cache.close()
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = ResponseCache(tmp_path / "cache.sqlite3", ttl=60)
+    cache.put("old", "reply")
+    clock[0] += 30
+    cache.put("new", "reply")
+    clock[0] += 31
+
+    assert cache.get("old") is None
+    assert cache.get("new") == "reply"
+
+    clock[0] += 60
+    cache.put("newest", "reply")
+    assert cache._db.execute("SELECT key FROM responses").fetchall() == [("newest",)]
+    cache.close()
+
+
+def test_entries_without_ttl_never_expire(tmp_path, clock):
+    cache = ResponseCache(tmp_path / "cache.sqlite3", ttl=None)
+    cache.put("k", "reply")
+    clock[0] += 10 ** 9
+
+    assert cache.get("k") == "reply"
+    cache.close()
+
+
+def test_open_cache_and_closing(tmp_path):
+    assert open_cache(None) is None
+    with closing(open_cache(None)) as cache:
+        assert cache is None
+
+    with closing(open_cache(tmp_path)) as cache:
+        assert cache.path == tmp_path / CACHE_FILE
+    with pytest.raises(sqlite3.ProgrammingError):
+        cache.get("k")
+
+
+def test_identical_requests_are_answered_from_the_cache(tmp_path):
+    client = FakeClient(lambda params: "reply")
+    with ResponseCache(tmp_path / "cache.sqlite3") as cache:
+        first = chat_completion(client, cache, model="m", messages=[{"role": "user", "content": "q"}])
+        second = chat_completion(client, cache, model="m", messages=[{"role": "user", "content": "q"}])
+        chat_completion(client, cache, model="m", messages=[{"role": "user", "content": "other"}])
+
+    assert first == second == "reply"
+    assert len(client.requests) == 2
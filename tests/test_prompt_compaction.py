@@ -0,0 +1,61 @@
+import json
+import re
+
+from conftest import FakeClient
+from src.cross_reference_analyzer import find_shard_refs
+from src.prompt_compaction import (compact_tagged_text, compact_toc, normalize_whitespace, restore_ref_ids,
+                                   section_ids)
+from src.section_index import TAG_RE
+from src.section_tagger import locate_sections, render_tagged_text
+
+
+TOC = '# CHAPTER I {#h1}\n"General provisions"\n## Article 1 {#h2}\n"Subject-matter and objectives"\n# CHAPTER II {#h3}'
+TAGGED = ("[START SECTION h1: CHAPTER I] General  provisions\n\n\n[START SECTION h2: Article 1] Subject-matter"
+          " [END SECTION h2: Article 1] [END SECTION h1: CHAPTER I] [START SECTION h3: CHAPTER II] Principles"
+          " [END SECTION h3: CHAPTER II]")
+
+
+def test_tags_become_short_markers_with_the_same_ids():
+    compact = compact_tagged_text(TAGGED)
+
+    assert compact == "⟦h1⟧ General provisions\n⟦h2⟧ Subject-matter ⟦/h2⟧ ⟦/h1⟧ ⟦h3⟧ Principles ⟦/h3⟧"
+    assert section_ids(TAGGED) == ["h1", "h2", "h3"]
+
+
+def test_compact_toc_keeps_only_anchored_headings():
+    assert compact_toc(TOC) == "# CHAPTER I {#h1}\n## Article 1 {#h2}\n# CHAPTER II {#h3}"
+
+
+def test_whitespace_is_normalized():
+    assert normalize_whitespace("  a \t b c \n\n \n d  ") == "a b c\nd"
+
+
+def test_compact_text_keeps_every_section_of_the_eu_document(eu_text, eu_toc_ids):
+    tagged = render_tagged_text(eu_text, locate_sections(eu_toc_ids, eu_text))
+
+    compact = compact_tagged_text(tagged)
+
+    assert section_ids(tagged) == [m.group(1) for m in re.finditer(r'⟦(h\d+|auto-[a-z]+)⟧', compact)]
+    assert not TAG_RE.search(compact)
+    assert len(compact) < len(tagged)
+
+
+def test_restored_ids_round_trip():
+    valid = section_ids(TAGGED)
+    refs = [{"from": "⟦h1⟧", "to": ["#h2", "{#h3}", "h9", "⟦/h2⟧"]},
+            {"from": "h9", "to": ["h1"]},
+            {"from": " h3 ", "to": []},
+            "h2"]
+
+    assert restore_ref_ids(refs, valid) == [{"from": "h1", "to": ["h2", "h3", "h2"]}, {"from": "h3", "to": []}]
+    assert restore_ref_ids(restore_ref_ids(refs, valid), valid) == restore_ref_ids(refs, valid)
+
+
+def test_compact_prompts_send_markers_and_restore_reply_ids():
+    client = FakeClient(lambda params: json.dumps({"refs": [{"from": "⟦h2⟧", "to": ["⟦h3⟧", "h7"]}]}))
+
+    refs = find_shard_refs(TOC, TAGGED, client, compact=True)
+
+    assert refs == [{"from": "h2", "to": ["h3"]}]
+    prompt = "".join(message["content"] for message in client.requests[0]["messages"])
+    assert "⟦h2⟧" in prompt and "[START SECTION" not in prompt and "Subject-matter and objectives" not in prompt
@@ -0,0 +1,94 @@
+from src.cross_reference_analyzer import parse_toc_md
+from src.numbering import normalize_number, roman_to_int
+from src.reference_extractor import (REFERENCE_RE, expand_numbers, find_local_refs, index_toc_units, is_heading_line,
+                                     resolve_unit)
+from src.section_tagger import locate_sections
+
+
+TOC = (
+    "# CHAPTER I {#h1}\n## Section 1 {#h2}\n### Article 1 {#h3}\n### Article 2 {#h4}\n"
+    "## Section 2 {#h5}\n### Article 3 {#h6}\n"
+    "# CHAPTER II {#h7}\n## Section 1 {#h8}\n### Article 4 {#h9}\n## Section 2 {#h10}\n### Article 5 {#h11}\n"
+)
+DOCUMENT = (
+    "CHAPTER I\n"
+    "Section 1\n"
+    "Article 1\nThis applies as laid down in Article 3(1)(a) and in Chapter II.\n"
+    "Article 2\nArticles 3 to 5 apply, but not Article 16 TFEU or Article 8 of the Charter.\n"
+    "Section 2\n"
+    "Article 3\nSee Section 1 and Article 9 of this Regulation.\n"
+    "CHAPTER II\n"
+    "Section 1\n"
+    "Article 4\nThe rest is in Section 2; Articles 1, 2 and 4 stay in force.\n"
+    "Section 2\n"
+    "Article 5\nNothing here refers to Article 2 of Directive 95/46/EC.\n"
+)
+
+
+def refs_by_section(refs):
+    return {ref["from"]: ref["to"] for ref in refs}
+
+
+def test_roman_and_arabic_numbers_normalize_alike():
+    assert [roman_to_int(numeral) for numeral in ["I", "IV", "IX", "XIV", "XL", "MCMXC"]] == [1, 4, 9, 14, 40, 1990]
+    assert normalize_number("III") == normalize_number("3") == "3"
+    assert normalize_number("6A") == "6a"
+    assert normalize_number("2.01") == "2.01"
+
+
+def test_reference_patterns():
+    found = [(m.group('kind'), m.group('numbers')) for m in REFERENCE_RE.finditer(
+        "under Article 6(1)(a), Articles 13 and 14, Chapter III, Section 2.01, Art. 5 and Annexes I or II; "
+        "article iv is prose")]
+
+    assert found == [("Article", "6(1)(a)"), ("Articles", "13 and 14"), ("Chapter", "III"),
+                     ("Section", "2.01"), ("Art.", "5"), ("Annexes", "I or II")]
+
+
+def test_number_lists_and_ranges_expand():
+    assert expand_numbers("13 and 14") == ["13", "14"]
+    assert expand_numbers("12 to 15") == ["12", "13", "14", "15"]
+    assert expand_numbers("6(1)(a), 7 or 9") == ["6", "7", "9"]
+    assert expand_numbers("II to IV") == ["2", "3", "4"]
+    assert expand_numbers("1 to 100000") == ["1", "100000"]
+
+
+def test_references_alone_on_their_line_are_headings():
+    text = "Intro\n  Article 5 \nSee Article 5.\nArticle 6(1) applies.\n"
+
+    assert [is_heading_line(text, match) for match in REFERENCE_RE.finditer(text)] == [True, False, False]
+
+
+def test_toc_units_resolve_roman_titles_and_repeated_numbers():
+    toc_map = parse_toc_md(TOC)
+    units = index_toc_units(toc_map)
+
+    assert units[("chapter", "2")] == ["h7"]
+    assert units[("section", "1")] == ["h2", "h8"]
+    assert units[("article", "5")] == ["h11"]
+
+
+def test_repeated_units_resolve_to_the_nearest_one():
+    ancestors = {"h3": ["h2", "h1"], "h6": ["h5", "h1"], "h9": ["h8", "h7"], "h2": ["h1"], "h5": ["h1"],
+                 "h8": ["h7"], "h10": ["h7"], "h1": [], "h7": []}
+
+    assert resolve_unit(["h2", "h8"], "h6", ancestors) == "h2"
+    assert resolve_unit(["h5", "h10"], "h9", ancestors) == "h10"
+    assert resolve_unit(["h2", "h8"], "h1", ancestors) == "h2"
+    assert resolve_unit(["h2", "h8"], "unknown", ancestors) is None
+    assert resolve_unit([], "h3", ancestors) is None
+
+
+def test_local_refs_skip_headings_and_other_instruments():
+    index = locate_sections(TOC, DOCUMENT)
+
+    refs, unresolved = find_local_refs(parse_toc_md(TOC), index)
+
+    assert refs_by_section(refs) == {
+        "h3": ["h6", "h7"],
+        "h4": ["h6", "h9", "h11"],
+        "h6": ["h2"],
+        "h9": ["h10", "h3", "h4"],
+    }
+    # "Article 9 of this Regulation" names an article the TOC does not have
+    assert unresolved == ["h6"]
@@ -0,0 +1,192 @@
+import threading
+import time
+from email.utils import formatdate
+from types import SimpleNamespace
+
+import pytest
+from openai import APIStatusError
+
+from src.scheduler import RequestScheduler, estimate_tokens, is_retryable, retry_after
+
+
+def status_error(status, headers=None):
+    """An APIStatusError with a status code and response headers, without an HTTP response behind it."""
+    error = APIStatusError.__new__(APIStatusError)
+    error.status_code = status
+    error.response = SimpleNamespace(headers=headers or {})
+    return error
+
+
+def failing(errors, result="ok"):
+    """A create function raising the given errors in turn, then returning result."""
+    errors = list(errors)
+    attempts = []
+
+    def create(**params):
+        attempts.append(params)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    create.attempts = attempts
+    return create
+
+
+def test_estimate_tokens_counts_prompt_chars_and_completion_allowance():
+    params = {"messages": [{"content": "x" * 400}, {"content": None}], "max_tokens": 50}
+
+    assert estimate_tokens(params) == 150
+
+
+def test_retry_after_reads_milliseconds_seconds_and_dates():
+    assert retry_after(status_error(429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after(status_error(429, {"retry-after": "7"})) == 7.0
+    assert 8 <= retry_after(status_error(429, {"retry-after": formatdate(time.time() + 10, usegmt=True)})) <= 10
+    assert retry_after(status_error(429)) is None
+    assert retry_after(ValueError()) is None
+
+
+def test_retryable_errors():
+    assert is_retryable(status_error(429))
+    assert is_retryable(status_error(503))
+    assert is_retryable(status_error(408))
+    assert not is_retryable(status_error(400))
+    assert not is_retryable(ValueError())
+
+
+def test_transient_failures_are_retried():
+    scheduler = RequestScheduler(base_delay=0.001)
+    create = failing([status_error(500), status_error(429)])
+
+    result, wall_s = scheduler.call(create, messages=[])
+
+    assert result == "ok"
+    assert len(create.attempts) == 3
+    assert scheduler.retries == 2
+    assert scheduler._in_flight == 0
+
+
+def test_retry_waits_at_least_retry_after():
+    scheduler = RequestScheduler(base_delay=0.001)
+    create = failing([status_error(503, {"retry-after-ms": "200"})])
+
+    start = time.monotonic()
+    scheduler.call(create, messages=[])
+
+    assert time.monotonic() - start >= 0.2
+
+
+def test_permanent_failures_are_raised_at_once():
+    scheduler = RequestScheduler(base_delay=0.001)
+    create = failing([status_error(400)])
+
+    with pytest.raises(APIStatusError):
+        scheduler.call(create, messages=[])
+    assert len(create.attempts) == 1
+    assert scheduler._in_flight == 0
+
+
+def test_retries_give_up_after_max_retries():
+    scheduler = RequestScheduler(max_retries=2, base_delay=0.001)
+    create = failing([status_error(500)] * 5)
+
+    with pytest.raises(APIStatusError):
+        scheduler.call(create, messages=[])
+    assert len(create.attempts) == 3
+
+
+def test_wall_time_covers_only_the_successful_attempt():
+    scheduler = RequestScheduler(base_delay=0.001)
+    errors = [status_error(503, {"retry-after-ms": "200"})]
+
+    def create(**params):
+        if errors:
+            raise errors.pop()
+        time.sleep(0.02)
+        return "ok"
+
+    _, wall_s = scheduler.call(create, messages=[])
+
+    assert 0.02 <= wall_s < 0.2
+
+
+def test_max_concurrent_bounds_requests_in_flight():
+    scheduler = RequestScheduler(max_concurrent=2)
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def create(**params):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        return "ok"
+
+    threads = [threading.Thread(target=scheduler.call, args=(create,), kwargs={"messages": []}) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert in_flight[1] == 2
+
+
+def test_admitted_request_holds_its_slot_until_the_block_ends():
+    scheduler = RequestScheduler(max_concurrent=1)
+    started = threading.Event()
+
+    with scheduler.admitted(lambda **params: "stream", messages=[]) as (stream, _):
+        thread = threading.Thread(target=scheduler.call, args=(lambda **params: started.set(),))
+        thread.start()
+        time.sleep(0.05)
+        assert stream == "stream"
+        assert not started.is_set()
+    thread.join(1)
+
+    assert started.is_set()
+    assert scheduler._in_flight == 0
+
+
+def test_token_budget_delays_requests_beyond_it():
+    scheduler = RequestScheduler(tokens_per_minute=600)
+    scheduler.call(lambda **params: "ok", messages=[], max_tokens=600)
+
+    start = time.monotonic()
+    scheduler.call(lambda **params: "ok", messages=[], max_tokens=3)
+
+    # The budget refills at 10 tokens per second
+    assert 0.2 <= time.monotonic() - start < 1.0
+
+
+def test_request_budget_delays_requests_beyond_it():
+    scheduler = RequestScheduler(requests_per_minute=120)
+    for _ in range(120):
+        scheduler.call(lambda **params: "ok", messages=[])
+
+    start = time.monotonic()
+    scheduler.call(lambda **params: "ok", messages=[])
+
+    # The budget refills at 2 requests per second
+    assert 0.4 <= time.monotonic() - start < 1.0
+
+
+def test_waiting_requests_are_admitted_shortest_first():
+    scheduler = RequestScheduler(max_concurrent=1)
+    order = []
+
+    def request(name, max_tokens):
+        scheduler.call(lambda **params: order.append(name), messages=[], max_tokens=max_tokens)
+
+    with scheduler.admitted(lambda **params: None, messages=[]):
+        large = threading.Thread(target=request, args=("large", 1000))
+        large.start()
+        time.sleep(0.05)
+        small = threading.Thread(target=request, args=("small", 10))
+        small.start()
+        time.sleep(0.05)
+    large.join(1)
+    small.join(1)
+
+    assert order == ["small", "large"]
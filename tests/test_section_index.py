@@ -0,0 +1,48 @@
+import json
+
+from src.section_index import SectionIndex, SectionSpan
+from src.section_tagger import locate_sections, render_tagged_text
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+def test_tagged_text_round_trip_keeps_sections(eu_text, eu_toc_ids):
+    located = locate_sections(eu_toc_ids, eu_text, monotonic=True)
+
+    rebuilt = SectionIndex.from_tagged_text(render_tagged_text(eu_text, located))
+
+    assert [(span.id, span.parent) for span in rebuilt] == [(span.id, span.parent) for span in located]
+    for span in located:
+        assert normalize(rebuilt.text(span.id)) == normalize(located.text(span.id)), span.id
+
+
+def test_levels_come_from_nesting_depth():
+    tagged = ("[START SECTION h1: A] a [START SECTION h2: A.1] b [START SECTION h3: A.1.a] c"
+              " [END SECTION h3: A.1.a] [END SECTION h2: A.1] [END SECTION h1: A]")
+
+    index = SectionIndex.from_tagged_text(tagged)
+
+    assert [(span.id, span.level, span.parent) for span in index] == [("h1", 1, None), ("h2", 2, "h1"),
+                                                                      ("h3", 3, "h2")]
+    assert index.own_text("h1") == "a"
+    assert index.text("h3") == "c"
+
+
+def test_unclosed_sections_run_to_the_end():
+    index = SectionIndex.from_tagged_text("[START SECTION h1: A] a [START SECTION h2: B] b")
+
+    assert index.get("h1").end == index.get("h2").end == len(index.source)
+
+
+def test_records_round_trip_through_json():
+    source = "Intro. Part one. Part two."
+    index = SectionIndex(source, [SectionSpan("h1", "A", 1, 0, len(source)),
+                                  SectionSpan("h2", "A.1", 2, 7, 16, "h1")])
+
+    rebuilt = SectionIndex.from_records(source, json.loads(json.dumps(index.to_records())))
+
+    assert rebuilt.to_records() == index.to_records()
+    assert rebuilt.text("h2") == "Part one."
+    assert "h2" in rebuilt and "h3" not in rebuilt
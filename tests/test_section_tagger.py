@@ -0,0 +1,126 @@
+import re
+from typing import Optional
+
+from src.section_index import SectionIndex, SectionSpan
+from src.section_tagger import (HeaderLocator, find_header_directly, locate_sections, parse_markdown_structure,
+                                render_tagged_text)
+
+
+def regex_find_header(raw_text: str, header_text: str, start_pos: int = 0) -> Optional[int]:
+    """find_header_directly as it was before HeaderLocator: one regex search per variation and context."""
+    if not header_text:
+        return None
+
+    header_variations = [
+        header_text,
+        header_text.upper(),
+        header_text.lower(),
+        header_text.title(),
+    ]
+
+    for variation in header_variations:
+        escaped_header = re.escape(variation)
+
+        pattern = r'(?:^|\n)\s*' + escaped_header + r'(?:\s*$|\s+[A-Z]|\s*\n)'
+        match = re.search(pattern, raw_text[start_pos:], re.IGNORECASE | re.MULTILINE)
+        if match:
+            header_pos_in_match = match.group().lower().find(variation.lower())
+            if header_pos_in_match >= 0:
+                return start_pos + match.start() + header_pos_in_match
+
+        header_context_patterns = [
+            r'(?:^|\n)\s*' + escaped_header + r'\s+[0-9]+(?:\.[0-9]+)*(?:\s|$|\n)',
+            r'(?:^|\n)\s*' + escaped_header + r'\s*[:\-]',
+            r'(?:^|\n)\s*' + escaped_header.upper() + r'(?:\s*$|\s*\n)',
+        ]
+
+        for context_pattern in header_context_patterns:
+            match = re.search(context_pattern, raw_text[start_pos:], re.IGNORECASE | re.MULTILINE)
+            if match:
+                header_pos_in_match = match.group().lower().find(variation.lower())
+                if header_pos_in_match >= 0:
+                    return start_pos + match.start() + header_pos_in_match
+
+    return None
+
+
+def test_header_locator_matches_regex_search(eu_text, eu_toc_ids):
+    titles = [section['title'] for section in parse_markdown_structure(eu_toc_ids)]
+    titles += ["Section", "Recital", "CHAPTER", "Article 99 Entry into force", "not a heading anywhere"]
+    locator = HeaderLocator(eu_text, titles)
+
+    for title in titles:
+        for start_pos in (0, len(eu_text) // 3, 2 * len(eu_text) // 3):
+            assert locator.find(title, start_pos) == regex_find_header(eu_text, title, start_pos), title
+
+
+def test_find_header_directly_without_locator():
+    text = "Preamble\n  Article 5: Scope\nSee Article 5.\nArticle 5 - Definitions"
+
+    assert find_header_directly(text, "article 5") == text.index("Article 5")
+    assert find_header_directly(text, "Article 5", start_pos=12) == text.rindex("Article 5")
+    assert find_header_directly(text, "Scope") is None
+    assert find_header_directly(text, "Article 5", end_pos=10) is None
+    assert find_header_directly(text, "") is None
+
+
+CHAPTERS = (
+    "Chapter 1\nSection 1\nRules about the first chapter.\nSection 2\nMore rules.\n"
+    "Chapter 2\nSection 1\nRules about the second chapter.\nSection 2\nLast rules.\n"
+)
+CHAPTERS_TOC = (
+    "# Chapter 1 {#h1}\n## Section 1 {#h2}\n## Section 2 {#h3}\n"
+    "# Chapter 2 {#h4}\n## Section 1 {#h5}\n## Section 2 {#h6}\n"
+)
+
+
+def test_monotonic_tagging_places_repeated_headings_in_order():
+    index = locate_sections(CHAPTERS_TOC, CHAPTERS)
+
+    assert [span.id for span in index] == ["h1", "h2", "h3", "h4", "h5", "h6"]
+    assert [span.parent for span in index] == [None, "h1", "h1", None, "h4", "h4"]
+    assert index.text("h5").startswith("Section 1\nRules about the second chapter.")
+    assert index.text("h4").endswith("Last rules.")
+
+
+def test_independent_tagging_finds_repeated_headings_from_the_top():
+    index = locate_sections(CHAPTERS_TOC, CHAPTERS, monotonic=False)
+
+    assert index.get("h5").start == index.get("h2").start
+
+
+def test_monotonic_tagging_places_every_eu_section(eu_text, eu_toc_ids):
+    index = locate_sections(eu_toc_ids, eu_text)
+
+    assert all(section['id'] in index for section in parse_markdown_structure(eu_toc_ids))
+    assert all(span.start <= child.start and child.end <= span.end
+               for span in index for child in index if child.parent == span.id)
+
+
+def test_sections_are_never_placed_before_earlier_toc_entries():
+    # Section 2 is listed after chapter 2 in the TOC, so it is taken to be chapter 2's
+    toc = "# Chapter 1 {#h1}\n## Section 1 {#h2}\n# Chapter 2 {#h4}\n## Section 1 {#h5}\n## Section 2 {#h3}\n"
+
+    index = locate_sections(toc, CHAPTERS)
+
+    assert [span.start for span in index] == sorted(span.start for span in index)
+    assert index.get("h3").start == CHAPTERS.rindex("Section 2")
+
+
+def test_tags_nest_at_shared_offsets():
+    text = "Title body"
+    spans = [SectionSpan("h1", "A", 1, 0, len(text)), SectionSpan("h2", "A.1", 2, 0, len(text), "h1"),
+             SectionSpan("h3", "Empty", 1, len(text), len(text))]
+
+    tagged = render_tagged_text(text, spans)
+
+    assert tagged == ("[START SECTION h1: A] [START SECTION h2: A.1] Title body [END SECTION h2: A.1]"
+                      " [END SECTION h1: A][START SECTION h3: Empty]  [END SECTION h3: Empty]")
+    assert [(span.id, span.parent) for span in SectionIndex.from_tagged_text(tagged)] == [
+        ("h1", None), ("h2", "h1"), ("h3", None)]
+
+
+def test_stripping_the_tags_gives_back_the_text(eu_text, eu_toc_ids):
+    tagged = render_tagged_text(eu_text, locate_sections(eu_toc_ids, eu_text))
+
+    assert re.sub(r'\[START SECTION [^\]]+\] | \[END SECTION [^\]]+\]', '', tagged) == eu_text
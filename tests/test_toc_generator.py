@@ -0,0 +1,123 @@
+import json
+
+from conftest import FakeClient
+from src.toc_generator import (MAX_STRAY_CHARS, TocStreamParser, apply_toc_insertions, entry_lines,
+                               get_next_level_toc_delta, parse_toc_entries)
+
+
+DOC = (
+    "Preamble of the agreement between the parties.\n\n"
+    "Article 1\nDefinitions\nIn this agreement the following words have the meanings given to them below.\n\n"
+    "Article 2\nTerm\nThis agreement starts on the signing date and runs for three full years.\n\n"
+    "Article 3\nPayment\nThe buyer pays every invoice within thirty days of receiving it.\n"
+)
+
+REPLY = (
+    "# Article 1\n\"In this agreement the following words have\"\n"
+    "# Article 2\n\"This agreement starts on the signing date\"\n"
+    "# Article 3\n\"The buyer pays every invoice within thirty\"\n"
+)
+
+
+def feed_in_pieces(parser, text, size=7):
+    completed = []
+    for i in range(0, len(text), size):
+        completed.extend(parser.feed(text[i:i + size]))
+    return completed + parser.finish()
+
+
+def test_stream_parser_completes_entries_at_their_headings():
+    parser = TocStreamParser(DOC)
+    entries = feed_in_pieces(parser, REPLY)
+
+    assert [entry['title'] for entry in entries] == ["Article 1", "Article 2", "Article 3"]
+    assert [entry['pos'] for entry in entries] == [DOC.index("Article 1"), DOC.index("Article 2"),
+                                                   DOC.index("Article 3")]
+    assert parser.text == REPLY
+    assert entry_lines(parser.entries) == REPLY.strip()
+    assert not parser.copying
+
+
+def test_stream_parser_completes_entry_without_snippet_at_next_heading():
+    parser = TocStreamParser(DOC)
+    completed = parser.feed("# Article 1\n# Article 2\n")
+
+    assert [entry['title'] for entry in completed] == ["Article 1"]
+    assert completed[0]['pos'] is None
+    assert [entry['title'] for entry in parser.finish()] == ["Article 2"]
+
+
+def test_stream_parser_leaves_short_and_unknown_snippets_unplaced():
+    parser = TocStreamParser(DOC)
+    entries = feed_in_pieces(parser, "# Article 2\n\"Term\"\n# Annex\n\"words that appear nowhere in the text\"\n")
+
+    assert [entry['pos'] for entry in entries] == [None, None]
+
+
+def test_stream_parser_flags_copied_document_text():
+    parser = TocStreamParser(DOC)
+    parser.feed("# Article 1\n")
+    parser.feed(("The document copied out line by line. " * 10 + "\n") * (MAX_STRAY_CHARS // 380 + 1))
+
+    assert parser.copying
+
+
+def test_stream_parser_flags_one_overlong_line():
+    parser = TocStreamParser(DOC)
+    parser.feed("x" * (MAX_STRAY_CHARS + 1))
+
+    assert parser.copying
+
+
+TOC = "# A\n\"alpha\"\n## A.1\n\"alpha one\"\n# B\n\"beta\""
+
+
+def test_insertions_go_after_parent_subtree_one_level_down():
+    entries = parse_toc_entries(TOC)
+    result = apply_toc_insertions(entries, [
+        {"parent": "t0", "title": "A.2", "level": 5, "snippet": "alpha two"},
+        {"parent": "#t2", "title": "B.1"},
+        {"parent": "t0", "title": "A.3"},
+    ])
+
+    assert [(entry['level'], entry['title']) for entry in result] == [
+        (1, "A"), (2, "A.1"), (2, "A.2"), (2, "A.3"), (1, "B"), (2, "B.1")]
+    assert result[2]['snippet'] == "alpha two"
+
+
+def test_insertions_that_cannot_apply_are_dropped():
+    entries = parse_toc_entries(TOC)
+    result = apply_toc_insertions(entries, [
+        {"parent": "t9", "title": "Unknown parent"},
+        {"parent": "h1", "title": "Not a TOC index"},
+        {"parent": "t0", "title": "A.1"},
+        {"parent": "t0", "title": ""},
+        ["t0", "List"],
+        "t0",
+        None,
+    ])
+
+    assert result == entries
+
+
+def test_deeper_parent_children_come_first_at_shared_end():
+    entries = parse_toc_entries(TOC)
+    result = apply_toc_insertions(entries, [{"parent": "t0", "title": "A.2"},
+                                            {"parent": "t1", "title": "A.1.a"}])
+
+    assert [entry['title'] for entry in result] == ["A", "A.1", "A.1.a", "A.2", "B"]
+
+
+def test_delta_pass_falls_back_to_full_pass_on_unusable_reply():
+    full_toc = TOC + "\n## B.1\n\"beta one\""
+
+    for reply in ["[]", "\"insertions\"", "{\"insertions\": 5}", "not json"]:
+        client = FakeClient(lambda params: reply if params.get("response_format") else full_toc)
+        assert get_next_level_toc_delta("document", TOC, client, 2) == full_toc
+        assert len(client.requests) == 2
+
+
+def test_delta_pass_applies_insertions():
+    client = FakeClient(lambda params: json.dumps({"insertions": [{"parent": "t2", "title": "B.1"}]}))
+
+    assert get_next_level_toc_delta("document", TOC, client, 2).splitlines()[-1] == "## B.1"
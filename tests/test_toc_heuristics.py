@@ -0,0 +1,109 @@
+import json
+
+from conftest import FakeClient
+from src.toc_generator import bootstrap_toc, parse_toc_entries
+from src.toc_heuristics import detect_headings, infer_scheme_levels, nest_heading_levels
+
+
+CONTRACT = (
+    "ARTICLE I\nDefinitions\nThe words below have these meanings.\n"
+    "Section 1.01 Agreement. This agreement between the parties.\n"
+    "Section 1.02 Party. Either of the parties.\n"
+    "ARTICLE II\nTerm\nThe term of the agreement.\n"
+    "Section 2.01 Start. It starts on signing.\n"
+)
+
+REGULATION = (
+    "CHAPTER I\nGeneral provisions\n"
+    "Article 1\nSubject-matter\nThis Regulation lays down rules.\n"
+    "Article 2\nScope\nThis Regulation applies to processing.\n"
+    "CHAPTER II\nRights\n"
+    "Section 1\nTransparency\n"
+    "Article 3\nInformation\nThe controller shall inform.\n"
+    "Section 2\nAccess\n"
+    "Article 4\nRight of access\nThe data subject may ask.\n"
+)
+
+
+def schemes_and_titles(headings):
+    return [(heading['scheme'], heading['title']) for heading in headings]
+
+
+def test_detect_headings_finds_keyword_and_dotted_headings():
+    headings = detect_headings(CONTRACT)
+
+    assert schemes_and_titles(headings) == [
+        ("article", "ARTICLE I"), ("section", "Section 1.01"), ("section", "Section 1.02"),
+        ("article", "ARTICLE II"), ("section", "Section 2.01")]
+    assert [heading['number'] for heading in headings] == ["1", "1.01", "1.02", "2", "2.01"]
+    assert headings[0]['snippet'] == ("Definitions The words below have these meanings. Section 1.01 Agreement. "
+                                      "This agreement between the")
+
+
+def test_points_and_one_off_words_are_not_headings():
+    text = "Rule 14\nSome prose.\n(a) first point\n(b) second point\nArticle 1\nText.\n"
+
+    assert schemes_and_titles(detect_headings(text)) == [("article", "Article 1")]
+    assert [h['scheme'] for h in detect_headings(text, include_points=True)] == ["point", "point", "article"]
+
+
+def test_dotted_numbers_go_below_the_scheme_they_extend():
+    # Sections numbered 1.01 under ARTICLE I rank below articles, against the usual legal order
+    assert infer_scheme_levels(detect_headings(CONTRACT)) == {"article": 1, "section": 2}
+
+
+def test_known_kinds_follow_the_legal_hierarchy():
+    assert infer_scheme_levels(detect_headings(REGULATION)) == {"chapter": 1, "section": 2, "article": 3}
+
+
+def test_decimal_numbering_alone_ranks_by_depth():
+    text = "1.1 Deliverables\nText.\n1.1.1 Reports\nText.\n1.1.2 Reviews\nText.\n2.1 Payment terms\nText.\n"
+
+    assert infer_scheme_levels(detect_headings(text)) == {"decimal2": 1, "decimal3": 2}
+
+
+def test_unknown_kinds_are_left_open():
+    text = "Article 1\nText.\nSchedule 1\nText.\nRule 1\nText.\nRule 2\nText.\n"
+
+    assert infer_scheme_levels(detect_headings(text)) == {"article": 2, "schedule": 1, "rule": None}
+
+
+def test_levels_follow_how_headings_nest():
+    headings = detect_headings(REGULATION)
+    levels = infer_scheme_levels(headings)
+
+    # Articles of chapter I sit right under the chapter, those of chapter II under its sections
+    assert nest_heading_levels(headings, levels) == [1, 2, 2, 1, 2, 3, 2, 3]
+
+
+def test_headings_before_any_outer_heading_start_at_the_top():
+    headings = [{'scheme': 'article'}, {'scheme': 'chapter'}, {'scheme': 'article'}, {'scheme': 'article'}]
+
+    assert nest_heading_levels(headings, {'chapter': 1, 'article': 3}) == [1, 1, 2, 2]
+
+
+def test_bootstrap_toc_needs_no_llm_for_known_schemes():
+    client = FakeClient(lambda params: "{}")
+
+    entries = parse_toc_entries(bootstrap_toc(REGULATION, client))
+
+    assert [(entry['level'], entry['title']) for entry in entries] == [
+        (1, "CHAPTER I"), (2, "Article 1"), (2, "Article 2"), (1, "CHAPTER II"),
+        (2, "Section 1"), (3, "Article 3"), (2, "Section 2"), (3, "Article 4")]
+    assert entries[1]['snippet'].startswith("Subject-matter This Regulation")
+    assert client.requests == []
+
+
+def test_bootstrap_toc_asks_once_for_unknown_schemes():
+    text = "Article 1\nText.\nRule 1\nText.\nRule 2\nText.\nArticle 2\nText.\nRule 3\nText.\n"
+    client = FakeClient(lambda params: json.dumps({"levels": {"rule": 2}}))
+
+    entries = parse_toc_entries(bootstrap_toc(text, client))
+
+    assert [entry['level'] for entry in entries] == [1, 2, 2, 1, 2]
+    assert len(client.requests) == 1
+    assert "Text." not in client.requests[0]["messages"][-1]["content"]
+
+
+def test_bootstrap_toc_gives_up_without_numbering():
+    assert bootstrap_toc("Just a letter.\nWith no headings at all.\n", FakeClient(lambda params: "{}")) is None